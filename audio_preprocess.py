@@ -0,0 +1,178 @@
+import io
+import wave
+import numpy as np
+import constants as ct
+
+def read_wav(audio_data):
+    """
+    WAVデータ（bytes）をfloat32の配列に変換
+    Args:
+        audio_data: WAVファイルのバイト列
+    Returns:
+        (samples, sample_rate): samplesは (フレーム数, チャンネル数) の配列（-1.0〜1.0）
+    """
+
+    with wave.open(io.BytesIO(audio_data), 'rb') as wav_file:
+        channels = wav_file.getnchannels()
+        sample_width = wav_file.getsampwidth()
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    if sample_width == 1:
+        # 8bitは符号なし整数
+        samples = (np.frombuffer(frames, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sample_width == 2:
+        samples = np.frombuffer(frames, dtype='<i2').astype(np.float32) / 32768.0
+    elif sample_width == 3:
+        # 24bitは3バイトずつ取り出して符号付き32bitに拡張
+        raw = np.frombuffer(frames, dtype=np.uint8).reshape(-1, 3)
+        ints = (raw[:, 0].astype(np.int32) | (raw[:, 1].astype(np.int32) << 8) | (raw[:, 2].astype(np.int32) << 16))
+        ints = np.where(ints & 0x800000, ints - 0x1000000, ints)
+        samples = ints.astype(np.float32) / 8388608.0
+    elif sample_width == 4:
+        samples = np.frombuffer(frames, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f"未対応のサンプル幅です: {sample_width}")
+
+    return samples.reshape(-1, channels), sample_rate
+
+def to_mono(samples):
+    """
+    複数チャンネルの音声をモノラルにダウンミックス
+    """
+
+    if samples.ndim == 1:
+        return samples
+    return samples.mean(axis=1, dtype=np.float32)
+
+def resample(samples, orig_rate, target_rate):
+    """
+    モノラル音声を指定のサンプリングレートに変換
+    ダウンサンプリング時は折り返し雑音を防ぐためにローパスフィルタを先に適用
+    """
+
+    if orig_rate == target_rate or len(samples) == 0:
+        return samples
+
+    if target_rate < orig_rate:
+        # 窓関数付きsincによるローパスフィルタ（カットオフは変換後のナイキスト周波数）
+        cutoff = 0.5 * target_rate / orig_rate
+        taps = np.arange(-31, 32)
+        kernel = 2 * cutoff * np.sinc(2 * cutoff * taps) * np.hanning(len(taps))
+        kernel /= kernel.sum()
+        samples = np.convolve(samples, kernel.astype(np.float32), mode='same')
+
+    duration = len(samples) / orig_rate
+    target_length = int(round(duration * target_rate))
+    orig_times = np.arange(len(samples)) / orig_rate
+    target_times = np.arange(target_length) / target_rate
+    return np.interp(target_times, orig_times, samples).astype(np.float32)
+
+def frame_rms_db(samples, sample_rate, frame_ms=ct.VAD_FRAME_MS):
+    """
+    フレームごとのRMSをdBFSで計算
+    """
+
+    frame_length = max(1, int(sample_rate * frame_ms / 1000))
+    frame_count = len(samples) // frame_length
+    if frame_count == 0:
+        return np.empty(0, dtype=np.float32), frame_length
+    frames = samples[:frame_count * frame_length].reshape(frame_count, frame_length)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10)), frame_length
+
+def trim_silence(samples, sample_rate):
+    """
+    エネルギーベースの発話区間検出で前後の無音を除去
+    Returns:
+        発話区間の音声（発話が見つからない場合は空の配列）
+    """
+
+    levels, frame_length = frame_rms_db(samples, sample_rate)
+    if len(levels) == 0:
+        return samples[:0]
+
+    # 環境ノイズが大きい録音にも対応するため、最大音量からの相対閾値も考慮
+    threshold = max(ct.VAD_THRESHOLD_DB, float(levels.max()) - 35.0)
+    voiced = np.flatnonzero(levels >= threshold)
+    if len(voiced) == 0:
+        return samples[:0]
+
+    padding = int(sample_rate * ct.VAD_PADDING_MS / 1000)
+    start = max(0, voiced[0] * frame_length - padding)
+    end = min(len(samples), (voiced[-1] + 1) * frame_length + padding)
+    return samples[start:end]
+
+def encode_wav(samples, sample_rate):
+    """
+    float32のモノラル音声を16bit PCMのWAVデータ（bytes）に変換
+    """
+
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767).astype('<i2')
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm.tobytes())
+    return buffer.getvalue()
+
+def preprocess_for_transcription(audio_data):
+    """
+    文字起こし前の音声前処理（モノラル化・16kHz化・無音トリミング・無音判定）
+    Args:
+        audio_data: 録音されたWAVファイルのバイト列
+    Returns:
+        (processed_data, stats):
+            processed_data: 送信用のWAVデータ（無音と判定した場合はNone）
+            stats: 前処理前後のサイズ・長さなどの統計情報（WAVとして読めない場合はNone）
+    """
+
+    try:
+        samples, sample_rate = read_wav(audio_data)
+    except (wave.Error, EOFError, ValueError):
+        # WAV以外の形式はそのまま送信する
+        return audio_data, None
+
+    original_sec = len(samples) / sample_rate if sample_rate else 0.0
+    mono = resample(to_mono(samples), sample_rate, ct.TRANSCRIBE_SAMPLE_RATE)
+    speech = trim_silence(mono, ct.TRANSCRIBE_SAMPLE_RATE)
+
+    # 発話区間が見つからない場合は録音全体のRMSで判定する
+    measured = speech if len(speech) else mono
+    rms = float(np.sqrt(np.mean(measured * measured))) if len(measured) else 0.0
+    rms_db = 20 * np.log10(max(rms, 1e-10))
+    speech_sec = len(speech) / ct.TRANSCRIBE_SAMPLE_RATE
+    is_silent = rms_db < ct.SILENCE_RMS_DB or speech_sec * 1000 < ct.MIN_SPEECH_MS
+
+    processed_data = None if is_silent else encode_wav(speech, ct.TRANSCRIBE_SAMPLE_RATE)
+    stats = {
+        "original_bytes": len(audio_data),
+        "processed_bytes": len(processed_data) if processed_data else 0,
+        "original_sec": original_sec,
+        "processed_sec": 0.0 if is_silent else speech_sec,
+        "rms_db": rms_db,
+        "is_silent": is_silent,
+    }
+
+    return processed_data, stats
+
+def format_preprocess_stats(stats):
+    """
+    前処理による削減量をログ出力用の文字列に整形
+    """
+
+    if stats["is_silent"]:
+        return (
+            f"[音声前処理] 無音と判定したため送信を省略しました"
+            f"（{stats['original_bytes']} bytes, {stats['original_sec']:.2f}s, RMS {stats['rms_db']:.1f} dBFS）"
+        )
+
+    saved_bytes = stats["original_bytes"] - stats["processed_bytes"]
+    saved_ratio = saved_bytes / stats["original_bytes"] * 100 if stats["original_bytes"] else 0.0
+    return (
+        f"[音声前処理] 送信サイズ {stats['original_bytes']} → {stats['processed_bytes']} bytes"
+        f"（{saved_bytes} bytes / {saved_ratio:.1f}% 削減）, "
+        f"長さ {stats['original_sec']:.2f}s → {stats['processed_sec']:.2f}s"
+        f"（{stats['original_sec'] - stats['processed_sec']:.2f}s 削減）"
+    )
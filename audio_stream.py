@@ -0,0 +1,274 @@
+"""
+音声合成の結果を、生成されたそばからHTTPのチャンク転送でブラウザに送るストリーミング配信
+バックエンドサービス利用時は backend_server.py の /stream/<id> で、
+未使用時はこのモジュールが起動する小さな配信サーバーで配信する
+配信サーバーは、保存済みの音声ファイル（static_media.pyで配置したもの）も /media/<ファイル名> で配信する
+"""
+import os
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import constants as ct
+import rate_limiter
+import static_media
+import worker_pool
+
+RANGE_PATTERN = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+_streams = {}
+_streams_lock = threading.Lock()
+_server = None
+_server_lock = threading.Lock()
+
+class AudioStream:
+    """
+    生成中の音声データのバッファ（複数の読み手が先頭から順に読める）
+    """
+
+    def __init__(self):
+        self.format = None
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.created = time.time()
+        self.condition = threading.Condition()
+
+    def start(self, audio_format):
+        with self.condition:
+            self.format = audio_format
+            self.condition.notify_all()
+
+    def append(self, chunk):
+        with self.condition:
+            self.chunks.append(chunk)
+            self.condition.notify_all()
+
+    def finish(self, error=None):
+        with self.condition:
+            self.done = True
+            self.error = error
+            self.condition.notify_all()
+
+    def wait_started(self, timeout=ct.AUDIO_STREAM_TIMEOUT):
+        """
+        音声の形式が決まるまで待機（合成の開始前に失敗した場合は例外を送出）
+        """
+
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.format is not None or self.done, timeout):
+                raise TimeoutError("音声合成の開始を待つ間にタイムアウトしました")
+            if self.format is None:
+                raise self.error or RuntimeError("音声合成に失敗しました")
+            return self.format
+
+    def iter_chunks(self, timeout=ct.AUDIO_STREAM_TIMEOUT):
+        """
+        音声データを先頭から順に返す（未生成の部分は生成されるまで待機）
+        """
+
+        index = 0
+        while True:
+            with self.condition:
+                if not self.condition.wait_for(lambda: index < len(self.chunks) or self.done, timeout):
+                    raise TimeoutError("音声データを待つ間にタイムアウトしました")
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                elif self.error:
+                    raise self.error
+                else:
+                    return
+            index += 1
+            yield chunk
+
+    def content(self, timeout=ct.AUDIO_STREAM_TIMEOUT):
+        """
+        生成が終わるまで待ち、音声データ全体を返す
+        """
+
+        return b"".join(self.iter_chunks(timeout))
+
+def _produce(stream, backend, text):
+    audio_format, chunks = backend.synthesize_stream(text)
+    stream.start(audio_format)
+    for chunk in chunks:
+        stream.append(chunk)
+
+def _run_stream(stream, backend, text, model, reserved):
+    try:
+        rate_limiter.get_rate_limiter().call(model, _produce, args=(stream, backend, text), reserved=reserved)
+        stream.finish()
+    except Exception as e:
+        stream.finish(e)
+        return
+    # リクエストごとの転送量と所要時間をログに出力（バックエンドサービスで配信した場合も記録される）
+    size = sum(len(chunk) for chunk in stream.chunks)
+    print(f"[tts-stream] {stream.format}: {size / 1024:.1f}KB（{time.time() - stream.created:.2f}秒）")
+
+def start_stream(backend, text, model=None, reserved=False, tag=None):
+    """
+    音声合成を共有ワーカープールで開始し、ストリームIDを返す（合成の完了は待たない）
+    Args:
+        backend: 音声合成バックエンド
+        model: レート制限を適用するモデル名（ローカルの場合はNone）
+        reserved: 呼び出し元でレート制限の枠を予約済みの場合はTrue
+    Returns:
+        (stream_id, AudioStream)
+    """
+
+    stream = AudioStream()
+    stream_id = uuid.uuid4().hex
+    with _streams_lock:
+        now = time.time()
+        for expired_id in [key for key, value in _streams.items() if now - value.created > ct.AUDIO_STREAM_TTL]:
+            del _streams[expired_id]
+        _streams[stream_id] = stream
+    worker_pool.get_worker_pool().submit(
+        worker_pool.INTERACTIVE, _run_stream, stream, backend, text, model, reserved, tag=tag
+    )
+    return stream_id, stream
+
+def get_stream(stream_id):
+    with _streams_lock:
+        return _streams.get(stream_id)
+
+def write_stream_response(handler, stream_id):
+    """
+    ストリームの音声データをチャンク転送で送信（HTTP/1.1のハンドラから呼び出す）
+    """
+
+    stream = get_stream(stream_id)
+    if stream is None:
+        handler.send_error(404, "stream not found")
+        return
+    try:
+        audio_format = stream.wait_started()
+    except Exception as e:
+        handler.send_error(502, f"音声合成に失敗しました: {e}")
+        return
+
+    handler.send_response(200)
+    handler.send_header('Content-Type', ct.AUDIO_MIME_TYPES.get(audio_format, "application/octet-stream"))
+    handler.send_header('Transfer-Encoding', 'chunked')
+    handler.send_header('Cache-Control', 'no-store')
+    handler.send_header('Access-Control-Allow-Origin', '*')
+    handler.end_headers()
+    try:
+        for chunk in stream.iter_chunks():
+            handler.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+            handler.wfile.flush()
+        handler.wfile.write(b"0\r\n\r\n")
+    except Exception as e:
+        # 途中で失敗した場合は接続を閉じて終端を知らせる
+        print(f"Warning: 音声のストリーミング配信を中断しました: {e}")
+        handler.close_connection = True
+
+def _parse_range(header, size):
+    # Rangeヘッダー（単一の範囲のみ対応）を(開始, 終了)に変換（範囲外の場合はNone）
+    match = RANGE_PATTERN.match(header.strip())
+    if not match or match.group(1) == match.group(2) == "":
+        return None
+    if match.group(1) == "":
+        # "bytes=-N": 末尾のNバイト
+        start, end = max(size - int(match.group(2)), 0), size - 1
+    else:
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start > end or start >= size:
+        return None
+    return start, end
+
+def write_media_response(handler, file_name, head_only=False):
+    """
+    保存済みの音声ファイルを配信（音声のMIMEタイプ、Range指定への206応答、ETag・Cache-Controlを付与）
+    ファイル名に内容のハッシュを含むため、ETagはファイル名、キャッシュ期間は長くする
+    """
+
+    path = static_media.media_path(file_name)
+    if path is None or not os.path.isfile(path):
+        handler.send_error(404, "not found")
+        return
+    etag = f'"{os.path.splitext(file_name)[0]}"'
+    if handler.headers.get('If-None-Match') == etag:
+        handler.send_response(304)
+        handler.send_header('ETag', etag)
+        handler.send_header('Content-Length', '0')
+        handler.end_headers()
+        return
+
+    size = os.path.getsize(path)
+    start, end = 0, size - 1
+    status = 200
+    range_header = handler.headers.get('Range')
+    if range_header:
+        byte_range = _parse_range(range_header, size)
+        if byte_range is None:
+            handler.send_response(416)
+            handler.send_header('Content-Range', f"bytes */{size}")
+            handler.send_header('Content-Length', '0')
+            handler.end_headers()
+            return
+        (start, end), status = byte_range, 206
+
+    handler.send_response(status)
+    handler.send_header('Content-Type', ct.AUDIO_MIME_TYPES[os.path.splitext(file_name)[1].lstrip('.')])
+    handler.send_header('Content-Length', str(end - start + 1))
+    handler.send_header('Accept-Ranges', 'bytes')
+    if status == 206:
+        handler.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+    handler.send_header('ETag', etag)
+    handler.send_header('Cache-Control', f"public, max-age={ct.STATIC_MEDIA_MAX_AGE}, immutable")
+    handler.send_header('Access-Control-Allow-Origin', '*')
+    handler.end_headers()
+    if head_only:
+        return
+    with open(path, 'rb') as f:
+        f.seek(start)
+        handler.wfile.write(f.read(end - start + 1))
+
+class StreamRequestHandler(BaseHTTPRequestHandler):
+    """
+    /stream/<id> と /media/<ファイル名> を配信するハンドラ（バックエンド未使用時の配信サーバー用）
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        media_prefix = f"/{ct.STATIC_MEDIA_URL_PATH}/"
+        if path.startswith("/stream/"):
+            write_stream_response(self, path[len("/stream/"):])
+        elif path.startswith(media_prefix):
+            write_media_response(self, path[len(media_prefix):])
+        else:
+            self.send_error(404, "not found")
+
+    def do_HEAD(self):
+        path = self.path.split("?")[0]
+        media_prefix = f"/{ct.STATIC_MEDIA_URL_PATH}/"
+        if path.startswith(media_prefix):
+            write_media_response(self, path[len(media_prefix):], head_only=True)
+        else:
+            self.send_error(404, "not found")
+
+    def log_message(self, format, *args):
+        pass
+
+def ensure_stream_server(host=ct.AUDIO_STREAM_HOST, port=ct.AUDIO_STREAM_PORT):
+    """
+    配信サーバーをバックグラウンドのスレッドで起動（プロセスごとに一度だけ）
+    Returns:
+        起動に成功した場合はTrue
+    """
+
+    global _server
+    with _server_lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer((host, port), StreamRequestHandler)
+            except OSError as e:
+                print(f"Warning: 音声の配信サーバーを起動できませんでした: {e}")
+                return False
+            threading.Thread(target=_server.serve_forever, name="audio-stream-server", daemon=True).start()
+    return True
@@ -0,0 +1,119 @@
+import base64
+import json
+import urllib.error
+import urllib.request
+import uuid
+import constants as ct
+from stt_backends import Transcript
+from tts_backends import SpeechAudio
+from word_timings import WordTimings
+
+class BackendError(Exception):
+    """
+    バックエンドサービスの呼び出しに失敗した場合の例外
+    """
+
+class BackendClient:
+    """
+    バックエンドサービス（backend_server.py）を呼び出すクライアント
+    Streamlitのセッションごとに作成し、session_idで会話メモリを対応付ける
+    """
+
+    def __init__(self, base_url, session_id=None):
+        self.base_url = base_url.rstrip('/')
+        self.session_id = session_id or uuid.uuid4().hex
+
+    def _post(self, path, body):
+        data = json.dumps(body).encode('utf-8')
+        request = urllib.request.Request(
+            f"{self.base_url}{path}",
+            data=data,
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=ct.BACKEND_TIMEOUT) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get("error", str(e))
+            except Exception:
+                message = str(e)
+            raise BackendError(f"バックエンドサービスでエラーが発生しました: {message}") from e
+        except urllib.error.URLError as e:
+            raise BackendError(f"バックエンドサービスに接続できません: {e.reason}") from e
+
+    def turn(self, text):
+        return self._post("/turn", {"session_id": self.session_id, "text": text})["reply"]
+
+    def problem(self, stateless=False, recent_problems=None):
+        body = {"session_id": self.session_id, "stateless": stateless, "recent_problems": recent_problems or []}
+        return self._post("/problem", body)["problem"]
+
+    def evaluate(self, problem, answer):
+        return self._post("/evaluate", {"session_id": self.session_id, "problem": problem, "answer": answer})["evaluation"]
+
+    def evaluate_set(self, items):
+        result = self._post("/evaluate_set", {"session_id": self.session_id, "items": items})
+        return result["feedbacks"], result["summary"]
+
+    def synthesize(self, text, purpose=None, output_format="mp3", bit_rate=None):
+        result = self._post("/synthesize", {"text": text, "purpose": purpose, "format": output_format, "bit_rate": bit_rate})
+        return SpeechAudio(base64.b64decode(result["audio"]), result["format"])
+
+    def start_speech_stream(self, text, purpose=None, output_format="mp3"):
+        """
+        音声合成を開始し、ストリームIDを返す（合成の完了は待たない）
+        """
+
+        return self._post("/speech_stream", {"text": text, "purpose": purpose, "format": output_format})["stream_id"]
+
+    def stream_url(self, stream_id, public_url=None):
+        """
+        ブラウザから生成中の音声を受け取るURL
+        """
+
+        return f"{(public_url or self.base_url).rstrip('/')}/stream/{stream_id}"
+
+    def fetch_stream(self, stream_id):
+        """
+        生成が終わるまで待ち、音声データ全体を取得
+        """
+
+        try:
+            with urllib.request.urlopen(self.stream_url(stream_id), timeout=ct.BACKEND_TIMEOUT) as response:
+                content = response.read()
+                content_type = response.headers.get('Content-Type', '')
+        except urllib.error.URLError as e:
+            raise BackendError(f"音声データを取得できません: {e}") from e
+        audio_format = next((key for key, mime in ct.AUDIO_MIME_TYPES.items() if mime == content_type), "mp3")
+        return SpeechAudio(content, audio_format)
+
+    def transcribe(self, audio_data, file_name="audio.wav", language="en", word_timestamps=False, mode=None):
+        result = self._post("/transcribe", {
+            "audio": base64.b64encode(audio_data).decode('ascii'),
+            "file_name": file_name,
+            "language": language,
+            "word_timestamps": word_timestamps,
+            "mode": mode,
+        })
+        word_timings = None
+        if "words" in result:
+            word_timings = WordTimings(result["words"], result["starts"], result["ends"])
+        return Transcript(result["text"], word_timings)
+
+class BackendChain:
+    """
+    ConversationChainの代わりにバックエンドサービスを呼び出すChain（predictのみ対応）
+    """
+
+    def __init__(self, client, system_template):
+        if system_template not in (ct.SYSTEM_TEMPLATE_BASIC_CONVERSATION, ct.SYSTEM_TEMPLATE_CREATE_PROBLEM):
+            raise ValueError("バックエンドサービスが対応していないプロンプトです")
+        self.client = client
+        self.system_template = system_template
+
+    def predict(self, input):
+        if self.system_template == ct.SYSTEM_TEMPLATE_CREATE_PROBLEM:
+            return self.client.problem()
+        return self.client.turn(input)
@@ -0,0 +1,184 @@
+"""
+OpenAIのクライアント・会話メモリ・キャッシュを保持するバックエンドサービス
+Streamlit側は環境変数BACKEND_URLを設定すると、このサービスを呼び出す薄いクライアントになる
+
+起動方法:
+    python backend_server.py
+"""
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import constants as ct
+import settings
+import llm_usage
+import audio_stream
+import tutor_engine
+import worker_pool
+import rate_limiter
+
+class TutorBackend:
+    """
+    プロセス全体で共有するチューターのエンジンと、セッションごとの状態（Streamlitのst.session_stateに相当）の管理
+    """
+
+    def __init__(self, config):
+        self.engine = tutor_engine.EnglishTutorEngine.from_settings(config)
+        self.sessions = {}
+        self.sessions_lock = threading.Lock()
+
+    def get_session(self, session_id):
+        with self.sessions_lock:
+            self._expire_sessions()
+            if session_id not in self.sessions:
+                self.sessions[session_id] = self.engine.new_state()
+            return self.sessions[session_id]
+
+    def _expire_sessions(self):
+        now = time.time()
+        for session_id in [key for key, session in self.sessions.items() if now - session.last_used > ct.BACKEND_SESSION_TTL]:
+            del self.sessions[session_id]
+
+    def turn(self, request):
+        session = self.get_session(request["session_id"])
+        return {"reply": self.engine.converse(session, request["text"])}
+
+    def problem(self, request):
+        if request.get("stateless"):
+            # 次の問題文の先読み（評価と同時に実行できるよう、会話メモリを使わずセッションのロックも取らない）
+            return {"problem": self.engine.next_problem(recent_problems=request.get("recent_problems"))}
+        session = self.get_session(request["session_id"])
+        return {"problem": self.engine.next_problem(session)}
+
+    def evaluate(self, request):
+        # 評価は会話メモリを使わない（評価の指示・問題文・回答が会話履歴に残らないようにする）
+        return {"evaluation": self.engine.evaluate(request["problem"], request["answer"])}
+
+    def evaluate_set(self, request):
+        # ディクテーションのセットをまとめて評価（会話メモリを使わない）
+        feedbacks, summary = self.engine.evaluate_set(request["items"])
+        return {"feedbacks": feedbacks, "summary": summary}
+
+    def synthesize(self, request):
+        speech_audio, _ = self.engine.synthesize(
+            request["text"],
+            request.get("purpose"),
+            request.get("format") or "mp3",
+            request.get("bit_rate")
+        )
+        return {
+            "audio": base64.b64encode(speech_audio.content).decode('ascii'),
+            "format": speech_audio.format,
+        }
+
+    def speech_stream(self, request):
+        """
+        音声合成を開始し、GET /stream/<stream_id> で生成中の音声を受け取れるようにする
+        """
+
+        # ストリーミングでは変換せず、APIに出力形式を直接要求する
+        backend = self.engine.speech_backend(request.get("purpose"), request.get("format") or "mp3", streaming=True)
+        stream_id, _ = audio_stream.start_stream(backend, request["text"], model=tutor_engine.api_model_of(backend))
+        return {"stream_id": stream_id}
+
+    def transcribe(self, request):
+        transcript = self.engine.transcribe(
+            base64.b64decode(request["audio"]),
+            file_name=request.get("file_name", "audio.wav"),
+            mode=request.get("mode"),
+            language=request.get("language", "en"),
+            word_timestamps=request.get("word_timestamps", False)
+        )
+        result = {"text": transcript.text}
+        if transcript.word_timings is not None:
+            result["words"] = transcript.word_timings.words
+            result["starts"] = transcript.word_timings.starts.tolist()
+            result["ends"] = transcript.word_timings.ends.tolist()
+        return result
+
+    def handlers(self):
+        return {
+            "/turn": self.turn,
+            "/problem": self.problem,
+            "/evaluate": self.evaluate,
+            "/evaluate_set": self.evaluate_set,
+            "/synthesize": self.synthesize,
+            "/speech_stream": self.speech_stream,
+            "/transcribe": self.transcribe,
+        }
+
+def create_request_handler(tutor_backend):
+    """
+    TutorBackendの各処理をJSONのPOSTエンドポイントとして公開するハンドラを作成
+    """
+
+    handlers = tutor_backend.handlers()
+
+    class RequestHandler(BaseHTTPRequestHandler):
+        # 音声のチャンク転送のためHTTP/1.1で応答する
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send_json(200, {
+                    "status": "ok",
+                    "sessions": len(tutor_backend.sessions),
+                    "worker_pool": worker_pool.get_worker_pool().metrics(),
+                    "llm_usage": llm_usage.metrics(),
+                })
+            elif self.path.startswith("/stream/"):
+                audio_stream.write_stream_response(self, self.path[len("/stream/"):].split("?")[0])
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            handler = handlers.get(self.path)
+            if handler is None:
+                self._send_json(404, {"error": "not found"})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                # 同時実行数の上限は共有ワーカープールで管理する
+                self._send_json(200, worker_pool.get_worker_pool().run(worker_pool.INTERACTIVE, handler, request))
+            except KeyError as e:
+                self._send_json(400, {"error": f"必須項目がありません: {e}"})
+            except rate_limiter.RateLimitWaitTooLong as e:
+                self._send_json(429, {"error": str(e), "wait_sec": e.wait_sec})
+            except Exception as e:
+                self._send_json(500, {"error": str(e)})
+
+        def log_message(self, format, *args):
+            print(f"[backend] {self.address_string()} {format % args}")
+
+    return RequestHandler
+
+def run_server(host=None, port=None):
+    """
+    バックエンドサービスを起動（省略時は設定の待ち受けアドレス）
+    """
+
+    config = settings.get_settings()
+    host = host or config.backend_host
+    port = port or config.backend_port
+    if not config.has_valid_api_key:
+        raise SystemExit("OPENAI_API_KEYが設定されていません")
+
+    server = ThreadingHTTPServer((host, port), create_request_handler(TutorBackend(config)))
+    print(f"バックエンドサービスを起動しました: http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    run_server()
@@ -0,0 +1,89 @@
+"""
+ディクテーションのセット（複数問）をまとめて評価する処理
+セットの途中は回答をローカルで問題文と比較して正誤のみを表示し、セットの最後に全ての問題文と回答を1回のLLM呼び出しで評価する
+（Streamlitに依存しないため、バックエンドサービスからも使用する）
+"""
+import difflib
+import json
+from langchain.schema import HumanMessage, SystemMessage
+import constants as ct
+import review_scheduler
+
+def check_answer(problem, answer):
+    """
+    問題文と回答を単語単位で比較（大文字・小文字と句読点は区別しない）
+    Returns:
+        {"correct": 完全に一致したか, "accuracy": 問題文の単語のうち一致した割合, "missed": 聞き取れなかった単語のリスト}
+    """
+
+    problem_tokens = review_scheduler.tokenize(problem)
+    answer_tokens = review_scheduler.tokenize(answer)
+    matcher = difflib.SequenceMatcher(a=problem_tokens, b=answer_tokens, autojunk=False)
+    matched = set()
+    for block in matcher.get_matching_blocks():
+        matched.update(range(block.a, block.a + block.size))
+    missed = [token for index, token in enumerate(problem_tokens) if index not in matched]
+    return {
+        "correct": problem_tokens == answer_tokens,
+        "accuracy": len(matched) / len(problem_tokens) if problem_tokens else 0.0,
+        "missed": missed,
+    }
+
+def format_check(result):
+    """
+    ローカルでの比較結果の表示用テキスト
+    """
+
+    if result["correct"]:
+        return "✓ 正解です！"
+    text = f"△ 単語の一致率 {result['accuracy']:.0%}"
+    if result["missed"]:
+        text += f"（聞き取れなかった単語: {', '.join(result['missed'])}）"
+    return text
+
+def build_set_input(items):
+    """
+    セットの問題文と回答を、評価のChainに渡す1つのメッセージにまとめる
+    Args:
+        items: {"problem": 問題文, "answer": 回答}のリスト
+    """
+
+    return "\n\n".join(
+        ct.SET_EVALUATION_ITEM_TEMPLATE.format(number=number, llm_text=item["problem"], user_text=item["answer"])
+        for number, item in enumerate(items, 1)
+    )
+
+def parse_set_evaluation(text, count):
+    """
+    まとめて評価した結果（JSON）を問題ごとのフィードバックと総評に分ける
+    JSONとして読めない場合は、全体を総評として扱う
+    Returns:
+        (問題ごとのフィードバックのリスト（count件、欠けている場合は空文字列）, 総評)
+    """
+
+    try:
+        data = json.loads(text)
+        feedbacks = {int(item["number"]): str(item["feedback"]) for item in data.get("items", [])}
+        summary = str(data.get("summary", ""))
+    except (ValueError, TypeError, KeyError, AttributeError) as e:
+        print(f"Warning: まとめて評価した結果を読み取れませんでした: {e}")
+        return [""] * count, text
+    return [feedbacks.get(number, "") for number in range(1, count + 1)], summary
+
+def evaluate_set(llm, items):
+    """
+    セットの問題文と回答を1回のLLM呼び出しで評価（会話メモリは使わない）
+    Returns:
+        (問題ごとのフィードバックのリスト, 総評)
+    """
+
+    messages = [SystemMessage(content=ct.SYSTEM_TEMPLATE_SET_EVALUATION), HumanMessage(content=build_set_input(items))]
+    response = llm.bind(response_format={"type": "json_object"}).invoke(messages)
+    return parse_set_evaluation(response.content, len(items))
+
+def estimate_set_tokens(items):
+    """
+    まとめて評価する際の想定トークン数（レート制限用）
+    """
+
+    return ct.RATE_LIMIT_CHAT_TOKENS + ct.SET_EVALUATION_TOKENS_PER_ITEM * len(items)
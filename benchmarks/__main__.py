@@ -0,0 +1,85 @@
+"""
+ベンチマークの実行とベースラインとの比較
+
+使い方（リポジトリのルートで実行）:
+    python -m benchmarks run                   # 計測して benchmarks/results/latest.json に保存
+    python -m benchmarks run --save-baseline   # 計測結果をベースライン（benchmarks/results/baseline.json）として保存
+    python -m benchmarks run -k shadowing      # 名前が一致するベンチマークのみ実行
+    python -m benchmarks compare               # 最新の計測結果をベースラインと比較（遅くなったものがあれば終了コード1）
+
+実行時間は環境ごとに異なるため、ベースラインはリポジトリに含めず、比較する環境で作成する
+（変更前のコードで --save-baseline、変更後のコードで run と compare を実行する）
+計測した環境が異なる結果どうしは比較しない（--allow-machine-mismatch で警告のみにできる）
+"""
+import argparse
+import os
+import sys
+import warnings
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BENCHMARK_DIR, "results", "baseline.json")
+LATEST_PATH = os.path.join(BENCHMARK_DIR, "results", "latest.json")
+
+def _silence_streamlit():
+    """
+    Streamlitをスクリプト外（bare mode）で使う際に毎回出力される警告を抑える
+    （設定ファイルの読み込み時にログレベルが戻るため、先に読み込ませてから変更する）
+    """
+
+    import streamlit as st
+    import streamlit.logger
+    st.get_option("logger.level")
+    streamlit.logger.set_log_level("error")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="ベンチマークを実行")
+    run_parser.add_argument("-k", "--pattern", help="実行するベンチマーク名の正規表現")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument("--output", default=LATEST_PATH)
+    run_parser.add_argument("--save-baseline", action="store_true", help="結果をベースラインとしても保存")
+
+    compare_parser = subparsers.add_parser("compare", help="ベースラインと比較")
+    compare_parser.add_argument("--baseline", default=BASELINE_PATH)
+    compare_parser.add_argument("--current", default=LATEST_PATH)
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="遅くなったと判定する割合（0.2 = 20%%）")
+    compare_parser.add_argument("--allow-machine-mismatch", action="store_true", help="計測した環境が異なる場合も比較する")
+
+    args = parser.parse_args(argv)
+
+    from benchmarks import harness
+
+    if args.command == "run":
+        _silence_streamlit()
+        from benchmarks import cases  # noqa: F401（ベンチマークを登録）
+        # LangChainの非推奨の警告を抑える（LangChainのインポート時に追加される設定より優先させるため、インポート後に設定）
+        warnings.filterwarnings("ignore", category=DeprecationWarning)
+        results = harness.run(args.pattern, repeat=args.repeat)
+        harness.save(results, args.output)
+        if args.save_baseline:
+            harness.save(results, BASELINE_PATH)
+            print(f"ベースラインを保存しました: {BASELINE_PATH}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"ベースラインがありません（python -m benchmarks run --save-baseline で作成）: {args.baseline}")
+        return 2
+    baseline, baseline_machine = harness.load(args.baseline)
+    current, current_machine = harness.load(args.current)
+    if baseline_machine is None or baseline_machine != current_machine:
+        print(f"ベースラインと今回の計測結果は、計測した環境が異なります:\n  baseline: {baseline_machine}\n  current:  {current_machine}")
+        if not args.allow_machine_mismatch:
+            print("同じ環境でベースラインを作り直してください（python -m benchmarks run --save-baseline）")
+            return 2
+        print("Warning: 環境が異なるため、比較結果は参考値です")
+    rows, regressions = harness.compare(baseline, current, args.threshold)
+    print(harness.format_comparison(rows))
+    if regressions:
+        print(f"\n{len(regressions)}件のベンチマークが{args.threshold:.0%}以上遅くなっています: {', '.join(regressions)}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+"""
+functions.py と周辺モジュールの処理のベンチマーク
+APIクライアント・LLMはスタブに置き換え、ファイルは一時フォルダに書き出す
+"""
+import dataclasses
+import json
+import os
+import random
+import tempfile
+import numpy as np
+import streamlit as st
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain.schema import AIMessage, HumanMessage
+import constants as ct
+import functions as ft
+import audio_preprocess as ap
+import conversation_memory
+import shadowing_scorer
+import word_timings
+import review_scheduler
+import rate_limiter
+import session_store
+import static_media
+import worker_pool
+import tutor_engine
+import settings
+from benchmarks.harness import benchmark
+from benchmarks.stubs import StubChatModel, StubOpenAI, synthetic_speech, to_wav_bytes
+
+WORK_DIR = tempfile.mkdtemp(prefix="english_conv_bench_")
+# URL配信用の音声ファイル・文字起こしキャッシュの書き出し先を一時フォルダに変更
+ct.STATIC_MEDIA_DIR = os.path.join(WORK_DIR, "static_media")
+ct.TRANSCRIPT_CACHE_DIR = os.path.join(WORK_DIR, "transcripts")
+os.makedirs(ct.TRANSCRIPT_CACHE_DIR, exist_ok=True)
+# レート制限の待ち時間を計測に含めない（レートリミッター自体は個別に計測する）
+# （設定ファイルが更新されるまでは、置き換えた設定がそのまま使われる）
+settings._settings = dataclasses.replace(
+    settings.get_settings(),
+    rate_limit_chat_rpm=10 ** 9,
+    rate_limit_chat_tpm=10 ** 12,
+    rate_limit_tts_rpm=10 ** 9,
+    rate_limit_stt_rpm=10 ** 9
+)
+
+SENTENCES = [
+    "I usually walk to the station before breakfast.",
+    "Could you tell me how to get to the museum?",
+    "We decided to book a table for tonight.",
+    "She has been learning the piano since last spring.",
+    "The weather forecast says it will rain tomorrow afternoon.",
+    "I'd like to return this jacket because it's too small.",
+]
+
+def _history(turns):
+    messages = []
+    for i in range(turns):
+        messages.append(HumanMessage(content=SENTENCES[i % len(SENTENCES)]))
+        messages.append(AIMessage(content=SENTENCES[(i + 3) % len(SENTENCES)]))
+    return messages
+
+def _setup_session():
+    st.session_state.llm = StubChatModel()
+    st.session_state.engine = tutor_engine.EnglishTutorEngine(StubOpenAI(os.urandom(50 * 1024)), st.session_state.llm)
+    st.session_state.tutor_state = st.session_state.engine.new_state()
+    st.session_state.memory = st.session_state.tutor_state.memory
+
+@benchmark("create_conversation_messages[10]")
+def bench_conversation_messages_10():
+    history = _history(10)
+    return lambda: ft.create_conversation_messages("You are a tutor.", history, "Hello!")
+
+@benchmark("create_conversation_messages[200]")
+def bench_conversation_messages_200():
+    history = _history(200)
+    return lambda: ft.create_conversation_messages("You are a tutor.", history, "Hello!")
+
+@benchmark("create_conversation_messages[window]")
+def bench_conversation_messages_window():
+    history = conversation_memory.TokenWindowHistory(ct.MEMORY_MAX_TOKEN_LIMIT)
+    for message in _history(200):
+        history.add("assistant" if message.type == "ai" else "user", message.content)
+
+    def run():
+        history.trim(history.max_tokens - conversation_memory.count_message_tokens("Hello!"))
+        ft.create_conversation_messages("You are a tutor.", history, "Hello!")
+        history.add_turn("Hello!", SENTENCES[0])
+    return run
+
+def _run_memory_session(memory_class, turns=200):
+    memory = memory_class(
+        llm=StubChatModel(responses=["The learner talked about their daily routine."]),
+        max_token_limit=ct.MEMORY_MAX_TOKEN_LIMIT,
+        return_messages=True
+    )
+    for i in range(turns):
+        memory.save_context(
+            {"input": SENTENCES[i % len(SENTENCES)] * (1 + i % 3)},
+            {"output": SENTENCES[(i + 3) % len(SENTENCES)] * (1 + i % 4)}
+        )
+
+@benchmark("memory.save_context[200 turns][ConversationSummaryBufferMemory]")
+def bench_memory_summary_buffer():
+    return lambda: _run_memory_session(ConversationSummaryBufferMemory)
+
+@benchmark("memory.save_context[200 turns][TokenCountingSummaryBufferMemory]")
+def bench_memory_token_counting():
+    return lambda: _run_memory_session(conversation_memory.TokenCountingSummaryBufferMemory)
+
+@benchmark("create_chain")
+def bench_create_chain():
+    _setup_session()
+    return lambda: ft.create_chain(ct.SYSTEM_TEMPLATE_BASIC_CONVERSATION)
+
+@benchmark("save_to_wav[100KB]")
+def bench_save_to_wav():
+    content = os.urandom(100 * 1024)
+    path = os.path.join(WORK_DIR, "audio_output.wav")
+    return lambda: ft.save_to_wav(content, path, "mp3")
+
+@benchmark("static_media.publish_file[hit]")
+def bench_publish_hit():
+    path = os.path.join(WORK_DIR, "publish_hit.mp3")
+    with open(path, 'wb') as f:
+        f.write(os.urandom(200 * 1024))
+    return lambda: static_media.audio_html(static_media.publish_file(path))
+
+@benchmark("static_media.publish_file[miss]")
+def bench_publish_miss():
+    path = os.path.join(WORK_DIR, "publish_miss.mp3")
+    with open(path, 'wb') as f:
+        f.write(os.urandom(200 * 1024))
+
+    def run():
+        static_media._published.clear()
+        static_media.publish_file(path)
+    return run
+
+@benchmark("display_messages[100]")
+def bench_display_messages():
+    messages = []
+    for i in range(50):
+        messages.append({"role": "assistant", "content": SENTENCES[i % len(SENTENCES)]})
+        messages.append({"role": "user", "content": SENTENCES[(i + 1) % len(SENTENCES)]})
+    return lambda: ft.display_messages(messages)
+
+@benchmark("session_store.load_messages_page[2000]")
+def bench_history_page():
+    store = session_store.SessionStore(os.path.join(WORK_DIR, "sessions.db"))
+    for i in range(2000):
+        store.add_message("bench", "user" if i % 2 else "assistant", SENTENCES[i % len(SENTENCES)])
+    store.flush()
+    return lambda: store.load_messages_page("bench", before_id=1500)
+
+@benchmark("preprocess_for_transcription[5s]")
+def bench_preprocess():
+    audio_data = to_wav_bytes(synthetic_speech(5.0, sample_rate=48000), sample_rate=48000)
+    return lambda: ap.preprocess_for_transcription(audio_data)
+
+@benchmark("shadowing_scorer.score_shadowing[4s]")
+def bench_score_shadowing():
+    reference = to_wav_bytes(synthetic_speech(4.0, seed=1))
+    learner = to_wav_bytes(synthetic_speech(4.2, seed=2, offset_sec=0.1))
+    return lambda: shadowing_scorer.score_shadowing(reference, learner)
+
+@benchmark("shadowing_scorer.banded_dtw[400x420]")
+def bench_banded_dtw():
+    rng = np.random.default_rng(0)
+    reference = rng.standard_normal((400, ct.SHADOWING_N_MELS)).astype(np.float32)
+    learner = rng.standard_normal((420, ct.SHADOWING_N_MELS)).astype(np.float32)
+    return lambda: shadowing_scorer.banded_dtw(reference, learner)
+
+@benchmark("word_timings.load_cached_transcript[hit]")
+def bench_transcript_cache():
+    audio_hash = word_timings.recording_hash(b"bench")
+    timings = word_timings.WordTimings(SENTENCES[0].split(), list(range(8)), list(range(1, 9)))
+    word_timings.save_cached_transcript(audio_hash, SENTENCES[0], timings)
+    return lambda: word_timings.load_cached_transcript(audio_hash)
+
+@benchmark("review_scheduler.compare_answer")
+def bench_compare_answer():
+    return lambda: review_scheduler.compare_answer(SENTENCES[4], "The weather forecast say it rain tomorrow")
+
+@benchmark("review_scheduler.pick_sentence[500]")
+def bench_pick_sentence():
+    rng = random.Random(0)
+    words = [word for sentence in SENTENCES for word in review_scheduler.tokenize(sentence)]
+    candidates = [(" ".join(rng.choices(words, k=10)), None) for _ in range(500)]
+    due_tokens = rng.sample(sorted(set(words)), 10)
+    return lambda: review_scheduler.pick_sentence(due_tokens, candidates)
+
+@benchmark("rate_limiter.acquire[memory]")
+def bench_rate_limiter():
+    limiter = rate_limiter.RateLimiter(rate_limiter.MemoryBucketStore(), {"bench": {"rpm": 10 ** 9, "tpm": 10 ** 12}})
+    return lambda: limiter.acquire("bench", tokens=1500)
+
+@benchmark("worker_pool.run[no-op]")
+def bench_worker_pool():
+    pool = worker_pool.get_worker_pool()
+    return lambda: pool.run(worker_pool.INTERACTIVE, int)
+
+@benchmark("engine.evaluate[stub]")
+def bench_engine_evaluate():
+    # Streamlitを介さずにエンジンを直接呼び出す
+    engine = tutor_engine.EnglishTutorEngine(StubOpenAI(b""), StubChatModel())
+    return lambda: engine.evaluate(SENTENCES[4], "The weather forecast say it rain tomorrow")
+
+@benchmark("engine.evaluate_set[20][stub]")
+def bench_engine_evaluate_set():
+    items = [{"problem": SENTENCES[i % len(SENTENCES)], "answer": SENTENCES[(i + 1) % len(SENTENCES)]} for i in range(20)]
+    response = json.dumps({"items": [{"number": i + 1, "feedback": "OK"} for i in range(20)], "summary": "Good"})
+    engine = tutor_engine.EnglishTutorEngine(StubOpenAI(b""), StubChatModel(responses=[response]))
+    return lambda: engine.evaluate_set(items)
+
+@benchmark("synthesize_speech[stub]")
+def bench_synthesize_speech():
+    _setup_session()
+    st.session_state.mode = ct.MODE_1
+    ct.AUDIO_OUTPUT_DIR = WORK_DIR
+    settings._settings = dataclasses.replace(
+        settings.get_settings(),
+        tts_backend="openai",
+        tts_backend_problem=None,
+        tts_backend_conversation=None
+    )
+    return lambda: ft.synthesize_speech(SENTENCES[0], "conversation")
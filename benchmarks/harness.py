@@ -0,0 +1,143 @@
+"""
+ベンチマークの登録・計測・保存・比較
+"""
+import contextlib
+import io
+import json
+import os
+import platform
+import re
+import statistics
+import time
+
+BENCHMARKS = {}
+
+def benchmark(name):
+    """
+    ベンチマークを登録するデコレーター
+    登録する関数は準備処理を行い、計測対象の引数なしの関数を返す
+    """
+
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+def _time_loop(fn, number):
+    # 計測対象の関数が出力するログは捨てる
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        return time.perf_counter() - start
+
+def measure(fn, min_sample_sec=0.05, repeat=5):
+    """
+    1回あたりの実行時間を計測
+    1サンプルがmin_sample_sec以上になるよう実行回数を調整し、repeat回計測する
+    Returns:
+        統計情報の辞書（時間はマイクロ秒）
+    """
+
+    _time_loop(fn, 1)  # キャッシュの準備などの初回の処理を除外
+    number = 1
+    while True:
+        elapsed = _time_loop(fn, number)
+        if elapsed >= min_sample_sec or number >= 10 ** 6:
+            break
+        number *= max(2, min(10, int(min_sample_sec / max(elapsed, 1e-9)) + 1))
+
+    samples = [_time_loop(fn, number) / number * 1e6 for _ in range(repeat)]
+    return {
+        "min_us": min(samples),
+        "median_us": statistics.median(samples),
+        "max_us": max(samples),
+        "number": number,
+        "repeat": repeat,
+    }
+
+def run(pattern=None, repeat=5):
+    """
+    登録されたベンチマークを実行（patternを指定した場合は名前が一致するもののみ）
+    """
+
+    results = {}
+    for name, setup in BENCHMARKS.items():
+        if pattern and not re.search(pattern, name):
+            continue
+        stats = measure(setup(), repeat=repeat)
+        results[name] = stats
+        print(f"{name:<64} {stats['min_us']:>12.1f} us (median {stats['median_us']:.1f} us, x{stats['number']})")
+    return results
+
+def machine_info():
+    """
+    計測した環境（実行時間は環境ごとに異なるため、同じ環境で計測した結果どうしのみ比較する）
+    """
+
+    return {
+        "host": platform.node(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+    }
+
+def save(results, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    data = {
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "machine_info": machine_info(),
+        "results": results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+def load(path):
+    """
+    Returns:
+        (results, machine_info)（環境の記録がない古い形式の場合、machine_infoはNone）
+    """
+
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data["results"], data.get("machine_info")
+
+def compare(baseline, current, threshold=0.2):
+    """
+    ベースラインと比較し、最小時間がthreshold（割合）を超えて遅くなったものを検出
+    ベースラインにあり今回計測していないものは "missing" として表示する
+    Returns:
+        (rows, regressions): 比較結果の行のリストと、遅くなったベンチマーク名のリスト
+    """
+
+    rows, regressions = [], []
+    for name, base in baseline.items():
+        if name not in current:
+            rows.append((name, base["min_us"], None, None, "missing"))
+    for name, stats in current.items():
+        base = baseline.get(name)
+        if base is None:
+            rows.append((name, None, stats["min_us"], None, "new"))
+            continue
+        ratio = stats["min_us"] / base["min_us"] if base["min_us"] else float("inf")
+        if ratio > 1 + threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif ratio < 1 - threshold:
+            status = "faster"
+        else:
+            status = "ok"
+        rows.append((name, base["min_us"], stats["min_us"], ratio, status))
+    return rows, regressions
+
+def format_comparison(rows):
+    lines = [f"{'benchmark':<64} {'baseline':>12} {'current':>12} {'ratio':>8}  status"]
+    for name, base, current, ratio, status in rows:
+        base_text = f"{base:.1f}" if base is not None else "-"
+        current_text = f"{current:.1f}" if current is not None else "-"
+        ratio_text = f"{ratio:.2f}x" if ratio is not None else "-"
+        lines.append(f"{name:<64} {base_text:>12} {current_text:>12} {ratio_text:>8}  {status}")
+    return "\n".join(lines)
@@ -0,0 +1,73 @@
+"""
+ネットワークに接続せずにベンチマークを実行するためのスタブ
+"""
+import io
+import re
+import wave
+import numpy as np
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+
+# tiktokenの代わりに使う簡易的なトークン分割（文字数に比例する処理時間になるよう実際に分割する）
+TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+class StubChatModel(FakeListChatModel):
+    """
+    固定の応答を返すチャットモデル（トークン数はtiktokenを使わず簡易的に分割して数える）
+    """
+
+    responses: list = ["That sounds great. What did you do next?"]
+
+    def get_num_tokens(self, text):
+        return len(TOKEN_PATTERN.findall(text))
+
+    def get_num_tokens_from_messages(self, messages, tools=None):
+        # OpenAIのチャットモデルと同様に、メッセージごとに4トークン、応答の開始に3トークンを加える
+        return sum(self.get_num_tokens(str(message.content)) + 4 for message in messages) + 3
+
+class _StubSpeechResponse:
+    def __init__(self, content):
+        self.content = content
+
+class _StubSpeech:
+    def __init__(self, content):
+        self._content = content
+
+    def create(self, **kwargs):
+        return _StubSpeechResponse(self._content)
+
+class _StubAudio:
+    def __init__(self, content):
+        self.speech = _StubSpeech(content)
+
+class StubOpenAI:
+    """
+    音声合成の呼び出しに固定の音声データを返すOpenAIクライアント
+    """
+
+    def __init__(self, speech_content):
+        self.audio = _StubAudio(speech_content)
+
+def synthetic_speech(duration_sec, sample_rate=16000, seed=0, offset_sec=0.0):
+    """
+    音声に近い特性（振幅変調された倍音と無音区間）を持つ合成信号
+    """
+
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration_sec * sample_rate)) / sample_rate
+    pitch = 140 + 20 * np.sin(2 * np.pi * 0.5 * t)
+    phase = 2 * np.pi * np.cumsum(pitch) / sample_rate
+    voiced = sum(np.sin(k * phase) / k for k in range(1, 6))
+    envelope = np.clip(np.sin(2 * np.pi * 2.0 * (t - offset_sec)), 0, None)
+    signal = 0.3 * voiced * envelope + 0.002 * rng.standard_normal(len(t))
+    # 前後に無音を付ける
+    silence = np.zeros(int(0.5 * sample_rate))
+    return np.concatenate([silence, signal, silence]).astype(np.float32)
+
+def to_wav_bytes(samples, sample_rate=16000):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes((np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
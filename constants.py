@@ -4,6 +4,7 @@ MODE_2 = "シャドーイング"
 MODE_3 = "ディクテーション"
 USER_ICON_PATH = "images/user_icon.jpg"
 AI_ICON_PATH = "images/ai_icon.jpg"
+AVATAR_MAX_SIZE = 128  # チャットのアイコン画像を縮小する最大の辺の長さ（px）
 AUDIO_INPUT_DIR = "audio/input"
 AUDIO_OUTPUT_DIR = "audio/output"
 PLAY_SPEED_OPTION = [2.0, 1.5, 1.2, 1.0, 0.8, 0.6]
@@ -25,17 +26,16 @@ SYSTEM_TEMPLATE_CREATE_PROBLEM = """
 
     Limit your response to an English sentence of approximately 15 words with clear and understandable context.
 """
+# 会話メモリを使わずに問題文を生成する場合（先読み）に、最近の問題文と重ならないよう最後のメッセージで渡す指示
+PROBLEM_AVOID_TEMPLATE = """Do not repeat or closely paraphrase any of these recent sentences:
+{recent_problems}"""
+PREFETCH_RECENT_PROBLEMS = 10  # 先読みの際に避ける最近の問題文の件数
 
 # 問題文と回答を比較し、評価結果の生成を支持するプロンプトを作成
+# 問題文・回答文は含めず、EVALUATION_INPUT_TEMPLATEで最後のメッセージとして渡す（会話メモリは使わない）
 SYSTEM_TEMPLATE_EVALUATION = """
     あなたは英語学習の専門家です。
-    以下の「LLMによる問題文」と「ユーザーによる回答文」を比較し、分析してください：
-
-    【LLMによる問題文】
-    問題文：{llm_text}
-
-    【ユーザーによる回答文】
-    回答文：{user_text}
+    最後のメッセージで渡す「LLMによる問題文」と「ユーザーによる回答文」を比較し、分析してください：
 
     【分析項目】
     1. 単語の正確性（誤った単語、抜け落ちた単語、追加された単語）
@@ -52,4 +52,205 @@ SYSTEM_TEMPLATE_EVALUATION = """
     次回の練習のためのポイント
 
     ユーザーの努力を認め、前向きな姿勢で次の練習に取り組めるような励ましのコメントを含めてください。
-"""
\ No newline at end of file
+"""
+# 評価対象の問題文と回答文（評価への入力）
+EVALUATION_INPUT_TEMPLATE = """【LLMによる問題文】
+問題文：{llm_text}
+
+【ユーザーによる回答文】
+回答文：{user_text}"""
+
+# ディクテーションのセット（複数問）をまとめて評価するプロンプト（問題文と回答はSET_EVALUATION_ITEM_TEMPLATEで最後のメッセージとして渡す）
+SYSTEM_TEMPLATE_SET_EVALUATION = """
+    あなたは英語学習の専門家です。
+    最後のメッセージで渡す、番号付きの「LLMによる問題文」と「ユーザーによる回答文」の組をそれぞれ比較し、分析してください：
+
+    【分析項目】
+    1. 単語の正確性（誤った単語、抜け落ちた単語、追加された単語）
+    2. 文法的な正確性
+    3. 文の完成度
+
+    以下のJSON形式のみで、日本語で回答してください：
+    {"items": [{"number": 問題の番号, "feedback": "その問題の評価（✓ 正確に再現できた部分、△ 改善が必要な部分を簡潔に）"}], "summary": "セット全体の傾向と次回の練習のためのポイント"}
+
+    全ての問題について items に1件ずつ含めてください。
+    summary には、ユーザーの努力を認め、前向きな姿勢で次の練習に取り組めるような励ましのコメントを含めてください。
+"""
+SET_EVALUATION_ITEM_TEMPLATE = """【{number}】
+問題文：{llm_text}
+回答文：{user_text}"""
+# 文字起こし前の音声前処理（無音トリミング・リサンプリング）の設定
+TRANSCRIBE_SAMPLE_RATE = 16000  # Whisperへ送信する際のサンプリングレート（モノラル）
+VAD_FRAME_MS = 30  # 発話区間検出に使うフレーム長（ミリ秒）
+VAD_THRESHOLD_DB = -40.0  # 発話とみなすフレームのエネルギー閾値（dBFS）
+VAD_PADDING_MS = 200  # 発話区間の前後に残す余白（ミリ秒）
+SILENCE_RMS_DB = -50.0  # 録音全体のRMSがこれ未満なら無音として送信しない
+MIN_SPEECH_MS = 300  # 発話区間がこれより短い場合は無音とみなす
+
+# 音声変換（トランスコード）サービスの設定
+TRANSCODE_MAX_WORKERS = 2  # 同時に実行する変換処理の最大数
+TRANSCODE_MAX_PENDING = 16  # 実行待ちを含めて受け付ける変換処理の最大数
+TRANSCODE_TIMEOUT = 30  # 1件あたりの変換のタイムアウト（秒）
+TRANSCODE_PROFILES = {
+    # MP3 → AAC/MP4（ダウンロード用）
+    "mp4": {"format": "mp4", "codec": "aac", "bit_rate": 128000, "sample_rate": 24000, "layout": "mono", "mime": "audio/mp4"},
+    # WAV → Opus/Ogg（アップロード用）
+    "opus": {"format": "ogg", "codec": "libopus", "bit_rate": 24000, "sample_rate": 16000, "layout": "mono", "mime": "audio/ogg"},
+    # 音声合成の出力 → Opus/Ogg・AAC（再生用、ビットレートはモードごとに指定）
+    "opus_tts": {"format": "ogg", "codec": "libopus", "bit_rate": 32000, "sample_rate": 24000, "layout": "mono", "mime": "audio/ogg"},
+    "aac_tts": {"format": "adts", "codec": "aac", "bit_rate": 48000, "sample_rate": 24000, "layout": "mono", "mime": "audio/aac"},
+    # 音声合成の出力 → MP3・WAV（再生速度の変換用）
+    "mp3_tts": {"format": "mp3", "codec": "libmp3lame", "bit_rate": 64000, "sample_rate": 24000, "layout": "mono", "mime": "audio/mpeg"},
+    "wav_tts": {"format": "wav", "codec": "pcm_s16le", "bit_rate": 384000, "sample_rate": 24000, "layout": "mono", "mime": "audio/wav"},
+}
+
+# 文字起こし（STT）バックエンドの設定
+# "openai": OpenAI Whisper API / "local": faster-whisperによるCPU上のローカル文字起こし
+# 使用するバックエンド・モードごとの切り替えはsettings.pyで設定（STT_BACKEND / STT_BACKEND_CONVERSATION / STT_BACKEND_SHADOWING）
+STT_BACKEND = "openai"
+OPENAI_STT_MODEL = "whisper-1"
+LOCAL_STT_MODEL = "base.en"  # faster-whisperのモデル名
+LOCAL_STT_COMPUTE_TYPE = "int8"  # 量子化の種類
+LOCAL_STT_CPU_THREADS = 2  # 推論に使うCPUスレッド数
+
+# 音声合成（TTS）バックエンドの設定
+# "openai": OpenAI TTS API / "piper": Piperによるローカル合成 / "espeak": eSpeak NGによるローカル合成
+# 使用するバックエンド・用途ごとの切り替えはsettings.pyで設定（TTS_BACKEND / TTS_BACKEND_PROBLEM / TTS_BACKEND_CONVERSATION）
+TTS_BACKEND = "openai"
+OPENAI_TTS_MODEL = "tts-1"
+OPENAI_TTS_VOICE = "alloy"
+PIPER_VOICE_PATH = "voices/en_US-lessac-medium.onnx"  # Piperの音声モデル
+ESPEAK_VOICE = "en-us"
+
+# シャドーイングの音響スコア（参照音声と録音のDTW比較）の設定
+SHADOWING_SAMPLE_RATE = 16000
+SHADOWING_N_MELS = 40  # 対数メルスペクトログラムのバンド数
+SHADOWING_FRAME_MS = 25  # 特徴量の分析フレーム長（ミリ秒）
+SHADOWING_HOP_MS = 10  # 特徴量のフレーム間隔（ミリ秒）
+SHADOWING_DTW_BAND_RATIO = 0.2  # DTWの探索幅（長い方の系列長に対する割合）
+SHADOWING_SEGMENT_COUNT = 4  # 区間ごとの類似度を出す区間数
+
+# 単語単位のタイムスタンプ（文字起こし結果のキャッシュ）の設定
+TRANSCRIPT_CACHE_DIR = "audio/transcripts"  # 録音のハッシュごとに文字起こし結果を保存するフォルダ
+TRANSCRIPT_CACHE_SIZE = 256  # メモリ上に保持する文字起こし結果の件数
+TRANSCRIPT_CACHE_MAX_FILES = 1000  # ディスクに保存する文字起こし結果のファイル数の上限（超えた分は使われていない順に削除）
+SHADOWING_WORD_TIMESTAMPS = True  # シャドーイングで単語単位のタイムスタンプを取得するか
+LONG_PAUSE_SEC = 0.5  # この秒数以上の単語間の間を「長いポーズ」とみなす
+
+# バックエンドサービス（APIクライアント・キャッシュ・ワーカーを持つ別プロセス）の設定
+# 接続先のBACKEND_URL・待ち受けアドレスはsettings.pyで設定（BACKEND_URL設定時はStreamlitを薄いクライアントとして動作させる）
+BACKEND_HOST = "127.0.0.1"
+BACKEND_PORT = 8765
+BACKEND_TIMEOUT = 120  # バックエンド呼び出しのタイムアウト（秒）
+BACKEND_SESSION_TTL = 60 * 60  # 最後の利用からこの秒数を過ぎたセッションを破棄
+
+# API処理用の共有ワーカープール（全セッション共通）の設定
+WORKER_POOL_INTERACTIVE_WORKERS = 8  # 学習者が待っている処理の同時実行数
+WORKER_POOL_BACKGROUND_WORKERS = 2  # 要約・音声の変換など裏側の処理の同時実行数
+WORKER_POOL_PREFETCH_WORKERS = 1  # 次の問題文の先読みの同時実行数（backgroundより優先）
+WORKER_POOL_MAX_IN_FLIGHT = 8  # 全てのレーン合計の同時実行数の上限
+WORKER_POOL_TIMEOUT = 120  # 処理結果を待つ最大時間（秒）
+
+# 会話・問題文生成・評価に使うLLMの設定（既定値、settings.pyで上書き可能）
+OPENAI_CHAT_MODEL = "gpt-4o-mini"
+CHAT_TEMPERATURE = 0.5
+MEMORY_MAX_TOKEN_LIMIT = 1000  # 会話メモリで要約せずに保持するトークン数
+MESSAGE_TOKEN_OVERHEAD = 4  # メッセージ1件ごとに本文とは別にかかるトークン数（役割・区切り）
+
+# APIのレート制限（トークンバケット）の設定
+# 用途（chat / tts / stt）ごとの1分あたりのリクエスト数（rpm）とトークン数（tpm、Noneは制限なし）の既定値
+# 上限・保存先はsettings.pyで設定（RATE_LIMIT_CHAT_RPM / RATE_LIMIT_CHAT_TPM / RATE_LIMIT_TTS_RPM / RATE_LIMIT_STT_RPM / RATE_LIMIT_BACKEND / RATE_LIMIT_DB_PATH）
+RATE_LIMITS = {
+    "chat": {"rpm": 500, "tpm": 200000},
+    "tts": {"rpm": 50, "tpm": None},
+    "stt": {"rpm": 50, "tpm": None},
+}
+RATE_LIMIT_BACKEND = "memory"  # "memory": プロセス内 / "sqlite": 複数プロセスで共有
+RATE_LIMIT_DB_PATH = "rate_limit.db"
+RATE_LIMIT_MAX_WAIT = 60  # 待ち時間の見込みがこれを超える場合は受け付けない（秒）
+RATE_LIMIT_MAX_RETRIES = 3  # 429エラー時の再試行回数
+RATE_LIMIT_CHAT_TOKENS = 1500  # チャット1回あたりの想定トークン数（入力＋会話履歴＋出力）
+SET_EVALUATION_TOKENS_PER_ITEM = 150  # まとめて評価する際の1問あたりの想定トークン数（問題文・回答・フィードバック）
+
+# 学習履歴の保存（SQLite）の設定
+# 有効・無効と保存先はsettings.pyで設定（SESSION_STORE_ENABLED / SESSION_STORE_PATH）
+SESSION_STORE_ENABLED = True
+SESSION_STORE_PATH = "data/sessions.db"
+SESSION_STORE_BATCH_SIZE = 20  # 書き込みをまとめる件数（これを超えたら即時に書き込む）
+HISTORY_PAGE_SIZE = 20  # 会話履歴を一度に読み込む件数
+LEARNER_QUERY_PARAM = "learner"  # 学習者IDを保持するURLのクエリパラメータ
+
+# 復習（間隔反復）の設定
+REVIEW_ENABLED = True  # settings.pyで設定（REVIEW_ENABLED）
+REVIEW_INITIAL_EASINESS = 2.5  # SM-2の初期の易しさ係数
+REVIEW_RELEARN_INTERVAL_SEC = 600  # 聞き取れなかった単語を再出題するまでの間隔（秒）
+REVIEW_QUALITY_MISSED = 1  # 聞き取れなかった単語の評価（0〜5）
+REVIEW_QUALITY_CORRECT = 4  # 正しく答えられた単語の評価（0〜5）
+REVIEW_MAX_DUE_TOKENS = 20  # 問題文の選択に使う復習時期の単語の最大数
+REVIEW_CANDIDATE_LIMIT = 500  # 候補にする過去の問題文の最大数
+REVIEW_RECENT_EXCLUDE = 5  # 直近に出題した問題文は候補から除外する件数
+REVIEW_STOPWORDS = {
+    "a", "an", "the", "i", "you", "he", "she", "it", "we", "they", "me", "him", "her", "us", "them",
+    "my", "your", "his", "its", "our", "their", "is", "am", "are", "was", "were", "be", "been",
+    "do", "does", "did", "have", "has", "had", "to", "of", "in", "on", "at", "for", "with", "and",
+    "or", "but", "so", "this", "that", "it's", "i'm", "not",
+}
+
+# 生成した音声のURLでの配信の設定（audio_stream.pyの配信サーバーが、音声のMIMEタイプ・Range指定・キャッシュ用のヘッダー付きで配信）
+# Streamlitの静的ファイル配信（server.enableStaticServing）は画像・PDF以外をtext/plainとして返すため、音声には使わない
+STATIC_MEDIA_ENABLED = True
+STATIC_MEDIA_DIR = "audio/media"  # 配信するファイルの配置先
+STATIC_MEDIA_URL_PATH = "media"  # 配信サーバー上のパス
+STATIC_MEDIA_MAX_AGE = 365 * 24 * 60 * 60  # ブラウザにキャッシュさせる期間（秒、ファイル名に内容のハッシュを含むため変わらない）
+STATIC_MEDIA_MAX_FILES = 200  # 配置しておくファイル数の上限（超えた分は古い順に削除）
+STATIC_MEDIA_HASH_LENGTH = 16  # ファイル名に使う内容のハッシュの長さ
+
+# セッションごとの保持データ量の上限と、放置されたセッションの後始末の設定（上限・後始末までの時間はsettings.pyで設定）
+SESSION_PAYLOAD_MAX_BYTES = 4 * 1024 * 1024  # 会話履歴・会話メモリの本文と音声ファイルの合計の上限（超えた場合は整理）
+SESSION_KEEP_AUDIO_FILES = 3  # 整理時に残す直近の音声ファイル数（表示中の問題文の音声は常に残す）
+SESSION_EXPIRY_SEC = 600  # ブラウザとの接続が切れてから後始末するまでの時間（秒）
+SESSION_IDLE_TIMEOUT = 6 * 60 * 60  # 接続状態を確認できない場合（Streamlitの外で実行した場合など）は、最後の実行からこの秒数で後始末
+
+# 開発用のプロファイラーの設定（スクリプトの実行ごとに処理時間とメモリ確保を記録）
+PROFILE_ENABLED = False  # 全ての実行を記録（settings.pyで設定: PROFILE_RUNS）
+PROFILE_QUERY_PARAM = "profile"  # URLに ?profile=1 を付けたセッションのみ記録
+PROFILE_OUTPUT_DIR = "profiles"  # settings.pyで設定（PROFILE_OUTPUT_DIR）
+PROFILE_TOP_ALLOCATIONS = 30  # 記録するメモリ確保の上位件数
+PROFILE_MODE_TAGS = {MODE_1: "conversation", MODE_2: "shadowing", MODE_3: "dictation"}  # ファイル名に使うモード名
+
+# 問題文の音声を再生速度（PLAY_SPEED_OPTION）ごとにバックグラウンドで変換しておく設定
+SPEED_VARIANTS_ENABLED = True  # settings.pyで設定（SPEED_VARIANTS_ENABLED）
+SPEED_VARIANT_PROFILES = {"mp3": "mp3_tts", "wav": "wav_tts", "opus": "opus_tts", "aac": "aac_tts"}  # 元の音声の形式ごとの変換先
+SPEED_VARIANT_MAX_FILES = 200  # 保持する変換済みファイル数の上限（超えた分は古い順に削除）
+
+# 回答音声のストリーミング再生の設定
+AUDIO_STREAM_HOST = "127.0.0.1"  # バックエンド未使用時に起動する配信サーバーの待ち受けアドレス
+AUDIO_STREAM_PORT = 8766
+AUDIO_STREAM_CHUNK_SIZE = 4096  # 音声合成APIから読み込む単位（バイト）
+AUDIO_STREAM_TIMEOUT = 60  # 次のチャンクを待つ最大時間（秒）
+AUDIO_STREAM_TTL = 10 * 60  # 作成からこの秒数を過ぎたストリームを破棄
+
+# 音声の形式（音声合成の出力・文字起こしへのアップロード）の設定
+# 形式ごとのMIMEタイプ（"opus" はOgg Opus、"aac" はADTS形式のAAC）
+AUDIO_MIME_TYPES = {
+    "mp3": "audio/mpeg",
+    "wav": "audio/wav",
+    "opus": "audio/ogg",
+    "aac": "audio/aac",
+}
+# 音声合成の出力形式（settings.pyのtts_output_format）ごとの変換プロファイル（"mp3"はAPIの出力をそのまま使う）
+TTS_OUTPUT_PROFILES = {
+    "opus": "opus_tts",
+    "aac": "aac_tts",
+}
+# モードごとの出力ビットレート（bps、問題文の聞き取りが必要なモードは高めにする）
+TTS_OUTPUT_BIT_RATE_BY_MODE = {
+    MODE_1: 32000,
+    MODE_2: 48000,
+    MODE_3: 48000,
+}
+# 文字起こしへのアップロード形式（settings.pyのstt_upload_format）が"opus"の場合のモードごとのビットレート（bps）
+STT_UPLOAD_BIT_RATE_BY_MODE = {
+    MODE_1: 24000,
+    MODE_2: 32000,
+}
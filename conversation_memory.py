@@ -0,0 +1,149 @@
+"""
+会話履歴の保持
+メッセージごとのトークン数を追加時に一度だけ数えて合計を保持し、
+上限を超えた分は古い会話から要約する（LangChainのメモリ）または捨てる（フォールバックモード）ことで、
+リクエストの大きさを一定以下に保つ
+"""
+from collections import deque
+from langchain.memory import ConversationSummaryBufferMemory
+from pydantic import PrivateAttr
+import constants as ct
+import rate_limiter
+
+def count_message_tokens(content):
+    """
+    メッセージ1件のおおよそのトークン数（本文＋役割・区切りの分）
+    """
+
+    return rate_limiter.estimate_tokens(content) + ct.MESSAGE_TOKEN_OVERHEAD
+
+class TokenWindowHistory:
+    """
+    トークン数の上限付きの会話履歴（古いメッセージから順に捨てるリングバッファ）
+    メッセージはOpenAI APIの形式（{"role", "content"}）で保持し、リクエストごとに作り直さない
+    """
+
+    def __init__(self, max_tokens=ct.MEMORY_MAX_TOKEN_LIMIT):
+        self.max_tokens = max_tokens
+        self.total_tokens = 0
+        self.dropped = 0  # 上限を超えて捨てたメッセージ数
+        self._entries = deque()  # (メッセージ, トークン数)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def messages(self):
+        return [message for message, _ in self._entries]
+
+    def add(self, role, content):
+        """
+        メッセージを追加し、上限を超えた場合は古いメッセージを捨てる
+        """
+
+        tokens = count_message_tokens(content)
+        self._entries.append(({"role": role, "content": content}, tokens))
+        self.total_tokens += tokens
+        self.trim(self.max_tokens)
+
+    def add_turn(self, user_input, reply):
+        """
+        ユーザーの発話とAIの回答の1往復を追加
+        """
+
+        self.add("user", user_input)
+        self.add("assistant", reply)
+
+    def trim(self, max_tokens):
+        """
+        合計トークン数がmax_tokens以下になるまで古いメッセージを捨てる
+        （履歴がAIの回答から始まらないよう、往復の単位で捨てる）
+        """
+
+        while self._entries and self.total_tokens > max_tokens:
+            self._pop_oldest()
+            while self._entries and self._entries[0][0]["role"] == "assistant":
+                self._pop_oldest()
+
+    def clear(self):
+        self._entries.clear()
+        self.total_tokens = 0
+
+    def _pop_oldest(self):
+        _, tokens = self._entries.popleft()
+        self.total_tokens -= tokens
+        self.dropped += 1
+
+class TokenCountingSummaryBufferMemory(ConversationSummaryBufferMemory):
+    """
+    メッセージごとのトークン数をキャッシュするConversationSummaryBufferMemory
+    元のクラスは保存のたびに履歴全体のトークン数を数え直し、要約に回すメッセージを1件外すごとにも数え直すが、
+    このクラスは新しいメッセージだけを数え、合計の増減で要約するかを判断する
+    """
+
+    _token_counts: deque = PrivateAttr(default_factory=deque)  # (メッセージ, トークン数)
+    _total_tokens: int = PrivateAttr(default=0)
+    _base_tokens: int = PrivateAttr(default=None)  # メッセージ以外にかかるトークン数（応答の開始の分など）
+
+    @property
+    def total_tokens(self):
+        """
+        現在の履歴（要約を除く）のトークン数
+        """
+
+        self._sync_token_counts(self.chat_memory.messages)
+        return self._total_tokens
+
+    def _count(self, messages):
+        return self.llm.get_num_tokens_from_messages(messages)
+
+    def _sync_token_counts(self, buffer):
+        """
+        キャッシュを履歴に合わせる（追加されたメッセージのみ数える）
+        履歴が外部で置き換えられた場合（復元・クリアなど）は数え直す
+        """
+
+        if self._base_tokens is None:
+            self._base_tokens = self._count([])
+        counted = len(self._token_counts)
+        unchanged = (
+            counted <= len(buffer)
+            and (counted == 0 or (buffer[0] is self._token_counts[0][0] and buffer[counted - 1] is self._token_counts[-1][0]))
+        )
+        if not unchanged:
+            self._token_counts.clear()
+            self._total_tokens = 0
+            counted = 0
+        for message in buffer[counted:]:
+            tokens = self._count([message]) - self._base_tokens
+            self._token_counts.append((message, tokens))
+            self._total_tokens += tokens
+
+    def _pop_over_limit(self):
+        """
+        上限を超えた分の古いメッセージを履歴から外して返す
+        """
+
+        buffer = self.chat_memory.messages
+        self._sync_token_counts(buffer)
+        pruned_memory = []
+        while buffer and self._base_tokens + self._total_tokens > self.max_token_limit:
+            pruned_memory.append(buffer.pop(0))
+            _, tokens = self._token_counts.popleft()
+            self._total_tokens -= tokens
+        return pruned_memory
+
+    def prune(self):
+        pruned_memory = self._pop_over_limit()
+        if pruned_memory:
+            self.moving_summary_buffer = self.predict_new_summary(pruned_memory, self.moving_summary_buffer)
+
+    async def aprune(self):
+        pruned_memory = self._pop_over_limit()
+        if pruned_memory:
+            self.moving_summary_buffer = await self.apredict_new_summary(pruned_memory, self.moving_summary_buffer)
+
+    def clear(self):
+        super().clear()
+        self._token_counts.clear()
+        self._total_tokens = 0
@@ -0,0 +1,133 @@
+"""
+開発用のプロファイラー（main.pyの実行ごとの処理時間とメモリ確保を記録）
+設定 PROFILE_RUNS=1（環境変数・.env・secrets.toml）で全ての実行を、URLのクエリパラメータ ?profile=1 でそのセッションの実行のみを記録する
+処理時間はpyinstrumentがあればHTMLレポート、なければcProfileの統計（.prof、snakeviz等で表示可能）とテキストで、
+メモリ確保はtracemallocの上位の箇所をテキストで、PROFILE_OUTPUT_DIRに保存する
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import runpy
+import threading
+import time
+import tracemalloc
+# pyinstrumentがあればサンプリング方式で計測し、HTMLレポートを出力する
+try:
+    from pyinstrument import Profiler
+    PYINSTRUMENT_AVAILABLE = True
+except ImportError:
+    PYINSTRUMENT_AVAILABLE = False
+import constants as ct
+import settings
+
+_local = threading.local()  # 実行中のスクリプトを計測中かどうか（セッションごとのスクリプト実行スレッド単位）
+_tracemalloc_users = 0  # tracemallocを使用中の実行数（複数のセッションで同時に計測する場合に備える）
+_tracemalloc_lock = threading.Lock()
+
+def is_requested(query_params):
+    """
+    この実行を記録するかどうか
+    """
+
+    return settings.get_settings().profile_runs or query_params.get(ct.PROFILE_QUERY_PARAM) == "1"
+
+def is_active():
+    return getattr(_local, "active", False)
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracemalloc_users += 1
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+    return snapshot
+
+def _allocation_report(snapshot, elapsed_sec, tag, outcome):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    stats = snapshot.statistics("lineno")
+    lines = [
+        f"# {tag}",
+        f"elapsed: {elapsed_sec * 1000:.1f} ms ({outcome})",
+        f"traced memory: {sum(stat.size for stat in stats) / 1024:.1f} KiB",
+        "",
+        f"top {ct.PROFILE_TOP_ALLOCATIONS} allocations:",
+    ]
+    for stat in stats[:ct.PROFILE_TOP_ALLOCATIONS]:
+        lines.append(f"{stat.size / 1024:10.1f} KiB {stat.count:8d} blocks  {stat.traceback}")
+    return "\n".join(lines) + "\n"
+
+def _output_prefix(output_dir, session_id, mode, run_started):
+    # ファイル名: <日時（ミリ秒まで）>_<セッションIDの先頭8文字>_<モード>
+    timestamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(run_started)) + f"-{int(run_started * 1000) % 1000:03d}"
+    session_tag = re.sub(r"[^0-9A-Za-z]", "", session_id or "")[:8] or "nosession"
+    name = f"{timestamp}_{session_tag}_{ct.PROFILE_MODE_TAGS.get(mode, 'init')}"
+    return os.path.join(output_dir, name), f"session={session_id} mode={mode}"
+
+def run_profiled(script_path, session_id, mode):
+    """
+    スクリプトを計測しながら実行し、終了時（st.rerun()・st.stop()・例外の場合を含む）にレポートを保存
+    Args:
+        script_path: 実行するスクリプト（main.py）のパス
+        session_id / mode: レポートのファイル名に使うセッションID・実行開始時のモード
+        （st.stop()の後はst.session_stateを参照すると再び例外が送出されるため、開始時に受け取る）
+    """
+
+    run_started = time.time()
+    profiler = Profiler() if PYINSTRUMENT_AVAILABLE else cProfile.Profile()
+    _start_tracemalloc()
+    _local.active = True
+    outcome = "completed"
+    started = time.perf_counter()
+    if PYINSTRUMENT_AVAILABLE:
+        profiler.start()
+    else:
+        profiler.enable()
+    try:
+        runpy.run_path(script_path, run_name="__main__")
+    except BaseException as e:
+        # st.rerun()・st.stop()も例外として送出されるため、種類を記録してそのまま送出する
+        outcome = type(e).__name__
+        raise
+    finally:
+        if PYINSTRUMENT_AVAILABLE:
+            profiler.stop()
+        else:
+            profiler.disable()
+        elapsed_sec = time.perf_counter() - started
+        _local.active = False
+        snapshot = _stop_tracemalloc()
+        try:
+            _save_reports(profiler, snapshot, elapsed_sec, outcome, session_id, mode, run_started)
+        except Exception as e:
+            print(f"Warning: プロファイルを保存できませんでした: {e}")
+
+def _save_reports(profiler, snapshot, elapsed_sec, outcome, session_id, mode, run_started):
+    output_dir = settings.get_settings().profile_output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    prefix, tag = _output_prefix(output_dir, session_id, mode, run_started)
+
+    if PYINSTRUMENT_AVAILABLE:
+        with open(f"{prefix}.html", 'w', encoding='utf-8') as f:
+            f.write(profiler.output_html())
+    else:
+        profiler.dump_stats(f"{prefix}.prof")
+        buffer = io.StringIO()
+        pstats.Stats(profiler, stream=buffer).sort_stats("cumulative").print_stats(40)
+        with open(f"{prefix}_time.txt", 'w', encoding='utf-8') as f:
+            f.write(f"# {tag}\n{buffer.getvalue()}")
+
+    with open(f"{prefix}_memory.txt", 'w', encoding='utf-8') as f:
+        f.write(_allocation_report(snapshot, elapsed_sec, tag, outcome))
@@ -1,6 +1,9 @@
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from streamlit.components.v1 import html
 import os
 import time
+import uuid
 from pathlib import Path
 # import wave  # PyAudio関連なので不要
 # import pyaudio  # PyAudioを無効化
@@ -8,16 +11,318 @@ from pathlib import Path
 # from audiorecorder import audiorecorder  # pyaudioopエラーを回避するため無効化
 import numpy as np
 # from scipy.io.wavfile import write  # 未使用のため無効化
-from langchain.prompts import (
-    ChatPromptTemplate,
-    HumanMessagePromptTemplate,
-    MessagesPlaceholder,
-)
-from langchain.schema import SystemMessage
+from langchain.schema import messages_from_dict, messages_to_dict
 from langchain.memory import ConversationSummaryBufferMemory
 from langchain_openai import ChatOpenAI
-from langchain.chains import ConversationChain
 import constants as ct
+import audio_preprocess as ap
+import transcoder
+import stt_backends
+import tts_backends
+import shadowing_scorer
+import word_timings
+import backend_client
+import worker_pool
+import rate_limiter
+import settings
+import static_media
+import audio_stream
+import session_store
+import review_scheduler
+import conversation_memory
+import speed_variants
+import session_registry
+import llm_usage
+import batch_evaluation
+import tutor_engine
+
+def get_session_id():
+    """
+    現在のStreamlitセッションのID（ワーカープールの処理の識別に使用）
+    """
+
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+def run_interactive(fn, *args, **kwargs):
+    """
+    学習者が結果を待つAPI処理を共有ワーカープール（interactiveレーン）で実行し、結果を返す
+    fnはワーカースレッドで実行されるため、st.*やst.session_stateにはアクセスしないこと
+    """
+
+    return worker_pool.get_worker_pool().run(worker_pool.INTERACTIVE, fn, *args, tag=get_session_id(), **kwargs)
+
+def run_prefetch(fn, *args, **kwargs):
+    """
+    学習者が次に待つ処理の先読みを共有ワーカープール（prefetchレーン）に投入
+    再生速度ごとの音声の変換など、backgroundレーンの処理より先に実行される
+    Returns:
+        worker_pool.Job
+    """
+
+    return worker_pool.get_worker_pool().submit(worker_pool.PREFETCH, fn, *args, tag=get_session_id(), **kwargs)
+
+def show_rate_limit_wait(wait_sec):
+    """
+    レート制限による待ち時間の見込みを表示しながら待機
+    """
+
+    placeholder = st.empty()
+    deadline = time.time() + wait_sec
+    remaining = wait_sec
+    while remaining > 0:
+        placeholder.info(f"⏳ APIの利用が混雑しています。約{remaining:.0f}秒後に処理を開始します...")
+        time.sleep(min(1.0, remaining))
+        remaining = deadline - time.time()
+    placeholder.empty()
+
+def run_api_call(model, fn, *args, tokens=0, **kwargs):
+    """
+    レート制限の枠を確保してからAPI処理を共有ワーカープールで実行し、結果を返す
+    上限に達している場合は待ち時間の見込みを表示して待機し、待ち時間が長すぎる場合は受け付けない
+    Args:
+        model: モデル名（Noneの場合はレート制限を適用しない）
+        fn: APIを呼び出す関数
+        tokens: 想定トークン数
+    """
+
+    reserve_api_call(model, tokens)
+    return run_interactive(rate_limiter.get_rate_limiter().call, model, fn, args, kwargs, tokens, True)
+
+def reserve_api_call(model, tokens=0):
+    """
+    レート制限の枠を確保（上限に達している場合は待ち時間の見込みを表示して待機）
+    待ち時間が長すぎる場合は警告を表示してスクリプトを停止する
+    """
+
+    try:
+        rate_limiter.get_rate_limiter().acquire(model, tokens, on_wait=show_rate_limit_wait)
+    except rate_limiter.RateLimitWaitTooLong as e:
+        st.warning(f"⚠️ {e}。しばらくしてからもう一度お試しください。")
+        st.stop()
+
+def run_engine_call(model, fn, *args, tokens=0, **kwargs):
+    """
+    レート制限の枠を確保してから（上限到達時は待ち時間の見込みを表示）、
+    チューターのエンジン（tutor_engine.py）の処理を共有ワーカープールで実行し、結果を返す
+    Args:
+        model: モデル名（Noneの場合はレート制限を適用しない）
+        fn: エンジンのメソッド（reserved=Trueで呼び出す）
+        tokens: 想定トークン数
+    """
+
+    reserve_api_call(model, tokens)
+    return run_interactive(fn, *args, reserved=True, **kwargs)
+
+def cancel_session_jobs():
+    """
+    現在のセッションが投入した未完了の処理をキャンセル（モード切り替え時など）
+    先読み中の次の問題文と、まとめて評価する前のディクテーションの回答も破棄する
+    """
+
+    st.session_state.pop("prefetched_problem", None)
+    st.session_state.dictation_set_items = []
+    return worker_pool.get_worker_pool().cancel(tag=get_session_id())
+
+def get_learner_id():
+    """
+    学習者ID（URLのクエリパラメータで保持し、再読み込み後も同じ履歴を引き継ぐ）
+    """
+
+    learner_id = st.query_params.get(ct.LEARNER_QUERY_PARAM)
+    if not learner_id:
+        learner_id = uuid.uuid4().hex
+        st.query_params[ct.LEARNER_QUERY_PARAM] = learner_id
+    return learner_id
+
+def load_history():
+    """
+    保存済みの会話履歴のうち、最新の1ページ分をメッセージリストに読み込む
+    """
+
+    st.session_state.history_oldest_id = None
+    st.session_state.history_has_more = False
+    store = session_store.get_session_store()
+    if store is None:
+        return
+    messages, oldest_id, has_more = store.load_messages_page(st.session_state.learner_id)
+    st.session_state.messages = messages
+    st.session_state.history_oldest_id = oldest_id
+    st.session_state.history_has_more = has_more
+
+def load_older_history():
+    """
+    さらに古い会話履歴を1ページ分読み込み、メッセージリストの先頭に追加
+    """
+
+    store = session_store.get_session_store()
+    if store is None or not st.session_state.history_has_more:
+        return
+    messages, oldest_id, has_more = store.load_messages_page(
+        st.session_state.learner_id,
+        before_id=st.session_state.history_oldest_id
+    )
+    st.session_state.messages = messages + st.session_state.messages
+    st.session_state.history_oldest_id = oldest_id
+    st.session_state.history_has_more = has_more
+
+def measure_session_payload(record):
+    """
+    セッションが保持しているデータ量（会話履歴・会話メモリの本文のバイト数と、ディスク上の音声ファイルのサイズ）
+    Pythonオブジェクトとしてのメモリ使用量やプロセスのRSSではなく、整理によって減らせる量の目安
+    """
+
+    messages = st.session_state.get("messages", [])
+    messages_bytes = sum(len((message.get("content") or "").encode()) for message in messages)
+    memory_bytes = 0
+    memory = st.session_state.get("memory")
+    if memory is not None:
+        memory_bytes = len(memory.moving_summary_buffer.encode()) + sum(
+            len(str(message.content).encode()) for message in memory.chat_memory.messages
+        )
+    audio_bytes = 0
+    for path in list(record.files):
+        try:
+            audio_bytes += os.path.getsize(path)
+        except OSError:
+            pass
+    return {
+        "messages": len(messages),
+        "messages_bytes": messages_bytes,
+        "memory_bytes": memory_bytes,
+        "audio_files": len(record.files),
+        "audio_bytes": audio_bytes,
+        "total_bytes": messages_bytes + memory_bytes + audio_bytes,
+    }
+
+def compact_session(record):
+    """
+    セッションの使用量を減らす
+    直近以外の音声ファイルを削除し、それでも上限を超える場合は画面に表示する会話履歴を最新の1ページ分にする
+    （学習履歴を保存している場合、古い履歴は「過去の履歴をさらに表示」で読み込み直せる）
+    """
+
+    freed = session_registry.release_files(record, keep={st.session_state.get("current_audio_file")})
+    record.compactions += 1
+    if measure_session_payload(record)["total_bytes"] <= settings.get_settings().session_payload_max_bytes:
+        print(f"[session] {record.session_id[:8]} compacted: {freed / 1024:.1f}KB of audio deleted")
+        return
+
+    message_count = len(st.session_state.messages)
+    if session_store.get_session_store():
+        flush_session_store()
+        load_history()
+    else:
+        st.session_state.messages = st.session_state.messages[-ct.HISTORY_PAGE_SIZE:]
+    print(f"[session] {record.session_id[:8]} compacted: {freed / 1024:.1f}KB of audio deleted, messages {message_count} -> {len(st.session_state.messages)}")
+
+def account_session():
+    """
+    セッションの保持データ量を記録し、上限（session_payload_max_bytes）を超えた場合は整理する
+    あわせて、ブラウザとの接続が切れたまま放置されたセッションを後始末する（スクリプトの実行ごとに呼び出す）
+    """
+
+    session_id = get_session_id()
+    if session_id is None:
+        return
+    record = session_registry.touch(session_id)
+    # 後始末の際に閉じるAPIクライアント（ChatOpenAIは内部のOpenAIクライアントを閉じる）
+    session_registry.track_resource(session_id, st.session_state.get("openai_obj"))
+    session_registry.track_resource(session_id, getattr(st.session_state.get("llm"), "root_client", None))
+
+    payload = measure_session_payload(record)
+    if payload["total_bytes"] > settings.get_settings().session_payload_max_bytes:
+        compact_session(record)
+        payload = measure_session_payload(record)
+    record.payload = payload
+
+def display_messages(messages):
+    """
+    メッセージリストの一覧表示
+    """
+
+    for message in messages:
+        if message["role"] == "assistant":
+            with st.chat_message(message["role"], avatar=get_avatar(ct.AI_ICON_PATH)):
+                st.markdown(message["content"])
+        elif message["role"] == "user":
+            with st.chat_message(message["role"], avatar=get_avatar(ct.USER_ICON_PATH)):
+                st.markdown(message["content"])
+        else:
+            st.divider()
+
+def append_message(role, content=None):
+    """
+    メッセージリストへの追加と保存（保存はflush_session_store()でまとめて行う）
+    """
+
+    st.session_state.messages.append({"role": role} if role == "other" else {"role": role, "content": content})
+    store = session_store.get_session_store()
+    if store:
+        store.add_message(st.session_state.learner_id, role, content)
+
+def record_problem(problem, audio_path=None):
+    """
+    出題した問題文と音声ファイルのパスを保存
+    """
+
+    store = session_store.get_session_store()
+    if store:
+        store.add_problem(st.session_state.learner_id, st.session_state.mode, problem, audio_path)
+        # 復習で再利用するため、問題文の音声はセッションの後始末で削除しない
+        session_registry.untrack_file(get_session_id(), audio_path)
+
+def record_score(problem, answer, evaluation, acoustic_score=None):
+    """
+    回答と評価結果（シャドーイングの場合は音響スコアも）を保存
+    """
+
+    store = session_store.get_session_store()
+    if store:
+        store.add_score(st.session_state.learner_id, st.session_state.mode, problem, answer, evaluation, acoustic_score)
+
+def update_review_schedule(problem, answer):
+    """
+    問題文と回答を比較し、聞き取れなかった単語の復習時期を更新（SM-2方式）
+    """
+
+    store = session_store.get_session_store()
+    if store is None or not settings.get_settings().review_enabled:
+        return
+    missed, correct = review_scheduler.compare_answer(problem, answer)
+    items = store.load_review_items(st.session_state.learner_id, missed | correct)
+    store.save_review_items(st.session_state.learner_id, review_scheduler.update_schedule(items, missed, correct))
+
+def restore_memory(memory):
+    """
+    保存済みの要約と直近の会話で会話メモリを復元
+    """
+
+    store = session_store.get_session_store()
+    if store is None:
+        return
+    state = store.load_memory_state(st.session_state.learner_id)
+    if state:
+        summary, buffer_messages = state
+        memory.moving_summary_buffer = summary
+        memory.chat_memory.messages = messages_from_dict(buffer_messages)
+
+def flush_session_store():
+    """
+    会話メモリの状態を記録し、このターンの書き込みをまとめて保存（st.rerun()の前に呼び出す）
+    """
+
+    store = session_store.get_session_store()
+    if store is None:
+        return
+    memory = st.session_state.get("memory")
+    if memory is not None:
+        store.save_memory_state(
+            st.session_state.learner_id,
+            memory.moving_summary_buffer,
+            messages_to_dict(memory.chat_memory.messages)
+        )
+    store.flush()
 
 def record_audio(audio_input_file_path):
     """
@@ -33,6 +338,7 @@ def record_audio(audio_input_file_path):
         # 音声ファイルを保存
         with open(audio_input_file_path, "wb") as f:
             f.write(audio_bytes.getvalue())
+        session_registry.track_file(get_session_id(), audio_input_file_path)
         
         st.success("音声が正常に録音されました！")
         return True
@@ -55,6 +361,7 @@ def record_audio_for_shadowing(audio_input_file_path):
         # 音声ファイルを保存
         with open(audio_input_file_path, "wb") as f:
             f.write(audio_bytes.getvalue())
+        session_registry.track_file(get_session_id(), audio_input_file_path)
         
         st.success("✅ シャドーイング音声が正常に録音されました！")
         return True
@@ -62,110 +369,388 @@ def record_audio_for_shadowing(audio_input_file_path):
         st.info("🔴 シャドーイング用の音声を録音してください。")
         return False
 
-def transcribe_audio(audio_input_file_path):
+def transcribe_audio(audio_input_file_path, word_timestamps=False):
     """
     音声入力ファイルから文字起こしテキストを取得
+    送信前に無音トリミング・モノラル16kHz化を行い、無音の録音はAPIを呼ばずにNoneを返す
+    文字起こしのバックエンド（OpenAI API / ローカル）はモードごとの設定に従う
+    結果は録音のハッシュごとにキャッシュし、同じ録音は再度文字起こししない
+    単語ごとの時刻は無音トリミング後の音声が基準のため、その音声をキャッシュに残して transcript.audio_path で返す
+    （元の録音ファイルは削除する）
     Args:
         audio_input_file_path: 音声入力ファイルのパス
+        word_timestamps: 単語ごとの時刻（transcript.word_timings）も取得するか
     """
 
     with open(audio_input_file_path, 'rb') as audio_input_file:
-        transcript = st.session_state.openai_obj.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_input_file,
-            language="en"
-        )
-    
+        audio_data = audio_input_file.read()
+
     # 音声入力ファイルを削除
     os.remove(audio_input_file_path)
 
+    # 同じ録音の文字起こし結果があれば再利用する
+    audio_hash = word_timings.recording_hash(audio_data)
+    cached = word_timings.load_cached_transcript(audio_hash)
+    if cached and (cached[1] is not None or not word_timestamps):
+        return stt_backends.Transcript(*cached, audio_path=word_timings.clip_path(audio_hash))
+
+    # 無音トリミングとリサンプリングで送信サイズを削減
+    processed_data, stats = ap.preprocess_for_transcription(audio_data)
+    if stats:
+        print(ap.format_preprocess_stats(stats))
+        if stats["is_silent"]:
+            return None
+
+    file_name = Path(audio_input_file_path).name
+    # 単語ごとの時刻の基準として、圧縮前の前処理済みの音声を保存する
+    clip = processed_data
+    processed_data, file_name = compress_for_upload(processed_data, file_name)
+    if st.session_state.get("backend"):
+        # バックエンドサービス利用時は前処理済みの音声だけを送信
+        transcript = run_interactive(
+            st.session_state.backend.transcribe,
+            processed_data,
+            file_name=file_name,
+            word_timestamps=word_timestamps,
+            mode=st.session_state.get("mode")
+        )
+        word_timings.save_cached_transcript(audio_hash, transcript.text, transcript.word_timings, clip)
+        transcript.audio_path = word_timings.clip_path(audio_hash)
+        return transcript
+
+    # API障害時はエンジンの中でローカル文字起こしに切り替える
+    engine = st.session_state.engine
+    mode = st.session_state.get("mode")
+    transcript = run_engine_call(
+        tutor_engine.api_model_of(engine.transcription_backend(mode)),
+        engine.transcribe,
+        processed_data,
+        file_name=file_name,
+        mode=mode,
+        word_timestamps=word_timestamps
+    )
+
+    word_timings.save_cached_transcript(audio_hash, transcript.text, transcript.word_timings, clip)
+    transcript.audio_path = word_timings.clip_path(audio_hash)
+
     return transcript
 
-def save_to_wav(llm_response_audio, audio_output_file_path):
+def compress_for_upload(audio_data, file_name):
     """
-    音声データを直接mp3ファイルとして保存（pydub不使用版）
+    文字起こしに送る音声を設定された形式（settings.pyのstt_upload_format）に圧縮
+    変換できない場合はWAVのまま送る
+    Returns:
+        (audio_data, file_name)
+    """
+
+    source_size = len(audio_data)
+    if settings.get_settings().stt_upload_format == "opus" and transcoder.is_available():
+        bit_rate = ct.STT_UPLOAD_BIT_RATE_BY_MODE.get(st.session_state.get("mode"))
+        try:
+            audio_data = transcoder.submit_transcode(audio_data, "opus", bit_rate).result(timeout=ct.TRANSCODE_TIMEOUT)
+            file_name = f"{os.path.splitext(file_name)[0]}.ogg"
+        except Exception as e:
+            print(f"Warning: アップロード用の音声を圧縮できなかったため、WAVのまま送信します: {e}")
+    record_transfer("stt", os.path.splitext(file_name)[1].lstrip('.'), len(audio_data), source_size)
+    return audio_data, file_name
+
+def record_transfer(kind, audio_format, size, source_size=None):
+    """
+    音声の送受信サイズをログに出力し、学習履歴のストアに記録
+    """
+
+    if source_size and source_size != size:
+        print(f"[{kind}] {audio_format}: {size / 1024:.1f}KB（圧縮前 {source_size / 1024:.1f}KB、{size / source_size:.0%}）")
+    else:
+        print(f"[{kind}] {audio_format}: {size / 1024:.1f}KB")
+    store = session_store.get_session_store()
+    if store and "learner_id" in st.session_state:
+        store.add_transfer(st.session_state.learner_id, st.session_state.get("mode"), kind, audio_format, size, source_size)
+
+def save_to_wav(llm_response_audio, audio_output_file_path, audio_format="mp3"):
+    """
+    音声データを変換せずにそのままファイルとして保存（pydub不使用版）
     Args:
         llm_response_audio: LLMからの回答の音声データ
         audio_output_file_path: 出力先のファイルパス
+        audio_format: 音声データの形式（OpenAIのTTSはmp3、ローカル合成はwav）
     """
 
-    # OpenAIのTTSはmp3形式で出力されるため、直接mp3として保存
-    mp3_file_path = audio_output_file_path.replace('.wav', '.mp3')
+    # 音声データの形式に合わせて拡張子を付け替えて保存
+    actual_file_path = f"{os.path.splitext(audio_output_file_path)[0]}.{audio_format}"
     
     try:
-        with open(mp3_file_path, "wb") as audio_output_file:
+        with open(actual_file_path, "wb") as audio_output_file:
             audio_output_file.write(llm_response_audio)
-        return mp3_file_path  # 実際に保存されたファイルパスを返す
+        return actual_file_path  # 実際に保存されたファイルパスを返す
     except Exception as e:
         st.error(f"音声ファイルの保存に失敗しました: {e}")
         raise
 
+def synthesize_speech(text, purpose):
+    """
+    テキストを音声データに変換してファイルに保存
+    Args:
+        text: 読み上げるテキスト
+        purpose: 用途（"problem" / "conversation"）、用途ごとの音声合成バックエンドを使用
+    Returns:
+        (speech_audio, actual_file_path): 音声合成結果と保存先のファイルパス
+    """
+
+    # 出力形式・モードごとのビットレート（mp3以外は、可能ならWAVで受け取ってから1回だけ圧縮する）
+    output_format = settings.get_settings().tts_output_format
+    bit_rate = ct.TTS_OUTPUT_BIT_RATE_BY_MODE.get(st.session_state.get("mode"))
+
+    if st.session_state.get("backend"):
+        speech_audio = run_interactive(st.session_state.backend.synthesize, text, purpose, output_format, bit_rate)
+        source_size = None
+    else:
+        # ローカル合成に失敗した場合は、エンジンの中でOpenAI APIでの合成に切り替える
+        engine = st.session_state.engine
+        speech_audio, source_size = run_engine_call(
+            tutor_engine.api_model_of(engine.speech_backend(purpose, output_format)),
+            engine.synthesize,
+            text,
+            purpose,
+            output_format,
+            bit_rate
+        )
+
+    return speech_audio, store_speech_audio(speech_audio, source_size)
+
+def store_speech_audio(speech_audio, source_size=None):
+    """
+    音声合成結果をファイルに保存し、転送量を記録
+    Args:
+        speech_audio: 音声合成結果
+        source_size: 圧縮前のバイト数（ローカルで圧縮した場合）
+    Returns:
+        保存先のファイルパス
+    """
+
+    record_transfer("tts", speech_audio.format, len(speech_audio.content), source_size)
+    audio_output_file_path = f"{ct.AUDIO_OUTPUT_DIR}/audio_output_{int(time.time())}.{speech_audio.format}"
+    actual_file_path = save_to_wav(speech_audio.content, audio_output_file_path, speech_audio.format)
+    session_registry.track_file(get_session_id(), actual_file_path)
+
+    return actual_file_path
+
+def get_audio_server_url():
+    """
+    ブラウザから見た配信サーバー（audio_stream.py）のURL
+    """
+
+    return settings.get_settings().audio_stream_url or f"http://localhost:{ct.AUDIO_STREAM_PORT}"
+
+def render_audio(audio_file_path, autoplay=False):
+    """
+    音声プレーヤーを表示
+    URLでの配信が有効な場合は、配信サーバーの内容のハッシュを含むURLだけを送り、再描画のたびに音声データを送らない
+    無効な場合・配信サーバーを起動できない場合は従来通りst.audioに音声データを渡す
+    """
+
+    if ct.STATIC_MEDIA_ENABLED and audio_stream.ensure_stream_server():
+        url = static_media.publish_file(audio_file_path, get_audio_server_url())
+        st.markdown(static_media.audio_html(url, autoplay), unsafe_allow_html=True)
+        return
+
+    with open(audio_file_path, 'rb') as audio_file:
+        audio_bytes = audio_file.read()
+    audio_format = os.path.splitext(audio_file_path)[1].lstrip('.')
+    st.audio(audio_bytes, format=ct.AUDIO_MIME_TYPES.get(audio_format, 'audio/wav'), autoplay=autoplay)
+
+def resolve_playback_file(audio_file_path, speed):
+    """
+    再生速度に合わせた音声ファイルのパス
+    問題文の音声は生成時にバックグラウンドで変換済みのものを使い、未作成の場合はその場で作成する
+    作成できない場合は案内を表示して元の音声を返す
+    """
+
+    if speed == 1.0:
+        return audio_file_path
+    variant_path = speed_variants.get_variant(audio_file_path, speed)
+    if variant_path is None:
+        st.info(f"⚠️ 再生速度{speed}倍の音声を用意できなかったため、通常の速度で再生します")
+        return audio_file_path
+    return variant_path
+
+def get_avatar(icon_path):
+    """
+    チャットメッセージのアイコン画像（ファイルの読み込みはプロセスごとに一度だけ）
+    """
+
+    return static_media.load_image(icon_path)
+
+def is_speech_streaming_enabled():
+    """
+    回答音声をストリーミング再生するか（settings.pyのaudio_streaming）
+    """
+
+    return settings.get_settings().audio_streaming
+
+def start_speech_stream(text, purpose):
+    """
+    音声合成を開始し、ブラウザが生成中の音声を受け取るURLを返す
+    Returns:
+        (stream_url, fetch_audio): fetch_audio() は合成の完了を待ってSpeechAudioを返す
+        （配信サーバーを起動できない場合はNone）
+    """
+
+    config = settings.get_settings()
+    # ストリーミングでは変換せず、APIに出力形式を直接要求する
+    output_format = config.tts_output_format if config.tts_output_format in ct.AUDIO_MIME_TYPES else "mp3"
+    if st.session_state.get("backend"):
+        client = st.session_state.backend
+        stream_id = run_interactive(client.start_speech_stream, text, purpose, output_format)
+        return client.stream_url(stream_id, config.backend_public_url), lambda: run_interactive(client.fetch_stream, stream_id)
+
+    if not audio_stream.ensure_stream_server():
+        return None
+    backend = st.session_state.engine.speech_backend(purpose, output_format, streaming=True)
+    model = tutor_engine.api_model_of(backend)
+    reserve_api_call(model)
+    stream_id, stream = audio_stream.start_stream(backend, text, model=model, reserved=True, tag=get_session_id())
+    return f"{get_audio_server_url().rstrip('/')}/stream/{stream_id}", lambda: tts_backends.SpeechAudio(stream.content(), stream.format)
+
+def render_stream_player(stream_url):
+    """
+    ストリーミング配信の音声プレーヤー（最初のチャンクが届いた時点で再生を開始）
+    """
+
+    html(f"""
+    <audio id="player" controls autoplay preload="auto" src="{stream_url}" style="width: 100%;"></audio>
+    <div id="status" style="font-family: sans-serif; font-size: 12px; color: #666;">🎧 音声を受信中...</div>
+    <script>
+    const player = document.getElementById("player");
+    const status = document.getElementById("status");
+    player.addEventListener("canplay", () => {{
+        player.play().catch(() => {{ status.textContent = "▶️ ボタンを押して再生してください"; }});
+    }});
+    player.addEventListener("playing", () => {{ status.textContent = ""; }});
+    player.addEventListener("error", () => {{ status.textContent = "⚠️ 音声の受信に失敗しました"; }});
+    </script>
+    """, height=80)
+
+def play_speech_stream(text, purpose):
+    """
+    回答音声をストリーミング再生し、再生開始後に音声全体をファイルに保存
+    配信サーバーを起動できない場合は、合成の完了後に通常の再生を行う
+    Returns:
+        保存先のファイルパス
+    """
+
+    started = start_speech_stream(text, purpose)
+    if started is None:
+        _, actual_file_path = synthesize_speech(text, purpose)
+        play_wav_auto_for_conversation(actual_file_path, speed=st.session_state.speed)
+        return actual_file_path
+
+    stream_url, fetch_audio = started
+    render_stream_player(stream_url)
+    speech_audio = fetch_audio()
+    record_transfer("tts", speech_audio.format, len(speech_audio.content))
+    audio_output_file_path = f"{ct.AUDIO_OUTPUT_DIR}/audio_output_{int(time.time())}.{speech_audio.format}"
+    actual_file_path = save_to_wav(speech_audio.content, audio_output_file_path, speech_audio.format)
+    session_registry.track_file(get_session_id(), actual_file_path)
+
+    # 音声ダウンロード機能（MP4変換はワーカープールで実行）
+    if speech_audio.format == "mp3":
+        display_audio_download_buttons(speech_audio.content)
+    return actual_file_path
+
 def play_wav_auto_for_conversation(audio_output_file_path, speed=1.0):
     """
     日常英会話モード専用の音声自動再生
     Args:
         audio_output_file_path: 音声ファイルのパス
-        speed: 再生速度（現在は無効、pydub不使用のため）
+        speed: 再生速度（1.0以外の場合はその場で速度を変えた音声を作成）
     """
     
-    # 速度変更機能の案内
-    if speed != 1.0:
-        st.info(f"⚠️ 音声速度変更機能は現在無効になっています（指定速度: {speed}x）")
-    
-    # Streamlitの音声再生機能を使用（自動再生を試行）
+    # 音声プレーヤーを表示（自動再生を試行）
     try:
-        with open(audio_output_file_path, 'rb') as audio_file:
-            audio_bytes = audio_file.read()
-            
-            # まず自動再生を試行（メッセージなしでシンプルに）
-            if audio_output_file_path.endswith('.mp3'):
-                st.audio(audio_bytes, format='audio/mp3', autoplay=True)
-            else:
-                st.audio(audio_bytes, format='audio/wav', autoplay=True)
-            
+        render_audio(resolve_playback_file(audio_output_file_path, speed), autoplay=True)
     except Exception as e:
         st.error(f"🚨 音声ファイルの準備に失敗しました: {e}")
         st.info("音声が利用できませんが、テキストでの回答は表示されています。")
         return
+
+    # 音声ダウンロード機能（MP4変換はワーカープールで実行）
+    if audio_output_file_path.endswith('.mp3'):
+        with open(audio_output_file_path, 'rb') as audio_file:
+            display_audio_download_buttons(audio_file.read())
     
     # 音声ファイルは即座に削除せず、セッション終了時まで保持
     # （ユーザーが複数回再生できるようにするため）
 
+def convert_mp3_to_mp4(mp3_bytes):
+    """
+    MP3データをMP4形式（AAC）に変換
+    Args:
+        mp3_bytes: MP3の音声データ
+    Returns:
+        bytes: MP4の音声データ（変換失敗時はNone）
+    """
+
+    if not transcoder.is_available():
+        return None
+
+    try:
+        return transcoder.submit_transcode(mp3_bytes, "mp4").result(timeout=ct.TRANSCODE_TIMEOUT)
+    except Exception as e:
+        st.warning(f"⚠️ MP4変換でエラーが発生しました: {e}")
+        return None
+
+def display_audio_download_buttons(mp3_bytes):
+    """
+    AI回答音声のダウンロードボタン（MP3/MP4）を表示
+    """
+
+    timestamp = int(time.time())
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col2:
+        st.download_button(
+            label="💾 MP3ダウンロード",
+            data=mp3_bytes,
+            file_name=f"ai_response_{timestamp}.mp3",
+            mime="audio/mp3",
+            help="AI回答音声をMP3形式でダウンロード"
+        )
+    with col3:
+        mp4_bytes = convert_mp3_to_mp4(mp3_bytes)
+        if mp4_bytes:
+            st.download_button(
+                label="💾 MP4ダウンロード",
+                data=mp4_bytes,
+                file_name=f"ai_response_{timestamp}.mp4",
+                mime=ct.TRANSCODE_PROFILES["mp4"]["mime"],
+                help="AI回答音声をMP4形式でダウンロード"
+            )
+
 def play_wav(audio_output_file_path, speed=1.0):
     """
     音声ファイルの再生（手動再生推奨）
     Args:
         audio_output_file_path: 音声ファイルのパス
-        speed: 再生速度（現在は無効、pydub不使用のため）
+        speed: 再生速度（事前に変換した音声を使用）
     """
     
-    # 速度変更機能の案内
-    if speed != 1.0:
-        st.warning(f"⚠️ 音声速度変更機能は現在無効になっています（指定速度: {speed}x）")
-    
     # ユーザーに明確な操作指示を表示
     st.success("🎵 **問題文の音声が生成されました！**")
     st.info("👇 **下の音声プレーヤーで ▶️ ボタンを押して問題文を聞いてください**")
     
-    # Streamlitの音声再生機能を使用
+    # 音声プレーヤーを表示
     try:
-        with open(audio_output_file_path, 'rb') as audio_file:
-            audio_bytes = audio_file.read()
-            
-            # 手動再生のみ（autoplay=Falseに変更）
-            if audio_output_file_path.endswith('.mp3'):
-                st.audio(audio_bytes, format='audio/mp3', autoplay=False)
-            else:
-                st.audio(audio_bytes, format='audio/wav', autoplay=False)
-            
-            # 追加の案内メッセージ
-            st.markdown("""
-            📢 **音声が聞こえない場合:**
-            - 音声プレーヤーの ▶️ ボタンを手動でクリックしてください
-            - ブラウザの音量設定を確認してください
-            - スピーカーまたはヘッドフォンの接続を確認してください
-            """)
-            
+        # 手動再生のみ（autoplay=Falseに変更）
+        render_audio(resolve_playback_file(audio_output_file_path, speed), autoplay=False)
+
+        # 追加の案内メッセージ
+        st.markdown("""
+        📢 **音声が聞こえない場合:**
+        - 音声プレーヤーの ▶️ ボタンを手動でクリックしてください
+        - ブラウザの音量設定を確認してください
+        - スピーカーまたはヘッドフォンの接続を確認してください
+        """)
+
     except Exception as e:
         st.error(f"🚨 音声ファイルの準備に失敗しました: {e}")
         st.info("音声が利用できませんが、テキストでの問題文は生成されています。")
@@ -185,20 +770,145 @@ def play_wav(audio_output_file_path, speed=1.0):
 def create_chain(system_template):
     """
     LLMによる回答生成用のChain作成
+    バックエンドサービス利用時は、サービスを呼び出すChainを返す
+    """
+
+    if st.session_state.get("backend"):
+        return backend_client.BackendChain(st.session_state.backend, system_template)
+
+    return st.session_state.engine.get_chain(st.session_state.tutor_state, system_template)
+
+def pick_review_problem():
+    """
+    復習時期の単語を含む過去の問題文を選ぶ（LLM・音声合成を呼ばずに出題できる）
+    Returns:
+        (問題文, 音声ファイルのパス)（該当する問題文がない場合はNone）
+    """
+
+    store = session_store.get_session_store()
+    if store is None or not settings.get_settings().review_enabled:
+        return None
+    due_tokens = store.due_review_tokens(st.session_state.learner_id, time.time())
+    if not due_tokens:
+        return None
+    recent = [problem for problem, _ in store.recent_problems(st.session_state.learner_id, ct.REVIEW_RECENT_EXCLUDE)]
+    return review_scheduler.pick_sentence(due_tokens, store.problem_candidates(), exclude=recent)
+
+def prepare_problem():
+    """
+    次の問題文と音声ファイルを用意
+    Returns:
+        (problem, speech_audio, actual_file_path)
     """
 
-    prompt = ChatPromptTemplate.from_messages([
-        SystemMessage(content=system_template),
-        MessagesPlaceholder(variable_name="history"),
-        HumanMessagePromptTemplate.from_template("{input}")
-    ])
-    chain = ConversationChain(
-        llm=st.session_state.llm,
-        memory=st.session_state.memory,
-        prompt=prompt
+    review = pick_review_problem()
+    if review:
+        problem, audio_path = review
+        if audio_path and os.path.exists(audio_path):
+            with open(audio_path, "rb") as audio_file:
+                speech_audio = tts_backends.SpeechAudio(audio_file.read(), os.path.splitext(audio_path)[1].lstrip("."))
+            return problem, speech_audio, audio_path
+        # 音声ファイルが残っていない場合は音声合成のみ行う
+        speech_audio, actual_file_path = synthesize_speech(problem, "problem")
+        return problem, speech_audio, actual_file_path
+
+    # 回答の評価と同時に先読みした問題文と音声があれば使う
+    prefetched = take_prefetched_problem()
+    if prefetched:
+        problem, speech_audio, source_size = prefetched
+        return problem, speech_audio, store_speech_audio(speech_audio, source_size)
+
+    # 問題文を生成
+    problem = create_problem_text()
+
+    # LLMからの回答を音声データに変換し、音声ファイルを作成
+    speech_audio, actual_file_path = synthesize_speech(problem, "problem")
+    return problem, speech_audio, actual_file_path
+
+def create_conversation_response(text):
+    """
+    日常英会話の回答を生成
+    バックエンドサービス利用時は、レート制限はサービス側で行う
+    """
+
+    if st.session_state.get("backend"):
+        return run_interactive(st.session_state.backend.turn, text)
+    model = settings.get_settings().openai_chat_model
+    if not st.session_state.get("use_langchain"):
+        # LangChainのChainを作成できなかった場合の代替（直接OpenAI APIを呼び出すChain）
+        return run_api_call(model, st.session_state.chain_basic_conversation.predict, tokens=ct.RATE_LIMIT_CHAT_TOKENS, input=text)
+    # 同じセッションの会話メモリへの書き込みは、エンジンが状態のロックで順に実行する
+    return run_engine_call(model, st.session_state.engine.converse, st.session_state.tutor_state, text, tokens=ct.RATE_LIMIT_CHAT_TOKENS)
+
+def create_problem_text():
+    """
+    問題文を生成（会話メモリを作成できなかった場合は、会話メモリを使わずに生成）
+    """
+
+    if st.session_state.get("backend"):
+        return run_interactive(st.session_state.backend.problem)
+    return run_engine_call(
+        settings.get_settings().openai_chat_model,
+        st.session_state.engine.next_problem,
+        st.session_state.get("tutor_state"),
+        tokens=ct.RATE_LIMIT_CHAT_TOKENS
     )
 
-    return chain
+def _prepare_problem_in_background(backend, engine, recent_problems, output_format, bit_rate):
+    # ワーカースレッドで実行（st.*やst.session_stateにはアクセスしない）
+    # 評価と同時に実行するため、問題文は会話メモリを使わず、最近の問題文を避けるよう指示して生成する
+    if backend:
+        problem = backend.problem(stateless=True, recent_problems=recent_problems)
+        return problem, backend.synthesize(problem, "problem", output_format, bit_rate), None
+    problem = engine.next_problem(recent_problems=recent_problems)
+    speech_audio, source_size = engine.synthesize(problem, "problem", output_format, bit_rate)
+    return problem, speech_audio, source_size
+
+def prefetch_next_problem():
+    """
+    次の問題文の生成と音声合成をバックグラウンドで開始（回答の評価と同時に実行し、評価を読む間に用意しておく）
+    設定（prefetch_next_problem）が無効の場合や、先読み中の問題文がある場合は何もしない
+    """
+
+    if not settings.get_settings().prefetch_next_problem or "prefetched_problem" in st.session_state:
+        return
+    backend = st.session_state.get("backend")
+    engine = st.session_state.get("engine")
+    if backend is None and engine is None:
+        return
+
+    output_format = settings.get_settings().tts_output_format
+    bit_rate = ct.TTS_OUTPUT_BIT_RATE_BY_MODE.get(st.session_state.get("mode"))
+    st.session_state.prefetched_problem = run_prefetch(
+        _prepare_problem_in_background, backend, engine, get_recent_problems(), output_format, bit_rate
+    )
+
+def get_recent_problems():
+    """
+    最近出題した問題文（新しい順、学習履歴を保存していない場合は表示中の問題文のみ）
+    """
+
+    store = session_store.get_session_store()
+    if store is not None:
+        return [problem for problem, _ in store.recent_problems(st.session_state.learner_id, ct.PREFETCH_RECENT_PROBLEMS)]
+    problem = st.session_state.get("problem")
+    return [problem] if problem else []
+
+def take_prefetched_problem():
+    """
+    先読みした問題文と音声合成結果を取り出す（未完了の場合は完了を待つ）
+    Returns:
+        (problem, speech_audio, source_size)（先読みしていない場合・失敗した場合はNone）
+    """
+
+    job = st.session_state.pop("prefetched_problem", None)
+    if job is None:
+        return None
+    try:
+        return job.result()
+    except Exception as e:
+        print(f"Warning: 次の問題文の先読みに失敗したため、改めて生成します: {e}")
+        return None
 
 def create_problem_and_play_audio():
     """
@@ -209,23 +919,15 @@ def create_problem_and_play_audio():
         openai_obj: OpenAIのオブジェクト
     """
 
-    # 問題文を生成するChainを実行し、問題文を取得
-    problem = st.session_state.chain_create_problem.predict(input="")
-
-    # LLMからの回答を音声データに変換
-    llm_response_audio = st.session_state.openai_obj.audio.speech.create(
-        model="tts-1",
-        voice="alloy",
-        input=problem
-    )
-
-    # 音声ファイルの作成（mp3形式で保存）
-    audio_output_file_path = f"{ct.AUDIO_OUTPUT_DIR}/audio_output_{int(time.time())}.mp3"
-    actual_file_path = save_to_wav(llm_response_audio.content, audio_output_file_path)
+    # 復習時期の単語を含む過去の問題文を再利用し、なければ問題文と音声を生成
+    problem, llm_response_audio, actual_file_path = prepare_problem()
 
     # セッション状態に音声ファイルパスを保存（st.rerun()後も持続するように）
     st.session_state.current_audio_file = actual_file_path
     st.session_state.audio_ready = True
+    record_problem(problem, actual_file_path)
+    # 再生速度を切り替えてもすぐ再生できるよう、速度ごとの音声をバックグラウンドで作成
+    speed_variants.submit_variants(actual_file_path)
 
     return problem, llm_response_audio
 
@@ -234,22 +936,13 @@ def create_problem_and_play_audio_for_shadowing():
     シャドーイング専用の問題生成と音声ファイルの再生
     """
 
-    # 問題文を生成するChainを実行し、問題文を取得
-    problem = st.session_state.chain_create_problem.predict(input="")
-
-    # LLMからの回答を音声データに変換
-    llm_response_audio = st.session_state.openai_obj.audio.speech.create(
-        model="tts-1",
-        voice="alloy",
-        input=problem
-    )
-
-    # 音声ファイルの作成（mp3形式で保存）
-    audio_output_file_path = f"{ct.AUDIO_OUTPUT_DIR}/audio_output_{int(time.time())}.mp3"
-    actual_file_path = save_to_wav(llm_response_audio.content, audio_output_file_path)
+    # 復習時期の単語を含む過去の問題文を再利用し、なければ問題文と音声を生成
+    problem, llm_response_audio, actual_file_path = prepare_problem()
 
     # セッション状態に音声ファイルパスを保存
     st.session_state.current_audio_file = actual_file_path
+    record_problem(problem, actual_file_path)
+    speed_variants.submit_variants(actual_file_path)
     
     # シャドーイング専用の音声プレーヤーを表示
     display_audio_player_for_shadowing()
@@ -288,37 +981,154 @@ def play_wav_for_shadowing(audio_output_file_path, speed=1.0):
     シャドーイング専用の音声再生（メッセージを簡潔にする）
     """
     
-    # 速度変更機能の案内
-    if speed != 1.0:
-        st.warning(f"⚠️ 音声速度変更機能は現在無効になっています（指定速度: {speed}x）")
-    
     # シャドーイング用の操作指示
     st.success("🎵 **シャドーイング問題文の音声**")
     st.info("👇 **音声を聞いてから、同じ内容を録音してください**")
     
-    # Streamlitの音声再生機能を使用
+    # 音声プレーヤーを表示（手動再生のみ）
     try:
-        with open(audio_output_file_path, 'rb') as audio_file:
-            audio_bytes = audio_file.read()
-            
-            # 手動再生のみ
-            if audio_output_file_path.endswith('.mp3'):
-                st.audio(audio_bytes, format='audio/mp3', autoplay=False)
-            else:
-                st.audio(audio_bytes, format='audio/wav', autoplay=False)
-            
+        render_audio(resolve_playback_file(audio_output_file_path, speed), autoplay=False)
     except Exception as e:
         st.error(f"🚨 音声ファイルの準備に失敗しました: {e}")
         return
 
-def create_evaluation():
+def score_shadowing_audio(audio_input_file_path):
+    """
+    お手本の音声（問題文のTTS）と録音を比較し、ローカルで音響スコアを計算
+    Args:
+        audio_input_file_path: 学習者の録音ファイルのパス
+    Returns:
+        音響スコアの辞書（計算できない場合はNone）
+    """
+
+    reference_file_path = st.session_state.get("current_audio_file")
+    if not reference_file_path or not os.path.exists(reference_file_path):
+        return None
+
+    try:
+        with open(reference_file_path, 'rb') as reference_file:
+            reference_audio = reference_file.read()
+        with open(audio_input_file_path, 'rb') as audio_input_file:
+            learner_audio = audio_input_file.read()
+        score = shadowing_scorer.score_shadowing(reference_audio, learner_audio)
+    except Exception as e:
+        print(f"Warning: シャドーイングの音響スコア計算に失敗しました: {e}")
+        return None
+
+    if score:
+        print(f"[シャドーイング音響スコア] 計算時間 {score['elapsed_ms']:.1f}ms")
+    return score
+
+def display_shadowing_score(score, timings=None):
+    """
+    シャドーイングの音響スコアを画面に表示
+    Args:
+        score: 音響スコアの辞書
+        timings: 録音の単語ごとの時刻（あれば発話速度・長い間も表示）
+    Returns:
+        表示したテキスト（メッセージリストへの追加用）
+    """
+
+    score_text = shadowing_scorer.format_shadowing_score(score)
+    if timings is not None and len(timings) > 0:
+        score_text += "\n" + word_timings.format_word_timings(timings)
+    with st.chat_message("assistant", avatar=get_avatar(ct.AI_ICON_PATH)):
+        st.markdown(score_text)
+
+    return score_text
+
+def create_evaluation(llm_text, user_text):
     """
     ユーザー入力値の評価生成
+    Args:
+        llm_text: LLMによる問題文
+        user_text: ユーザーによる回答文
+    """
+
+    if st.session_state.get("backend"):
+        return run_interactive(st.session_state.backend.evaluate, llm_text, user_text)
+
+    # 評価は会話メモリを使わない（評価の指示・問題文・回答で会話の履歴が膨らまないようにする）
+    return run_engine_call(
+        settings.get_settings().openai_chat_model,
+        st.session_state.engine.evaluate,
+        llm_text,
+        user_text,
+        tokens=ct.RATE_LIMIT_CHAT_TOKENS
+    )
+
+def is_dictation_set_mode():
+    """
+    ディクテーションを複数問ごとにまとめて評価するか（設定のdictation_set_sizeが1以上の場合）
+    """
+
+    return settings.get_settings().dictation_set_size > 0
+
+def check_dictation_answer(problem, answer):
+    """
+    セットの途中の回答をLLMを呼ばずに問題文と比較して正誤を表示し、まとめて評価する回答として保持
+    Returns:
+        表示したテキスト（メッセージリストへの追加用）
+    """
+
+    check_text = batch_evaluation.format_check(batch_evaluation.check_answer(problem, answer))
+    with st.chat_message("assistant", avatar=get_avatar(ct.AI_ICON_PATH)):
+        st.markdown(check_text)
+    st.session_state.dictation_set_items.append({"problem": problem, "answer": answer})
+
+    return check_text
+
+def is_dictation_set_complete():
+    """
+    セットの問題数に達したか
+    """
+
+    return len(st.session_state.dictation_set_items) >= settings.get_settings().dictation_set_size
+
+def create_set_evaluation(items):
+    """
+    セットの問題文と回答をまとめて評価（1回のLLM呼び出し）
+    Returns:
+        (問題ごとのフィードバックのリスト, 総評)
     """
 
-    llm_response_evaluation = st.session_state.chain_evaluation.predict(input="")
+    if st.session_state.get("backend"):
+        return run_interactive(st.session_state.backend.evaluate_set, items)
+    return run_engine_call(
+        settings.get_settings().openai_chat_model,
+        st.session_state.engine.evaluate_set,
+        items,
+        tokens=batch_evaluation.estimate_set_tokens(items)
+    )
+
+def display_set_evaluation():
+    """
+    保持しているセットの回答をまとめて評価し、問題ごとのフィードバックと総評を表示・保存
+    """
+
+    items = st.session_state.dictation_set_items
+    feedbacks, summary = create_set_evaluation(items)
+
+    for number, (item, feedback) in enumerate(zip(items, feedbacks), 1):
+        feedback_text = f"**【{number}】** {item['problem']}\n\n{feedback}"
+        with st.chat_message("assistant", avatar=get_avatar(ct.AI_ICON_PATH)):
+            st.markdown(feedback_text)
+        append_message("assistant", feedback_text)
+        record_score(item["problem"], item["answer"], feedback)
+
+    summary_text = f"**【総評】**（{len(items)}問）\n\n{summary}"
+    with st.chat_message("assistant", avatar=get_avatar(ct.AI_ICON_PATH)):
+        st.markdown(summary_text)
+    append_message("assistant", summary_text)
+    append_message("other")
+    st.session_state.dictation_set_items = []
+
+def create_backend_client():
+    """
+    バックエンドサービスのクライアントを作成（Streamlitのセッションごと）
+    """
 
-    return llm_response_evaluation
+    return backend_client.BackendClient(settings.get_settings().backend_url)
 
 # LangChain代替関数（Pydantic互換性問題の回避用）
 def create_simple_openai_client(api_key):
@@ -328,33 +1138,46 @@ def create_simple_openai_client(api_key):
     from openai import OpenAI
     return OpenAI(api_key=api_key)
 
-def simple_chat_completion(client, messages, model="gpt-4o-mini", temperature=0.5):
+def simple_chat_completion(client, messages, model=None, temperature=None):
     """
     OpenAI API直接呼び出しでチャット補完（LangChain代替）
+    model・temperatureを省略した場合は設定（settings.py）の値を使用
+    再試行しても失敗した場合は、LangChainのChainと同じく例外を送出する
     """
-    try:
-        response = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            temperature=temperature
-        )
-        return response.choices[0].message.content
-    except Exception as e:
-        return f"API呼び出しエラー: {e}"
+    config = settings.get_settings()
+    model = model or config.openai_chat_model
+    temperature = config.chat_temperature if temperature is None else temperature
+    # 429エラー時は待機して再試行（初回の枠は呼び出し元のrun_api_callで予約済み）
+    response = rate_limiter.get_rate_limiter().call(
+        model,
+        client.chat.completions.create,
+        kwargs={"model": model, "messages": messages, "temperature": temperature},
+        reserved=True
+    )
+    llm_usage.record_openai_usage(response.usage)
+    return response.choices[0].message.content
+
+# LangChainのメッセージの種類とOpenAI APIの役割の対応
+OPENAI_MESSAGE_ROLES = {"human": "user", "ai": "assistant", "system": "system"}
 
 def create_conversation_messages(system_prompt, conversation_history, user_input):
     """
     会話履歴から OpenAI API用のメッセージ形式を作成
+    Args:
+        conversation_history: TokenWindowHistory（API用の形式で保持済み）またはLangChainのメッセージのリスト
     """
     messages = [
         {"role": "system", "content": system_prompt}
     ]
     
     # 会話履歴を追加
-    for msg in conversation_history:
-        if hasattr(msg, 'content'):
-            role = "assistant" if hasattr(msg, 'type') and msg.type == "ai" else "user"
-            messages.append({"role": role, "content": msg.content})
+    if isinstance(conversation_history, conversation_memory.TokenWindowHistory):
+        messages.extend(conversation_history.messages)
+    else:
+        messages.extend(
+            {"role": OPENAI_MESSAGE_ROLES.get(msg.type, "user"), "content": msg.content}
+            for msg in conversation_history
+        )
     
     # 現在のユーザー入力を追加
     messages.append({"role": "user", "content": user_input})
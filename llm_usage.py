@@ -0,0 +1,58 @@
+"""
+LLM呼び出しのトークン数（プロンプトキャッシュに一致した分を含む）の記録
+OpenAIはプロンプトの先頭部分（1024トークン以上）が直前の呼び出しと一致する場合にキャッシュを使い、APIのusageでキャッシュに一致したトークン数を返す
+（実際にキャッシュに一致したかどうかは、呼び出しごとのログで確認する）
+"""
+import threading
+from langchain_core.callbacks import BaseCallbackHandler
+
+_totals = {"calls": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+_totals_lock = threading.Lock()
+
+def record_usage(input_tokens, cached_tokens, output_tokens):
+    """
+    1回の呼び出しのトークン数をログに出力し、プロセス全体の合計に加える
+    """
+
+    with _totals_lock:
+        _totals["calls"] += 1
+        _totals["input_tokens"] += input_tokens
+        _totals["cached_tokens"] += cached_tokens
+        _totals["output_tokens"] += output_tokens
+    cached_ratio = cached_tokens / input_tokens if input_tokens else 0
+    print(f"[llm] 入力 {input_tokens} tokens（キャッシュ {cached_tokens}、{cached_ratio:.0%}）、出力 {output_tokens} tokens")
+
+def record_openai_usage(usage):
+    """
+    OpenAIクライアントの応答のusageを記録（LangChainを使わない呼び出し用）
+    """
+
+    if usage is None:
+        return
+    details = getattr(usage, "prompt_tokens_details", None)
+    record_usage(usage.prompt_tokens, getattr(details, "cached_tokens", None) or 0, usage.completion_tokens)
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """
+    ChatOpenAIの呼び出しごとにトークン数を記録するコールバック（ワーカースレッドからも呼ばれる）
+    """
+
+    def on_llm_end(self, response, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage:
+                    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read") or 0
+                    record_usage(usage["input_tokens"], cached_tokens, usage["output_tokens"])
+
+USAGE_HANDLER = UsageCallbackHandler()
+
+def metrics():
+    """
+    プロセス全体のトークン数の合計と、入力のうちキャッシュに一致した割合
+    """
+
+    with _totals_lock:
+        totals = dict(_totals)
+    totals["cached_ratio"] = totals["cached_tokens"] / totals["input_tokens"] if totals["input_tokens"] else 0.0
+    return totals
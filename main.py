@@ -2,9 +2,7 @@ import streamlit as st
 import os
 import time
 from time import sleep
-from pathlib import Path
 from streamlit.components.v1 import html
-from langchain.memory import ConversationSummaryBufferMemory
 from langchain.chains import ConversationChain
 from langchain.prompts import (
     ChatPromptTemplate,
@@ -14,14 +12,13 @@ from langchain.prompts import (
 from langchain.schema import SystemMessage
 from openai import OpenAI
 from langchain_openai import ChatOpenAI
-# Streamlit Cloud対応：python-dotenvの代わりにStreamlit Secretsを使用
-try:
-    from dotenv import load_dotenv
-    DOTENV_AVAILABLE = True
-except ImportError:
-    DOTENV_AVAILABLE = False
 import functions as ft
 import constants as ct
+import settings
+import conversation_memory
+import dev_profiler
+import llm_usage
+import tutor_engine
 
 # Pydantic互換性の問題を解決
 try:
@@ -32,44 +29,16 @@ except Exception as e:
     print(f"Warning: ChatOpenAI model rebuild failed: {e}")
     # 継続して実行
 
+# 開発用: 実行ごとの処理時間・メモリ確保を記録（このファイルを計測しながら実行し直し、元の実行はここで終える）
+if dev_profiler.is_requested(st.query_params) and not dev_profiler.is_active():
+    dev_profiler.run_profiled(__file__, ft.get_session_id(), st.session_state.get("mode"))
+    st.stop()
 
 # 各種設定
-# .envファイルを明示的に読み込み（ローカル環境のみ）
-if DOTENV_AVAILABLE:
-    env_path = Path('.') / '.env'
-    load_dotenv(dotenv_path=env_path, override=True)
-
-# API key の設定（Streamlit Cloud + ローカル対応）
-def get_openai_api_key():
-    # 1. Streamlit Secrets
-    try:
-        if hasattr(st, 'secrets') and 'OPENAI_API_KEY' in st.secrets:
-            return st.secrets['OPENAI_API_KEY']
-    except Exception:
-        pass
-    
-    # 2. 環境変数
-    if "OPENAI_API_KEY" in os.environ:
-        return os.environ["OPENAI_API_KEY"]
-    
-    # 3. .envファイル（ローカル開発用）
-    if DOTENV_AVAILABLE:
-        env_file = Path(".env")
-        if env_file.exists():
-            with open(env_file, 'r', encoding='utf-8') as f:
-                for line in f:
-                    line = line.strip()
-                    if line.startswith('OPENAI_API_KEY=') and not line.startswith('#'):
-                        key_value = line.split('=', 1)
-                        if len(key_value) == 2:
-                            return key_value[1].strip('"\'')
-    
-    return None
-
-# OpenAI API key の設定
-api_key = get_openai_api_key()
-if api_key:
-    os.environ['OPENAI_API_KEY'] = api_key
+# 環境変数・.env・Streamlit Secretsはプロセスごとに一度だけ読み込む（設定ファイルの変更時のみ再読み込み）
+config = settings.get_settings()
+if config.openai_api_key:
+    os.environ['OPENAI_API_KEY'] = config.openai_api_key
 
 st.set_page_config(
     page_title=ct.APP_NAME
@@ -95,50 +64,31 @@ if "messages" not in st.session_state:
     st.session_state.dictation_first_flg = True
     st.session_state.dictation_chat_message = ""
     st.session_state.dictation_evaluation_first_flg = True
+    st.session_state.dictation_set_items = []  # まとめて評価する回答（セットモード）
     st.session_state.chat_open_flg = False
     st.session_state.problem = ""
     st.session_state.audio_ready = False
     st.session_state.current_audio_file = None
+    # 学習者IDに対応する保存済みの会話履歴を読み込む（古い履歴は必要になった時に読み込む）
+    st.session_state.learner_id = ft.get_learner_id()
+    ft.load_history()
     
     # OpenAI関連の初期化も一度だけ実行
 
+# バックエンドサービス利用時は、APIクライアントを持たない薄いクライアントとして初期化
+if config.backend_url and "chain_basic_conversation" not in st.session_state:
+    st.session_state.backend = ft.create_backend_client()
+    st.session_state.use_langchain = False
+    st.session_state.chain_basic_conversation = ft.create_chain(ct.SYSTEM_TEMPLATE_BASIC_CONVERSATION)
+
 # OpenAI API とLangChainの初期化（必要時のみ）
 if "chain_basic_conversation" not in st.session_state:
     st.info("🔄 OpenAI APIとLangChainを初期化中...")
     
-    # OpenAI APIキーの取得（複数の方法を試行）
-    api_key = None
-    
-    # 方法1: 環境変数から直接取得
-    api_key = os.environ.get("OPENAI_API_KEY")
-    
-    # 方法2: .envファイルから手動読み込み
-    if not api_key:
-        env_file = Path(".env")
-        if env_file.exists():
-            try:
-                with open(env_file, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line.startswith('OPENAI_API_KEY=') and not line.startswith('#'):
-                            key_value = line.split('=', 1)
-                            if len(key_value) == 2:
-                                api_key = key_value[1].strip('"\'')
-                                os.environ['OPENAI_API_KEY'] = api_key
-                                break
-            except Exception as e:
-                st.warning(f".envファイル読み込みエラー: {e}")
-    
-    # 方法3: Streamlit secretsから取得
-    if not api_key:
-        try:
-            if hasattr(st, 'secrets') and "OPENAI_API_KEY" in st.secrets:
-                api_key = st.secrets["OPENAI_API_KEY"]
-        except Exception:
-            pass
-    
+    api_key = config.openai_api_key
+
     # APIキーの検証
-    if not api_key or api_key == "your-openai-api-key-here" or len(api_key) < 20:
+    if not config.has_valid_api_key:
         st.error("🔑 OpenAI APIキーが設定されていません。")
         st.info("""
         **APIキーの設定方法:**
@@ -160,8 +110,8 @@ if "chain_basic_conversation" not in st.session_state:
             try:
                 st.session_state.llm = ChatOpenAI(
                     api_key=api_key,
-                    model="gpt-4o-mini",
-                    temperature=0.5
+                    model=config.openai_chat_model,
+                    temperature=config.chat_temperature
                 )
                 llm_initialized = True
                 st.success("✅ ChatOpenAI初期化成功（方法1）")
@@ -173,8 +123,8 @@ if "chain_basic_conversation" not in st.session_state:
             try:
                 st.session_state.llm = ChatOpenAI(
                     openai_api_key=api_key,
-                    model="gpt-4o-mini",
-                    temperature=0.5
+                    model=config.openai_chat_model,
+                    temperature=config.chat_temperature
                 )
                 llm_initialized = True
                 st.success("✅ ChatOpenAI初期化成功（方法2）")
@@ -186,8 +136,8 @@ if "chain_basic_conversation" not in st.session_state:
             try:
                 os.environ['OPENAI_API_KEY'] = api_key
                 st.session_state.llm = ChatOpenAI(
-                    model="gpt-4o-mini",
-                    temperature=0.5
+                    model=config.openai_chat_model,
+                    temperature=config.chat_temperature
                 )
                 llm_initialized = True
                 st.success("✅ ChatOpenAI初期化成功（方法3）")
@@ -199,8 +149,8 @@ if "chain_basic_conversation" not in st.session_state:
             try:
                 st.session_state.llm = ChatOpenAI(
                     openai_api_key=api_key,
-                    model_name="gpt-4o-mini",
-                    temperature=0.5
+                    model_name=config.openai_chat_model,
+                    temperature=config.chat_temperature
                 )
                 llm_initialized = True
                 st.success("✅ ChatOpenAI初期化成功（方法4 - 旧形式）")
@@ -209,14 +159,18 @@ if "chain_basic_conversation" not in st.session_state:
         
         if not llm_initialized:
             raise Exception("すべてのChatOpenAI初期化方法が失敗しました")
+        # 呼び出しごとのトークン数（プロンプトキャッシュに一致した分を含む）をログに出力
+        st.session_state.llm.callbacks = [llm_usage.USAGE_HANDLER]
+        # 会話・出題・評価・文字起こし・音声合成はStreamlitに依存しないエンジンで行い、画面はその結果を表示する
+        st.session_state.engine = tutor_engine.EnglishTutorEngine(st.session_state.openai_obj, st.session_state.llm)
         
         # LangChainのメモリとチェーンを初期化
         try:
-            st.session_state.memory = ConversationSummaryBufferMemory(
-                llm=st.session_state.llm,
-                max_token_limit=1000,
-                return_messages=True
-            )
+            # 会話メモリとChainを持つセッションの状態（会話メモリはトークン数をメッセージごとにキャッシュする）
+            st.session_state.tutor_state = st.session_state.engine.new_state()
+            st.session_state.memory = st.session_state.tutor_state.memory
+            # 前回までの要約と直近の会話から会話メモリを復元
+            ft.restore_memory(st.session_state.memory)
 
             # モード「日常英会話」用のChain作成
             st.session_state.chain_basic_conversation = ft.create_chain(ct.SYSTEM_TEMPLATE_BASIC_CONVERSATION)
@@ -226,31 +180,32 @@ if "chain_basic_conversation" not in st.session_state:
         except Exception as chain_error:
             st.warning(f"⚠️ LangChainチェーン作成失敗、直接OpenAI API使用モードに切り替えます: {chain_error}")
             st.session_state.use_langchain = False
-            st.session_state.conversation_history = []  # 代替の会話履歴管理
             
             # フォールバック用のダミーチェーンオブジェクトを作成
             class FallbackChain:
-                def __init__(self, api_key):
+                def __init__(self, api_key, max_tokens):
                     self.api_key = api_key
                     self.client = ft.create_simple_openai_client(api_key)
+                    # 直近の会話（トークン数の上限を超えた分は古い往復から捨てる）
+                    self.history = conversation_memory.TokenWindowHistory(max_tokens)
                 
                 def predict(self, input):
-                    try:
-                        # シンプルな会話システムプロンプト
-                        system_prompt = """あなたは優しく親切な英会話講師です。
+                    # シンプルな会話システムプロンプト
+                    system_prompt = """あなたは優しく親切な英会話講師です。
 ユーザーの英語に対して自然で適切な返答をしてください。
 英語で返答し、発音しやすい文章を心がけてください。"""
-                        
-                        messages = [
-                            {"role": "system", "content": system_prompt},
-                            {"role": "user", "content": input}
-                        ]
-                        
-                        return ft.simple_chat_completion(self.client, messages)
-                    except Exception as e:
-                        return f"申し訳ございません。応答の生成でエラーが発生しました: {e}"
+                    
+                    # 今回の入力と合わせて上限に収まるよう履歴を詰める
+                    self.history.trim(self.history.max_tokens - conversation_memory.count_message_tokens(input))
+                    messages = ft.create_conversation_messages(system_prompt, self.history, input)
+                    
+                    # API呼び出しに失敗した場合は、LangChainのChainと同じく例外をそのまま呼び出し元に伝える
+                    response = ft.simple_chat_completion(self.client, messages)
+                    self.history.add_turn(input, response)
+                    return response
             
-            st.session_state.chain_basic_conversation = FallbackChain(api_key)
+            st.session_state.chain_basic_conversation = FallbackChain(api_key, config.memory_max_token_limit)
+            st.session_state.conversation_history = st.session_state.chain_basic_conversation.history  # 代替の会話履歴管理
             st.info("✅ フォールバックモードで初期化完了")
         
     except Exception as e:
@@ -258,6 +213,9 @@ if "chain_basic_conversation" not in st.session_state:
         st.info("APIキーが正しく設定されているか確認してください。")
         st.stop()
 
+# セッションの使用量を記録し、上限を超えた場合は整理（放置された他のセッションの後始末もあわせて行う）
+ft.account_session()
+
 # 初期表示
 # col1, col2, col3, col4 = st.columns([1, 1, 1, 2])
 # 提出課題用
@@ -273,6 +231,8 @@ with col3:
     st.session_state.mode = st.selectbox(label="モード", options=[ct.MODE_1, ct.MODE_2, ct.MODE_3], label_visibility="collapsed")
     # モードを変更した際の処理
     if st.session_state.mode != st.session_state.pre_mode:
+        # 前のモードで投入した未完了の処理を破棄
+        ft.cancel_session_jobs()
         # 自動でそのモードの処理が実行されないようにする
         st.session_state.start_flg = False
         # 「日常英会話」選択時の初期化処理
@@ -293,7 +253,7 @@ with col3:
 with col4:
     st.session_state.englv = st.selectbox(label="英語レベル", options=ct.ENGLISH_LEVEL_OPTION, label_visibility="collapsed")
 
-with st.chat_message("assistant", avatar="images/ai_icon.jpg"):
+with st.chat_message("assistant", avatar=ft.get_avatar(ct.AI_ICON_PATH)):
     st.markdown("こちらは生成AIによる音声英会話の練習アプリです。何度も繰り返し練習し、英語力をアップさせましょう。")
     st.markdown("**【操作説明】**")
     st.success("""
@@ -317,22 +277,26 @@ with st.chat_message("assistant", avatar="images/ai_icon.jpg"):
             """)
 st.divider()
 
+# 保存済みの古い会話履歴は、ボタンが押された時に1ページずつ読み込む
+if st.session_state.history_has_more:
+    if st.button("⬆️ 過去の履歴をさらに表示"):
+        ft.load_older_history()
+        st.rerun()
+
 # メッセージリストの一覧表示
-for message in st.session_state.messages:
-    if message["role"] == "assistant":
-        with st.chat_message(message["role"], avatar="images/ai_icon.jpg"):
-            st.markdown(message["content"])
-    elif message["role"] == "user":
-        with st.chat_message(message["role"], avatar="images/user_icon.jpg"):
-            st.markdown(message["content"])
-    else:
-        st.divider()
+ft.display_messages(st.session_state.messages)
 
 # LLMレスポンスの下部にモード実行のボタン表示
 if st.session_state.shadowing_flg:
     st.session_state.shadowing_button_flg = st.button("シャドーイング開始")
 if st.session_state.dictation_flg:
     st.session_state.dictation_button_flg = st.button("ディクテーション開始")
+    # セットの途中でも、それまでの回答をまとめて評価できるようにする
+    if st.session_state.dictation_set_items and st.button(f"ここまでの{len(st.session_state.dictation_set_items)}問をまとめて評価"):
+        with st.spinner('評価結果の生成中...'):
+            ft.display_set_evaluation()
+        ft.flush_session_store()
+        st.rerun()
 
 # 「ディクテーション」モードのチャット入力受付時に実行
 if st.session_state.chat_open_flg:
@@ -352,7 +316,6 @@ if st.session_state.start_flg:
     # 「ディクテーション」ボタン押下時か、「英会話開始」ボタン押下時か、チャット送信時
     if st.session_state.mode == ct.MODE_3 and (st.session_state.dictation_button_flg or st.session_state.dictation_count == 0 or st.session_state.dictation_chat_message):
         if st.session_state.dictation_first_flg:
-            st.session_state.chain_create_problem = ft.create_chain(ct.SYSTEM_TEMPLATE_CREATE_PROBLEM)
             st.session_state.dictation_first_flg = False
         # チャット入力以外
         if not st.session_state.chat_open_flg:
@@ -361,6 +324,7 @@ if st.session_state.start_flg:
 
             st.session_state.chat_open_flg = True
             st.session_state.dictation_flg = False
+            ft.flush_session_store()
             st.rerun()
         # チャット入力時の処理
         else:
@@ -369,29 +333,41 @@ if st.session_state.start_flg:
                 st.stop()
             
             # AIメッセージとユーザーメッセージの画面表示
-            with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+            with st.chat_message("assistant", avatar=ft.get_avatar(ct.AI_ICON_PATH)):
                 st.markdown(st.session_state.problem)
-            with st.chat_message("user", avatar=ct.USER_ICON_PATH):
+            with st.chat_message("user", avatar=ft.get_avatar(ct.USER_ICON_PATH)):
                 st.markdown(st.session_state.dictation_chat_message)
 
             # LLMが生成した問題文とチャット入力値をメッセージリストに追加
-            st.session_state.messages.append({"role": "assistant", "content": st.session_state.problem})
-            st.session_state.messages.append({"role": "user", "content": st.session_state.dictation_chat_message})
+            ft.append_message("assistant", st.session_state.problem)
+            ft.append_message("user", st.session_state.dictation_chat_message)
+            # 評価と同時に次の問題文を用意しておく（設定で有効な場合）
+            ft.prefetch_next_problem()
             
-            with st.spinner('評価結果の生成中...'):
-                system_template = ct.SYSTEM_TEMPLATE_EVALUATION.format(
-                    llm_text=st.session_state.problem,
-                    user_text=st.session_state.dictation_chat_message
-                )
-                st.session_state.chain_evaluation = ft.create_chain(system_template)
-                # 問題文と回答を比較し、評価結果の生成を指示するプロンプトを作成
-                llm_response_evaluation = ft.create_evaluation()
-            
-            # 評価結果のメッセージリストへの追加と表示
-            with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
-                st.markdown(llm_response_evaluation)
-            st.session_state.messages.append({"role": "assistant", "content": llm_response_evaluation})
-            st.session_state.messages.append({"role": "other"})
+            if ft.is_dictation_set_mode():
+                # セットの途中は正誤のみをその場で表示し、セットの最後にまとめて評価
+                check_text = ft.check_dictation_answer(st.session_state.problem, st.session_state.dictation_chat_message)
+                ft.append_message("assistant", check_text)
+                ft.append_message("other")
+                if ft.is_dictation_set_complete():
+                    with st.spinner('セット全体の評価結果の生成中...'):
+                        ft.display_set_evaluation()
+            else:
+                with st.spinner('評価結果の生成中...'):
+                    # 問題文と回答を比較し、評価結果を生成
+                    llm_response_evaluation = ft.create_evaluation(
+                        st.session_state.problem,
+                        st.session_state.dictation_chat_message
+                    )
+                
+                # 評価結果のメッセージリストへの追加と表示
+                with st.chat_message("assistant", avatar=ft.get_avatar(ct.AI_ICON_PATH)):
+                    st.markdown(llm_response_evaluation)
+                ft.append_message("assistant", llm_response_evaluation)
+                ft.append_message("other")
+                ft.record_score(st.session_state.problem, st.session_state.dictation_chat_message, llm_response_evaluation)
+            # 聞き取れなかった単語を復習項目に登録し、次回以降の出題に反映
+            ft.update_review_schedule(st.session_state.problem, st.session_state.dictation_chat_message)
             
             # 各種フラグの更新
             st.session_state.dictation_flg = True
@@ -399,6 +375,7 @@ if st.session_state.start_flg:
             st.session_state.dictation_count += 1
             st.session_state.chat_open_flg = False
 
+            ft.flush_session_store()
             st.rerun()
 
     
@@ -411,45 +388,46 @@ if st.session_state.start_flg:
             # 音声入力ファイルから文字起こしテキストを取得
             with st.spinner('音声入力をテキストに変換中...'):
                 transcript = ft.transcribe_audio(audio_input_file_path)
-                audio_input_text = transcript.text
+
+            # 無音の録音は文字起こしせずに再録音を促す
+            if transcript is None:
+                st.warning("🔇 音声が検出されませんでした。もう一度録音してください。")
+                st.stop()
+            audio_input_text = transcript.text
 
             # 音声入力テキストの画面表示
-            with st.chat_message("user", avatar=ct.USER_ICON_PATH):
+            with st.chat_message("user", avatar=ft.get_avatar(ct.USER_ICON_PATH)):
                 st.markdown(audio_input_text)
 
             with st.spinner("🤖 AI回答を生成中..."):
                 # ユーザー入力値をLLMに渡して回答取得
-                llm_response = st.session_state.chain_basic_conversation.predict(input=audio_input_text)
+                llm_response = ft.create_conversation_response(audio_input_text)
             
-            with st.spinner("🎤 音声を生成中..."):
-                # LLMからの回答を音声データに変換
-                llm_response_audio = st.session_state.openai_obj.audio.speech.create(
-                model="tts-1",
-                voice="alloy",
-                input=llm_response
-            )
-
-            # mp3形式で音声ファイル作成
-            audio_output_file_path = f"{ct.AUDIO_OUTPUT_DIR}/audio_output_{int(time.time())}.mp3"
-            actual_file_path = ft.save_to_wav(llm_response_audio.content, audio_output_file_path)
+            if ft.is_speech_streaming_enabled():
+                # 音声合成の結果を生成されたそばから再生（最初のチャンクの到着で再生開始）
+                actual_file_path = ft.play_speech_stream(llm_response, "conversation")
+            else:
+                with st.spinner("🎤 音声を生成中..."):
+                    # LLMからの回答を音声データに変換し、音声ファイルを作成
+                    llm_response_audio, actual_file_path = ft.synthesize_speech(llm_response, "conversation")
 
-            # 音声ファイルの読み上げ（日常英会話モード専用自動再生）
-            ft.play_wav_auto_for_conversation(actual_file_path, speed=st.session_state.speed)
+                # 音声ファイルの読み上げ（日常英会話モード専用自動再生）
+                ft.play_wav_auto_for_conversation(actual_file_path, speed=st.session_state.speed)
 
             # AIメッセージの画面表示とリストへの追加
-            with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+            with st.chat_message("assistant", avatar=ft.get_avatar(ct.AI_ICON_PATH)):
                 st.markdown(llm_response)
 
             # ユーザー入力値とLLMからの回答をメッセージ一覧に追加
-            st.session_state.messages.append({"role": "user", "content": audio_input_text})
-            st.session_state.messages.append({"role": "assistant", "content": llm_response})
+            ft.append_message("user", audio_input_text)
+            ft.append_message("assistant", llm_response)
+            ft.flush_session_store()
 
 
     # モード：「シャドーイング」
     # 「シャドーイング」ボタン押下時か、「英会話開始」ボタン押下時
     if st.session_state.mode == ct.MODE_2 and (st.session_state.shadowing_button_flg or st.session_state.shadowing_count == 0 or st.session_state.shadowing_audio_input_flg):
         if st.session_state.shadowing_first_flg:
-            st.session_state.chain_create_problem = ft.create_chain(ct.SYSTEM_TEMPLATE_CREATE_PROBLEM)
             st.session_state.shadowing_first_flg = False
         
         if not st.session_state.shadowing_audio_input_flg:
@@ -462,42 +440,63 @@ if st.session_state.start_flg:
         
         if ft.record_audio_for_shadowing(audio_input_file_path):
             st.session_state.shadowing_audio_input_flg = False
+            # 文字起こし・評価と同時に次の問題文を用意しておく（設定で有効な場合）
+            ft.prefetch_next_problem()
+
+            # お手本の音声と録音を比較して音響スコアを計算（文字起こしで録音が削除される前に実行）
+            shadowing_score = ft.score_shadowing_audio(audio_input_file_path)
 
             with st.spinner('音声入力をテキストに変換中...'):
-                # 音声入力ファイルから文字起こしテキストを取得
-                transcript = ft.transcribe_audio(audio_input_file_path)
-                audio_input_text = transcript.text
+                # 音声入力ファイルから文字起こしテキストを取得（単語ごとの時刻も取得）
+                transcript = ft.transcribe_audio(audio_input_file_path, word_timestamps=ct.SHADOWING_WORD_TIMESTAMPS)
+
+            # 無音の録音は評価せずに再録音を促す
+            if transcript is None:
+                st.session_state.shadowing_audio_input_flg = True
+                st.warning("🔇 音声が検出されませんでした。もう一度録音してください。")
+                st.stop()
+            audio_input_text = transcript.text
+            # 単語ごとの時刻はフィードバックや区間ごとの再生に再利用できるよう保持
+            st.session_state.shadowing_word_timings = transcript.word_timings
+            # 単語ごとの時刻は無音トリミング後の音声が基準のため、その音声のパスも保持
+            st.session_state.shadowing_word_timings_audio_path = transcript.audio_path
 
             # AIメッセージとユーザーメッセージの画面表示
-            with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+            with st.chat_message("assistant", avatar=ft.get_avatar(ct.AI_ICON_PATH)):
                 st.markdown(st.session_state.problem)
-            with st.chat_message("user", avatar=ct.USER_ICON_PATH):
+            with st.chat_message("user", avatar=ft.get_avatar(ct.USER_ICON_PATH)):
                 st.markdown(audio_input_text)
             
             # LLMが生成した問題文と音声入力値をメッセージリストに追加
-            st.session_state.messages.append({"role": "assistant", "content": st.session_state.problem})
-            st.session_state.messages.append({"role": "user", "content": audio_input_text})
+            ft.append_message("assistant", st.session_state.problem)
+            ft.append_message("user", audio_input_text)
 
             with st.spinner('評価結果の生成中...'):
-                if st.session_state.shadowing_evaluation_first_flg:
-                    system_template = ct.SYSTEM_TEMPLATE_EVALUATION.format(
-                        llm_text=st.session_state.problem,
-                        user_text=audio_input_text
-                    )
-                    st.session_state.chain_evaluation = ft.create_chain(system_template)
-                    st.session_state.shadowing_evaluation_first_flg = False
-                # 問題文と回答を比較し、評価結果の生成を指示するプロンプトを作成
-                llm_response_evaluation = ft.create_evaluation()
+                # 問題文と回答を比較し、評価結果を生成（毎回その問題文と回答で評価する）
+                llm_response_evaluation = ft.create_evaluation(
+                    st.session_state.problem,
+                    audio_input_text
+                )
+                st.session_state.shadowing_evaluation_first_flg = False
             
             # 評価結果のメッセージリストへの追加と表示
-            with st.chat_message("assistant", avatar=ct.AI_ICON_PATH):
+            with st.chat_message("assistant", avatar=ft.get_avatar(ct.AI_ICON_PATH)):
                 st.markdown(llm_response_evaluation)
-            st.session_state.messages.append({"role": "assistant", "content": llm_response_evaluation})
-            st.session_state.messages.append({"role": "other"})
+            ft.append_message("assistant", llm_response_evaluation)
+
+            # 音響スコア（リズム・タイミング）の表示
+            if shadowing_score:
+                shadowing_score_text = ft.display_shadowing_score(shadowing_score, transcript.word_timings)
+                ft.append_message("assistant", shadowing_score_text)
+            ft.append_message("other")
+            ft.record_score(st.session_state.problem, audio_input_text, llm_response_evaluation, shadowing_score)
+            # 聞き取れなかった単語を復習項目に登録し、次回以降の出題に反映
+            ft.update_review_schedule(st.session_state.problem, audio_input_text)
             
             # 各種フラグの更新
             st.session_state.shadowing_flg = True
             st.session_state.shadowing_count += 1
 
         # 「シャドーイング」ボタンを表示するために再描画
+        ft.flush_session_store()
         st.rerun()
\ No newline at end of file
@@ -0,0 +1,234 @@
+import sqlite3
+import threading
+import time
+from openai import RateLimitError
+import constants as ct
+import settings
+
+_limiter = None
+_limiter_config = None  # 現在のモデル名と上限の対応を作成した設定
+_limiter_lock = threading.Lock()
+
+class RateLimitWaitTooLong(Exception):
+    """
+    待ち時間の見込みが上限（ct.RATE_LIMIT_MAX_WAIT）を超えるため受け付けなかった場合の例外
+    """
+
+    def __init__(self, model, wait_sec):
+        super().__init__(f"{model} のリクエストが混雑しています（待ち時間の見込み: 約{wait_sec:.0f}秒）")
+        self.model = model
+        self.wait_sec = wait_sec
+
+def _refill(tokens, updated, capacity, now):
+    # 経過時間に応じてトークンを補充（1分でcapacity分）
+    return min(capacity, tokens + (now - updated) * capacity / 60.0)
+
+class MemoryBucketStore:
+    """
+    プロセス内で共有するトークンバケット
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def reserve(self, requests, now, dry_run=False):
+        """
+        複数のバケットからまとめてトークンを予約
+        Args:
+            requests: (バケット名, 容量, 消費量) のリスト
+            now: 現在時刻
+            dry_run: Trueの場合は待ち時間の見込みだけを返し、予約しない
+        Returns:
+            予約したトークンが使えるようになるまでの待ち時間（秒）
+        """
+
+        with self.lock:
+            wait_sec = 0.0
+            for key, capacity, amount in requests:
+                tokens, updated = self.buckets.get(key, (capacity, now))
+                tokens = _refill(tokens, updated, capacity, now) - amount
+                # 残量がマイナスの分だけ補充を待つ（先に予約したリクエストから順に処理される）
+                wait_sec = max(wait_sec, -tokens * 60.0 / capacity if tokens < 0 else 0.0)
+                if not dry_run:
+                    self.buckets[key] = (tokens, now)
+            return wait_sec
+
+    def drain(self, key, capacity, now):
+        """
+        429エラーを受けた場合にバケットを空にし、しばらく新しいリクエストを抑える
+        """
+
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (capacity, now))
+            self.buckets[key] = (min(0.0, _refill(tokens, updated, capacity, now)), now)
+
+class SQLiteBucketStore:
+    """
+    SQLiteファイルを介して複数プロセスで共有するトークンバケット
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated REAL)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _update(self, requests, now, dry_run, drain=False):
+        conn = self._connect()
+        try:
+            # 書き込みロックを取ってから読み書きし、プロセス間で予約が重ならないようにする
+            conn.execute("BEGIN IMMEDIATE")
+            wait_sec = 0.0
+            for key, capacity, amount in requests:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens, updated = row if row else (capacity, now)
+                tokens = _refill(tokens, updated, capacity, now) - amount
+                if drain:
+                    tokens = min(0.0, tokens)
+                wait_sec = max(wait_sec, -tokens * 60.0 / capacity if tokens < 0 else 0.0)
+                if not dry_run:
+                    conn.execute("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)", (key, tokens, now))
+            conn.execute("COMMIT")
+            return wait_sec
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def reserve(self, requests, now, dry_run=False):
+        return self._update(requests, now, dry_run)
+
+    def drain(self, key, capacity, now):
+        self._update([(key, capacity, 0)], now, dry_run=False, drain=True)
+
+class RateLimiter:
+    """
+    モデルごとのリクエスト数・トークン数の上限を守るためのレートリミッター
+    上限に達している場合はエラーにせず、トークンが補充されるまで待機する
+    """
+
+    def __init__(self, store, limits=None):
+        self.store = store
+        self.limits = limits or {}
+
+    def _requests(self, model, tokens):
+        limit = self.limits.get(model)
+        if not limit:
+            return []
+        requests = [(f"{model}:rpm", limit["rpm"], 1)]
+        if limit.get("tpm") and tokens:
+            requests.append((f"{model}:tpm", limit["tpm"], min(tokens, limit["tpm"])))
+        return requests
+
+    def estimate_wait(self, model, tokens=0):
+        """
+        今リクエストした場合の待ち時間の見込み（秒）
+        """
+
+        return self.store.reserve(self._requests(model, tokens), time.time(), dry_run=True)
+
+    def acquire(self, model, tokens=0, on_wait=None, max_wait=ct.RATE_LIMIT_MAX_WAIT):
+        """
+        リクエストの実行枠を予約し、必要なら待機する
+        Args:
+            model: モデル名
+            tokens: 想定トークン数
+            on_wait: 待機が必要な場合に待ち時間（秒）を受け取るコールバック
+            max_wait: 待ち時間の見込みがこれを超える場合はRateLimitWaitTooLongを送出
+        Returns:
+            実際に待機した時間（秒）
+        """
+
+        requests = self._requests(model, tokens)
+        if not requests:
+            return 0.0
+
+        now = time.time()
+        expected_wait = self.store.reserve(requests, now, dry_run=True)
+        if expected_wait > max_wait:
+            raise RateLimitWaitTooLong(model, expected_wait)
+
+        wait_sec = self.store.reserve(requests, now)
+        if wait_sec > 0:
+            if on_wait:
+                on_wait(wait_sec)
+            else:
+                time.sleep(wait_sec)
+        return wait_sec
+
+    def penalize(self, model):
+        """
+        429エラーを受けたモデルのリクエスト枠を空にする
+        """
+
+        limit = self.limits.get(model)
+        if limit:
+            self.store.drain(f"{model}:rpm", limit["rpm"], time.time())
+
+    def call(self, model, fn, args=(), kwargs=None, tokens=0, reserved=False):
+        """
+        レート制限を守りながらAPIを呼び出し、429エラー時は待機して再試行する
+        Args:
+            model: モデル名
+            fn: APIを呼び出す関数
+            args, kwargs: fnに渡す引数
+            tokens: 想定トークン数
+            reserved: 呼び出し元で予約済みの場合はTrue（初回は予約しない）
+        """
+
+        for attempt in range(ct.RATE_LIMIT_MAX_RETRIES + 1):
+            if attempt > 0 or not reserved:
+                self.acquire(model, tokens)
+            try:
+                return fn(*args, **(kwargs or {}))
+            except RateLimitError:
+                if attempt >= ct.RATE_LIMIT_MAX_RETRIES:
+                    raise
+                print(f"Warning: {model} で429エラーが発生したため、待機して再試行します（{attempt + 1}回目）")
+                self.penalize(model)
+                time.sleep(2 ** attempt)
+
+def get_rate_limiter():
+    """
+    プロセス全体で共有するレートリミッターを取得（初回のみ作成）
+    """
+
+    global _limiter, _limiter_config
+    config = settings.get_settings()
+    with _limiter_lock:
+        if _limiter is None:
+            if config.rate_limit_backend == "sqlite":
+                store = SQLiteBucketStore(config.rate_limit_db_path)
+            else:
+                store = MemoryBucketStore()
+            _limiter = RateLimiter(store)
+        # 設定が再読み込みされた場合のみ、モデル名と上限の対応を作り直す
+        if config is not _limiter_config:
+            _limiter.limits = rate_limits_for(config)
+            _limiter_config = config
+    return _limiter
+
+def rate_limits_for(config):
+    """
+    設定されたモデル名ごとのレート制限（設定の用途ごとの上限をモデル名に対応付ける）
+    """
+
+    limits = config.rate_limits
+    return {
+        config.openai_chat_model: limits["chat"],
+        config.openai_tts_model: limits["tts"],
+        config.openai_stt_model: limits["stt"],
+    }
+
+def estimate_tokens(text):
+    """
+    テキストのおおよそのトークン数（英語は約4文字で1トークン）
+    """
+
+    return len(text) // 4 + 1
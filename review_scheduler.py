@@ -0,0 +1,106 @@
+import difflib
+import re
+import time
+import constants as ct
+
+TOKEN_PATTERN = re.compile(r"[a-z]+(?:'[a-z]+)?")
+
+def tokenize(text):
+    """
+    英文を小文字の単語のリストに分割（句読点は除く）
+    """
+
+    return TOKEN_PATTERN.findall(text.lower())
+
+def compare_answer(problem, answer):
+    """
+    問題文と回答を単語単位で比較し、聞き取れなかった単語と正しく答えられた単語を抽出
+    Returns:
+        (missed, correct): 単語の集合（機能語は除く）
+    """
+
+    problem_tokens = tokenize(problem)
+    matcher = difflib.SequenceMatcher(a=problem_tokens, b=tokenize(answer), autojunk=False)
+    matched = set()
+    for block in matcher.get_matching_blocks():
+        matched.update(range(block.a, block.a + block.size))
+
+    missed, correct = set(), set()
+    for index, token in enumerate(problem_tokens):
+        if token in ct.REVIEW_STOPWORDS:
+            continue
+        (correct if index in matched else missed).add(token)
+    return missed, correct - missed
+
+def sm2_update(easiness, interval_days, repetitions, quality):
+    """
+    SM-2方式で次回の復習間隔を計算
+    Args:
+        quality: 0〜5の評価（3未満は不正解として扱う）
+    Returns:
+        (easiness, interval_days, repetitions)
+    """
+
+    if quality < 3:
+        # 不正解の場合は最初からやり直し、同じ練習中に再出題されるよう短い間隔にする
+        repetitions = 0
+        interval_days = ct.REVIEW_RELEARN_INTERVAL_SEC / 86400
+    else:
+        repetitions += 1
+        if repetitions == 1:
+            interval_days = 1
+        elif repetitions == 2:
+            interval_days = 6
+        else:
+            interval_days = interval_days * easiness
+    easiness = max(1.3, easiness + 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02))
+    return easiness, interval_days, repetitions
+
+def update_schedule(items, missed, correct, now=None):
+    """
+    回答結果を復習項目に反映
+    Args:
+        items: 単語 -> (easiness, interval_days, repetitions, due) の辞書（登録済みの項目）
+        missed: 聞き取れなかった単語（未登録の場合は新しく登録）
+        correct: 正しく答えられた単語（登録済みの項目のみ更新）
+    Returns:
+        更新した項目の辞書
+    """
+
+    now = now if now is not None else time.time()
+    updated = {}
+    for token in missed:
+        easiness, interval_days, repetitions, _ = items.get(token, (ct.REVIEW_INITIAL_EASINESS, 0, 0, now))
+        easiness, interval_days, repetitions = sm2_update(easiness, interval_days, repetitions, ct.REVIEW_QUALITY_MISSED)
+        updated[token] = (easiness, interval_days, repetitions, now + interval_days * 86400)
+    for token in correct:
+        if token not in items:
+            continue
+        easiness, interval_days, repetitions, _ = items[token]
+        easiness, interval_days, repetitions = sm2_update(easiness, interval_days, repetitions, ct.REVIEW_QUALITY_CORRECT)
+        updated[token] = (easiness, interval_days, repetitions, now + interval_days * 86400)
+    return updated
+
+def pick_sentence(due_tokens, candidates, exclude=()):
+    """
+    復習時期の単語を最も多く含む過去の問題文を選ぶ
+    Args:
+        due_tokens: 復習時期の単語のリスト（復習時期が早い順）
+        candidates: (問題文, 音声ファイルのパス) のリスト
+        exclude: 直近に出題したため除外する問題文
+    Returns:
+        (問題文, 音声ファイルのパス)（該当する問題文がない場合はNone）
+    """
+
+    if not due_tokens:
+        return None
+    # 復習時期が早い単語ほど重みを大きくする
+    weights = {token: len(due_tokens) - rank for rank, token in enumerate(due_tokens)}
+    best, best_score = None, 0
+    for problem, audio_path in candidates:
+        if problem in exclude:
+            continue
+        score = sum(weights.get(token, 0) for token in set(tokenize(problem)))
+        if score > best_score:
+            best, best_score = (problem, audio_path), score
+    return best
@@ -0,0 +1,176 @@
+"""
+Streamlitのセッションごとの使用量の記録と、放置されたセッションの後始末
+セッションが作成した音声ファイルと、閉じる必要のあるオブジェクト（APIクライアントなど）を記録しておき、
+ブラウザとの接続が切れたまま一定時間が経過したセッションについて、処理のキャンセル・クライアントのクローズ・音声ファイルの削除を行う
+（後始末の確認は、いずれかのセッションのスクリプト実行時にまとめて行う）
+"""
+import os
+import threading
+import time
+import constants as ct
+import settings
+import speed_variants
+import worker_pool
+
+_records = {}
+_records_lock = threading.Lock()
+
+class SessionRecord:
+    """
+    セッションごとの記録（セッションの状態そのものは保持せず、後始末に必要な情報のみを持つ）
+    """
+
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.last_seen = time.time()
+        self.disconnected_since = None
+        self.files = {}  # 音声ファイルのパス -> 記録した時刻
+        self.resources = {}  # id(オブジェクト) -> close()を持つオブジェクト
+        self.payload = {}
+        self.compactions = 0
+
+def _is_connected(session_id):
+    """
+    ブラウザとの接続が続いているか（Streamlitの外で実行している場合はNone）
+    """
+
+    try:
+        from streamlit import runtime
+        if not runtime.exists():
+            return None
+        return runtime.get_instance().is_active_session(session_id)
+    except Exception:
+        return None
+
+def touch(session_id):
+    """
+    スクリプトの実行ごとに呼び出し、セッションの記録を返す（あわせて放置されたセッションを後始末する）
+    """
+
+    with _records_lock:
+        record = _records.get(session_id)
+        if record is None:
+            record = _records[session_id] = SessionRecord(session_id)
+        record.last_seen = time.time()
+        record.disconnected_since = None
+    reap()
+    return record
+
+def track_file(session_id, path):
+    """
+    セッションが作成した音声ファイルを記録（後始末・整理の際に削除する）
+    """
+
+    if session_id is None or not path:
+        return
+    with _records_lock:
+        record = _records.get(session_id)
+        if record is None:
+            record = _records[session_id] = SessionRecord(session_id)
+        record.files[path] = time.time()
+
+def untrack_file(session_id, path):
+    """
+    音声ファイルを後始末の対象から外す（学習履歴に保存して復習で再利用する問題文の音声など）
+    """
+
+    with _records_lock:
+        record = _records.get(session_id)
+        if record is not None:
+            record.files.pop(path, None)
+
+def track_resource(session_id, resource):
+    """
+    後始末の際にclose()するオブジェクトを記録（同じオブジェクトは一度だけ記録）
+    """
+
+    if session_id is None or resource is None or not hasattr(resource, "close"):
+        return
+    with _records_lock:
+        record = _records.get(session_id)
+        if record is not None:
+            record.resources.setdefault(id(resource), resource)
+
+def delete_files(paths):
+    """
+    音声ファイルと、その再生速度ごとの音声を削除
+    Returns:
+        削除したバイト数
+    """
+
+    freed = 0
+    for path in paths:
+        for speed in ct.PLAY_SPEED_OPTION:
+            target = path if speed == 1.0 else speed_variants.variant_path(path, speed)
+            try:
+                size = os.path.getsize(target)
+                os.remove(target)
+                freed += size
+            except OSError:
+                pass
+    return freed
+
+def release_files(record, keep=()):
+    """
+    記録した音声ファイルのうち、keep以外と直近のSESSION_KEEP_AUDIO_FILES件以外を削除
+    Returns:
+        削除したバイト数
+    """
+
+    with _records_lock:
+        newest_first = sorted(record.files, key=record.files.get, reverse=True)
+        targets = [path for path in newest_first[ct.SESSION_KEEP_AUDIO_FILES:] if path not in keep]
+        for path in targets:
+            del record.files[path]
+    return delete_files(targets)
+
+def _is_expired(record, now):
+    connected = _is_connected(record.session_id)
+    if connected is None:
+        return now - record.last_seen > ct.SESSION_IDLE_TIMEOUT
+    if connected:
+        record.disconnected_since = None
+        return False
+    if record.disconnected_since is None:
+        record.disconnected_since = now
+    return now - record.disconnected_since > settings.get_settings().session_expiry_sec
+
+def reap(now=None):
+    """
+    放置されたセッションを後始末
+    Returns:
+        後始末したセッションIDのリスト
+    """
+
+    now = now or time.time()
+    with _records_lock:
+        expired = [record for record in _records.values() if _is_expired(record, now)]
+        for record in expired:
+            del _records[record.session_id]
+    for record in expired:
+        _release(record)
+    return [record.session_id for record in expired]
+
+def _release(record):
+    # 未完了の処理のキャンセル・APIクライアントのクローズ・音声ファイルの削除
+    cancelled = worker_pool.get_worker_pool().cancel(tag=record.session_id)
+    for resource in record.resources.values():
+        try:
+            resource.close()
+        except Exception as e:
+            print(f"Warning: セッションのリソースを解放できませんでした: {e}")
+    freed = delete_files(list(record.files))
+    print(f"[session] {record.session_id[:8]} expired: {len(record.files)} files ({freed / 1024:.1f}KB) deleted, {cancelled} jobs cancelled")
+
+def metrics():
+    """
+    記録中のセッション数と保持データ量の合計
+    """
+
+    with _records_lock:
+        return {
+            "sessions": len(_records),
+            "payload_bytes": sum(record.payload.get("total_bytes", 0) for record in _records.values()),
+            "files": sum(len(record.files) for record in _records.values()),
+            "compactions": sum(record.compactions for record in _records.values()),
+        }
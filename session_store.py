@@ -0,0 +1,273 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+import constants as ct
+import settings
+
+_store = None
+_store_lock = threading.Lock()
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    learner_id TEXT NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_learner ON messages (learner_id, id);
+CREATE TABLE IF NOT EXISTS memory_state (
+    learner_id TEXT PRIMARY KEY,
+    summary TEXT,
+    buffer_json TEXT,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS problems (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    learner_id TEXT NOT NULL,
+    mode TEXT,
+    problem TEXT NOT NULL,
+    audio_path TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_problems_learner ON problems (learner_id, id);
+CREATE TABLE IF NOT EXISTS scores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    learner_id TEXT NOT NULL,
+    mode TEXT,
+    problem TEXT,
+    answer TEXT,
+    evaluation TEXT,
+    acoustic_json TEXT,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scores_learner ON scores (learner_id, id);
+CREATE TABLE IF NOT EXISTS transfers (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    learner_id TEXT,
+    mode TEXT,
+    kind TEXT NOT NULL,
+    format TEXT,
+    bytes INTEGER NOT NULL,
+    source_bytes INTEGER,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS review_items (
+    learner_id TEXT NOT NULL,
+    token TEXT NOT NULL,
+    easiness REAL NOT NULL,
+    interval_days REAL NOT NULL,
+    repetitions INTEGER NOT NULL,
+    due REAL NOT NULL,
+    PRIMARY KEY (learner_id, token)
+);
+CREATE INDEX IF NOT EXISTS idx_review_items_due ON review_items (learner_id, due);
+"""
+
+class SessionStore:
+    """
+    学習者ごとの会話履歴・要約・問題・評価を保存するSQLiteストア（WALモード）
+    書き込みはキューに溜めて、flush()でまとめて1トランザクションで書き込む
+    """
+
+    def __init__(self, db_path):
+        directory = os.path.dirname(db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=10)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.lock = threading.Lock()
+        self.pending = []  # (SQL, パラメータ) のリスト
+
+    def _queue(self, sql, params):
+        with self.lock:
+            self.pending.append((sql, params))
+            should_flush = len(self.pending) >= ct.SESSION_STORE_BATCH_SIZE
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        キューに溜まった書き込みをまとめて実行
+        """
+
+        with self.lock:
+            if not self.pending:
+                return
+            pending, self.pending = self.pending, []
+            with self.conn:
+                for sql, params in pending:
+                    self.conn.execute(sql, params)
+
+    def add_message(self, learner_id, role, content=None):
+        self._queue(
+            "INSERT INTO messages (learner_id, role, content, created) VALUES (?, ?, ?, ?)",
+            (learner_id, role, content, time.time())
+        )
+
+    def add_problem(self, learner_id, mode, problem, audio_path=None):
+        self._queue(
+            "INSERT INTO problems (learner_id, mode, problem, audio_path, created) VALUES (?, ?, ?, ?, ?)",
+            (learner_id, mode, problem, audio_path, time.time())
+        )
+
+    def add_score(self, learner_id, mode, problem, answer, evaluation, acoustic_score=None):
+        self._queue(
+            "INSERT INTO scores (learner_id, mode, problem, answer, evaluation, acoustic_json, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (learner_id, mode, problem, answer, evaluation, json.dumps(acoustic_score) if acoustic_score else None, time.time())
+        )
+
+    def add_transfer(self, learner_id, mode, kind, audio_format, size, source_size=None):
+        """
+        音声の送受信サイズを記録
+        Args:
+            kind: "tts"（音声合成の出力）/ "stt"（文字起こしへのアップロード）
+            size: 実際に送受信したバイト数
+            source_size: 圧縮前のバイト数
+        """
+
+        self._queue(
+            "INSERT INTO transfers (learner_id, mode, kind, format, bytes, source_bytes, created) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (learner_id, mode, kind, audio_format, size, source_size, time.time())
+        )
+
+    def save_memory_state(self, learner_id, summary, buffer_messages):
+        """
+        会話メモリの要約と直近のメッセージ（要約前のもの）を保存
+        Args:
+            buffer_messages: {"type": "human" / "ai", "content": ...} のリスト
+        """
+
+        self._queue(
+            "INSERT OR REPLACE INTO memory_state (learner_id, summary, buffer_json, updated) VALUES (?, ?, ?, ?)",
+            (learner_id, summary, json.dumps(buffer_messages, ensure_ascii=False), time.time())
+        )
+
+    def load_memory_state(self, learner_id):
+        """
+        保存された会話メモリの状態
+        Returns:
+            (summary, buffer_messages)（保存されていない場合はNone）
+        """
+
+        self.flush()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT summary, buffer_json FROM memory_state WHERE learner_id = ?", (learner_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0] or "", json.loads(row[1] or "[]")
+
+    def load_messages_page(self, learner_id, before_id=None, limit=ct.HISTORY_PAGE_SIZE):
+        """
+        会話履歴を新しい方から1ページ分読み込み
+        Args:
+            before_id: このIDより古いメッセージを対象にする（Noneの場合は最新から）
+        Returns:
+            (messages, oldest_id, has_more):
+                messages: 古い順の {"role", "content"} のリスト
+                oldest_id: 読み込んだ中で最も古いメッセージのID（次のページの読み込みに使用）
+                has_more: さらに古いメッセージがあるか
+        """
+
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, role, content FROM messages WHERE learner_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (learner_id, before_id if before_id is not None else 2 ** 63 - 1, limit + 1)
+            ).fetchall()
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+
+        messages = []
+        for _, role, content in rows:
+            messages.append({"role": role} if role == "other" else {"role": role, "content": content})
+        return messages, (rows[0][0] if rows else before_id), has_more
+
+    def recent_problems(self, learner_id, limit=50):
+        """
+        最近出題した問題文（新しい順）
+        """
+
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT problem, audio_path FROM problems WHERE learner_id = ? ORDER BY id DESC LIMIT ?",
+                (learner_id, limit)
+            ).fetchall()
+        return rows
+
+    def problem_candidates(self, limit=ct.REVIEW_CANDIDATE_LIMIT):
+        """
+        復習に再利用できる過去の問題文（全学習者分、問題文ごとに最新の音声ファイル）
+        """
+
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT problem, audio_path FROM problems WHERE id IN "
+                "(SELECT MAX(id) FROM problems GROUP BY problem) ORDER BY id DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
+        return rows
+
+    def load_review_items(self, learner_id, tokens):
+        """
+        指定した単語の復習項目
+        Returns:
+            単語 -> (easiness, interval_days, repetitions, due) の辞書
+        """
+
+        tokens = list(tokens)
+        if not tokens:
+            return {}
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT token, easiness, interval_days, repetitions, due FROM review_items "
+                f"WHERE learner_id = ? AND token IN ({','.join('?' * len(tokens))})",
+                (learner_id, *tokens)
+            ).fetchall()
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def save_review_items(self, learner_id, items):
+        for token, (easiness, interval_days, repetitions, due) in items.items():
+            self._queue(
+                "INSERT OR REPLACE INTO review_items (learner_id, token, easiness, interval_days, repetitions, due) VALUES (?, ?, ?, ?, ?, ?)",
+                (learner_id, token, easiness, interval_days, repetitions, due)
+            )
+
+    def due_review_tokens(self, learner_id, now, limit=ct.REVIEW_MAX_DUE_TOKENS):
+        """
+        復習時期になった単語（復習時期が早い順）
+        """
+
+        self.flush()
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT token FROM review_items WHERE learner_id = ? AND due <= ? ORDER BY due LIMIT ?",
+                (learner_id, now, limit)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+def get_session_store():
+    """
+    プロセス全体で共有するストアを取得（初回のみ作成、無効化されている場合はNone）
+    """
+
+    global _store
+    config = settings.get_settings()
+    if not config.session_store_enabled:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = SessionStore(config.session_store_path)
+            # プロセス終了時に未書き込みの内容を保存
+            atexit.register(_store.flush)
+    return _store
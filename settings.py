@@ -0,0 +1,205 @@
+import os
+import threading
+import time
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Optional
+try:
+    import tomllib
+    TOMLLIB_AVAILABLE = True
+except ImportError:
+    TOMLLIB_AVAILABLE = False
+import constants as ct
+
+# 設定の読み込み元（後のものほど優先）: 環境変数 → .env → secrets.toml
+ENV_FILE_PATH = Path(".env")
+SECRETS_FILE_PATHS = [Path.home() / ".streamlit" / "secrets.toml", Path(".streamlit") / "secrets.toml"]
+
+# 設定ファイルの更新を確認する間隔（秒、呼び出しごとにファイルを確認しないようにする）
+CHECK_INTERVAL_SEC = 1.0
+
+_settings = None
+_signature = None
+_checked_at = 0.0
+_settings_lock = threading.Lock()
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    アプリ全体の設定（プロセスごとに一度だけ読み込み、設定ファイルの変更時のみ再読み込み）
+    各項目は同名の環境変数（大文字）・.env・secrets.tomlで上書きできる
+    """
+
+    openai_api_key: Optional[str] = None
+    openai_chat_model: str = ct.OPENAI_CHAT_MODEL
+    chat_temperature: float = ct.CHAT_TEMPERATURE
+    memory_max_token_limit: int = ct.MEMORY_MAX_TOKEN_LIMIT
+    openai_tts_model: str = ct.OPENAI_TTS_MODEL
+    openai_tts_voice: str = ct.OPENAI_TTS_VOICE
+    openai_stt_model: str = ct.OPENAI_STT_MODEL
+    worker_pool_interactive_workers: int = ct.WORKER_POOL_INTERACTIVE_WORKERS
+    worker_pool_background_workers: int = ct.WORKER_POOL_BACKGROUND_WORKERS
+    worker_pool_prefetch_workers: int = ct.WORKER_POOL_PREFETCH_WORKERS
+    worker_pool_max_in_flight: int = ct.WORKER_POOL_MAX_IN_FLIGHT
+    transcript_cache_size: int = ct.TRANSCRIPT_CACHE_SIZE
+    backend_url: Optional[str] = None
+    backend_public_url: Optional[str] = None  # ブラウザから見たバックエンドのURL（未設定時はbackend_url）
+    tts_output_format: str = "mp3"  # 音声合成の出力形式（"mp3" / "opus" / "aac"）
+    stt_upload_format: str = "wav"  # 文字起こしに送る形式（"wav" / "opus"）
+    audio_streaming: bool = False  # 日常英会話の回答音声をストリーミング再生するか
+    audio_stream_url: Optional[str] = None  # ブラウザから見た配信サーバー（音声ファイル・ストリーミング）のURL
+    prefetch_next_problem: bool = False  # 回答の評価と同時に、次の問題文の生成・音声合成をバックグラウンドで行うか
+    dictation_set_size: int = 0  # ディクテーションを何問ごとにまとめて評価するか（0の場合は1問ごとに評価）
+    stt_backend: str = ct.STT_BACKEND  # 文字起こし（"openai" / "local"）
+    stt_backend_conversation: Optional[str] = None  # 日常英会話のみ切り替える場合
+    stt_backend_shadowing: Optional[str] = None  # シャドーイングのみ切り替える場合
+    local_stt_model: str = ct.LOCAL_STT_MODEL
+    local_stt_compute_type: str = ct.LOCAL_STT_COMPUTE_TYPE
+    local_stt_cpu_threads: int = ct.LOCAL_STT_CPU_THREADS
+    tts_backend: str = ct.TTS_BACKEND  # 音声合成（"openai" / "piper" / "espeak"）
+    tts_backend_problem: Optional[str] = None  # シャドーイング・ディクテーションの問題文のみ切り替える場合
+    tts_backend_conversation: Optional[str] = None  # 日常英会話の回答のみ切り替える場合
+    piper_voice_path: str = ct.PIPER_VOICE_PATH
+    espeak_voice: str = ct.ESPEAK_VOICE
+    backend_host: str = ct.BACKEND_HOST  # バックエンドサービスの待ち受けアドレス
+    backend_port: int = ct.BACKEND_PORT
+    rate_limit_chat_rpm: int = ct.RATE_LIMITS["chat"]["rpm"]
+    rate_limit_chat_tpm: int = ct.RATE_LIMITS["chat"]["tpm"]
+    rate_limit_tts_rpm: int = ct.RATE_LIMITS["tts"]["rpm"]
+    rate_limit_stt_rpm: int = ct.RATE_LIMITS["stt"]["rpm"]
+    rate_limit_backend: str = ct.RATE_LIMIT_BACKEND
+    rate_limit_db_path: str = ct.RATE_LIMIT_DB_PATH
+    session_store_enabled: bool = ct.SESSION_STORE_ENABLED
+    session_store_path: str = ct.SESSION_STORE_PATH
+    review_enabled: bool = ct.REVIEW_ENABLED
+    speed_variants_enabled: bool = ct.SPEED_VARIANTS_ENABLED  # 問題文の音声を再生速度ごとに変換しておくか
+    profile_runs: bool = ct.PROFILE_ENABLED  # 開発用のプロファイラーで全ての実行を記録するか
+    profile_output_dir: str = ct.PROFILE_OUTPUT_DIR
+    session_payload_max_bytes: int = ct.SESSION_PAYLOAD_MAX_BYTES  # セッションが保持する本文と音声ファイルの合計の上限
+    session_expiry_sec: int = ct.SESSION_EXPIRY_SEC  # ブラウザとの接続が切れてから後始末するまでの時間（秒）
+
+    @property
+    def has_valid_api_key(self):
+        """
+        APIキーが設定されているか（サンプルの値や明らかに短い値は無効として扱う）
+        """
+
+        key = self.openai_api_key
+        return bool(key) and key != "your-openai-api-key-here" and len(key) >= 20
+
+    def stt_backend_for(self, mode=None):
+        """
+        モードごとの文字起こしバックエンド名（未設定のモードはstt_backend）
+        """
+
+        overrides = {ct.MODE_1: self.stt_backend_conversation, ct.MODE_2: self.stt_backend_shadowing}
+        return overrides.get(mode) or self.stt_backend
+
+    def tts_backend_for(self, purpose=None):
+        """
+        用途ごとの音声合成バックエンド名（未設定の用途はtts_backend）
+        """
+
+        overrides = {"problem": self.tts_backend_problem, "conversation": self.tts_backend_conversation}
+        return overrides.get(purpose) or self.tts_backend
+
+    @property
+    def rate_limits(self):
+        """
+        用途（chat / tts / stt）ごとのレート制限（ct.RATE_LIMITSと同じ形式）
+        """
+
+        return {
+            "chat": {"rpm": self.rate_limit_chat_rpm, "tpm": self.rate_limit_chat_tpm},
+            "tts": {"rpm": self.rate_limit_tts_rpm, "tpm": None},
+            "stt": {"rpm": self.rate_limit_stt_rpm, "tpm": None},
+        }
+
+def _read_env_file(path):
+    values = {}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith('#') or '=' not in line:
+                    continue
+                key, value = line.split('=', 1)
+                values[key.strip().removeprefix('export ').strip()] = value.strip().strip('"\'')
+    except OSError:
+        pass
+    return values
+
+def _read_secrets_file(path):
+    if not TOMLLIB_AVAILABLE:
+        return {}
+    try:
+        with open(path, 'rb') as f:
+            data = tomllib.load(f)
+    except (OSError, tomllib.TOMLDecodeError) as e:
+        if path.exists():
+            print(f"Warning: {path} の読み込みに失敗しました: {e}")
+        return {}
+    # トップレベルの値のみを対象にする（[section] は無視）
+    return {key: str(value) for key, value in data.items() if not isinstance(value, dict)}
+
+def _file_signature():
+    # 監視対象ファイルの更新時刻（存在しない場合はNone）
+    signature = []
+    for path in [ENV_FILE_PATH, *SECRETS_FILE_PATHS]:
+        try:
+            signature.append(path.stat().st_mtime_ns)
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+def load_settings():
+    """
+    環境変数・.env・secrets.tomlから設定を読み込む
+    """
+
+    sources = dict(os.environ)
+    sources.update(_read_env_file(ENV_FILE_PATH))
+    for path in SECRETS_FILE_PATHS:
+        sources.update(_read_secrets_file(path))
+
+    values = {}
+    for field in fields(Settings):
+        raw = sources.get(field.name.upper())
+        if raw in (None, ""):
+            continue
+        # 型注釈（bool / int / float / str）に合わせて変換
+        if field.type is bool:
+            values[field.name] = raw.lower() in ("1", "true", "yes", "on")
+        elif field.type is int:
+            values[field.name] = int(raw)
+        elif field.type is float:
+            values[field.name] = float(raw)
+        else:
+            values[field.name] = raw
+    return Settings(**values)
+
+def get_settings():
+    """
+    プロセス全体で共有する設定を取得
+    .envまたはsecrets.tomlの更新時刻が変わった場合のみ再読み込みする（確認はCHECK_INTERVAL_SEC秒ごと）
+    設定が変わらない間は同じオブジェクトを返すため、呼び出し元は設定から導いた値をオブジェクトごとにキャッシュできる
+    （ワーカープールの大きさなど、起動時に使う設定の反映には再起動が必要）
+    """
+
+    global _settings, _signature, _checked_at
+    now = time.monotonic()
+    if _settings is not None and now - _checked_at < CHECK_INTERVAL_SEC:
+        return _settings
+    signature = _file_signature()
+    with _settings_lock:
+        _checked_at = now
+        if _settings is None or signature != _signature:
+            try:
+                _settings = load_settings()
+            except ValueError as e:
+                # 不正な値の場合は直前の設定を使い続ける
+                if _settings is None:
+                    raise
+                print(f"Warning: 設定の再読み込みに失敗しました: {e}")
+            _signature = signature
+    return _settings
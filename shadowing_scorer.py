@@ -0,0 +1,164 @@
+import time
+import wave
+from functools import lru_cache
+import numpy as np
+import constants as ct
+import audio_preprocess as ap
+import transcoder
+
+def load_audio(audio_data):
+    """
+    音声データをモノラル・ct.SHADOWING_SAMPLE_RATEのPCMに変換
+    WAVはNumPyで直接読み込み、それ以外（MP3など）はtranscoderでデコードする
+    """
+
+    try:
+        samples, sample_rate = ap.read_wav(audio_data)
+    except (wave.Error, EOFError, ValueError):
+        return transcoder.decode_to_pcm(audio_data, ct.SHADOWING_SAMPLE_RATE)
+    return ap.resample(ap.to_mono(samples), sample_rate, ct.SHADOWING_SAMPLE_RATE)
+
+@lru_cache(maxsize=4)
+def mel_filterbank(sample_rate, n_fft, n_mels):
+    """
+    メルフィルタバンク行列（n_mels × (n_fft // 2 + 1)）を作成
+    """
+
+    def hz_to_mel(hz):
+        return 2595.0 * np.log10(1.0 + hz / 700.0)
+
+    def mel_to_hz(mel):
+        return 700.0 * (10 ** (mel / 2595.0) - 1.0)
+
+    fft_freqs = np.linspace(0, sample_rate / 2, n_fft // 2 + 1)
+    mel_points = mel_to_hz(np.linspace(hz_to_mel(0.0), hz_to_mel(sample_rate / 2), n_mels + 2))
+    lower, center, upper = mel_points[:-2, None], mel_points[1:-1, None], mel_points[2:, None]
+    # 三角フィルタの立ち上がりと立ち下がりを一括で計算
+    rising = (fft_freqs - lower) / (center - lower)
+    falling = (upper - fft_freqs) / (upper - center)
+    return np.maximum(0.0, np.minimum(rising, falling)).astype(np.float32)
+
+def log_mel_features(samples, sample_rate=ct.SHADOWING_SAMPLE_RATE):
+    """
+    対数メルスペクトログラム（フレーム数 × バンド数）を計算
+    話者や録音環境の違いを抑えるため、発話ごとに平均・分散を正規化する
+    """
+
+    frame_length = int(sample_rate * ct.SHADOWING_FRAME_MS / 1000)
+    hop_length = int(sample_rate * ct.SHADOWING_HOP_MS / 1000)
+    if len(samples) < frame_length:
+        return np.empty((0, ct.SHADOWING_N_MELS), dtype=np.float32)
+
+    frames = np.lib.stride_tricks.sliding_window_view(samples, frame_length)[::hop_length]
+    spectrum = np.abs(np.fft.rfft(frames * np.hanning(frame_length).astype(np.float32), axis=1)) ** 2
+    mel = spectrum @ mel_filterbank(sample_rate, frame_length, ct.SHADOWING_N_MELS).T
+    features = np.log(mel + 1e-10)
+    return ((features - features.mean(axis=0)) / (features.std(axis=0) + 1e-5)).astype(np.float32)
+
+def banded_dtw(reference, learner, band_ratio=ct.SHADOWING_DTW_BAND_RATIO):
+    """
+    Sakoe-Chibaバンド付きのDTWで2つの特徴量系列を対応付け
+    距離は1 - コサイン類似度を使用する
+    Returns:
+        (path, similarities): 対応付けられたフレーム番号の配列（N × 2）と各対応のコサイン類似度
+    """
+
+    n, m = len(reference), len(learner)
+    ref_unit = reference / (np.linalg.norm(reference, axis=1, keepdims=True) + 1e-10)
+    learner_unit = learner / (np.linalg.norm(learner, axis=1, keepdims=True) + 1e-10)
+    similarity = ref_unit @ learner_unit.T
+    cost = 1.0 - similarity
+
+    # 対角線（長さの比を考慮）から一定幅の範囲だけを探索
+    width = max(abs(n - m), int(band_ratio * max(n, m))) + 1
+    centers = np.arange(n) * (m - 1) / max(n - 1, 1)
+    lows = np.clip(np.floor(centers - width).astype(int), 0, m - 1)
+    highs = np.clip(np.ceil(centers + width).astype(int) + 1, 1, m)
+
+    accumulated = np.full((n, m), np.inf)
+    accumulated[0, lows[0]:highs[0]] = np.cumsum(cost[0, lows[0]:highs[0]])
+    for i in range(1, n):
+        lo, hi = lows[i], highs[i]
+        row_cost = cost[i, lo:hi]
+        previous = accumulated[i - 1]
+        diagonal = previous[lo - 1:hi - 1] if lo > 0 else np.concatenate(([np.inf], previous[:hi - 1]))
+        from_above = np.minimum(diagonal, previous[lo:hi]) + row_cost
+        # 横方向の遷移 D[i, j] = min(from_above[j], D[i, j-1] + cost[i, j]) を累積和と累積最小値で一括計算
+        cumulative_cost = np.cumsum(row_cost)
+        accumulated[i, lo:hi] = cumulative_cost + np.minimum.accumulate(from_above - cumulative_cost)
+
+    # 終点から逆にたどって最適な対応付けを求める
+    i, j = n - 1, m - 1
+    path = [(i, j)]
+    while i > 0 or j > 0:
+        candidates = (
+            (accumulated[i - 1, j - 1] if i > 0 and j > 0 else np.inf, i - 1, j - 1),
+            (accumulated[i - 1, j] if i > 0 else np.inf, i - 1, j),
+            (accumulated[i, j - 1] if j > 0 else np.inf, i, j - 1),
+        )
+        _, i, j = min(candidates, key=lambda candidate: candidate[0])
+        path.append((i, j))
+    path = np.array(path[::-1])
+
+    return path, similarity[path[:, 0], path[:, 1]]
+
+def score_shadowing(reference_audio, learner_audio):
+    """
+    参照音声（問題文のTTS）と学習者の録音を比較してシャドーイングを音響的に評価
+    Args:
+        reference_audio: 参照音声のデータ（bytes）
+        learner_audio: 学習者の録音データ（bytes）
+    Returns:
+        評価結果の辞書（発話の遅れ・話速の比率・区間ごとの類似度など）、発話が検出できない場合はNone
+    """
+
+    start = time.perf_counter()
+    sample_rate = ct.SHADOWING_SAMPLE_RATE
+    reference_samples = load_audio(reference_audio)
+    learner_samples = load_audio(learner_audio)
+
+    # 前後の無音を除いた発話区間同士を比較する
+    reference_speech = ap.trim_silence(reference_samples, sample_rate)
+    learner_speech = ap.trim_silence(learner_samples, sample_rate)
+    reference_features = log_mel_features(reference_speech, sample_rate)
+    learner_features = log_mel_features(learner_speech, sample_rate)
+    if len(reference_features) < 2 or len(learner_features) < 2:
+        return None
+
+    path, similarities = banded_dtw(reference_features, learner_features)
+
+    hop_ms = ct.SHADOWING_HOP_MS
+    # 対応付けられたフレーム同士の時間差（学習者の方が遅い場合に正）
+    lags_ms = (path[:, 1] - path[:, 0]) * hop_ms
+    segment_ids = np.minimum(path[:, 0] * ct.SHADOWING_SEGMENT_COUNT // len(reference_features), ct.SHADOWING_SEGMENT_COUNT - 1)
+    segment_similarities = np.bincount(segment_ids, weights=similarities, minlength=ct.SHADOWING_SEGMENT_COUNT) \
+        / np.maximum(np.bincount(segment_ids, minlength=ct.SHADOWING_SEGMENT_COUNT), 1)
+
+    return {
+        "mean_lag_ms": float(np.mean(np.abs(lags_ms))),
+        "end_lag_ms": float(lags_ms[-1]),
+        "pace_ratio": len(learner_speech) / len(reference_speech),
+        "similarity": float(np.mean(similarities)),
+        "segment_similarities": [float(value) for value in segment_similarities],
+        "elapsed_ms": (time.perf_counter() - start) * 1000,
+    }
+
+def format_shadowing_score(score):
+    """
+    音響スコアを画面表示用のMarkdownに整形
+    """
+
+    pace_comment = "ちょうど良い速さです"
+    if score["pace_ratio"] > 1.15:
+        pace_comment = "お手本より遅めです"
+    elif score["pace_ratio"] < 0.85:
+        pace_comment = "お手本より速めです"
+
+    segments = " / ".join(f"{max(0.0, value) * 100:.0f}" for value in score["segment_similarities"])
+    return (
+        "【音声の比較（お手本との一致度）】\n\n"
+        f"- 全体の一致度: {max(0.0, score['similarity']) * 100:.0f} / 100\n"
+        f"- 区間ごとの一致度（前半→後半）: {segments}\n"
+        f"- 話す速さ: お手本の {score['pace_ratio']:.2f} 倍（{pace_comment}）\n"
+        f"- タイミングのずれ: 平均 {score['mean_lag_ms']:.0f}ms、文末 {score['end_lag_ms']:+.0f}ms"
+    )
@@ -0,0 +1,121 @@
+"""
+問題文の音声を再生速度ごとにあらかじめ変換しておく（再生速度を切り替えた際にすぐ再生できるようにする）
+変換した音声は元の音声と同じフォルダに <元のファイル名>_x<速度>.<拡張子> として保存し、
+URL配信用の音声ファイル（static_media.py）と同じく、上限を超えた分は古い順に削除する
+"""
+import os
+import re
+import threading
+import constants as ct
+import settings
+import transcoder
+import worker_pool
+
+VARIANT_NAME_PATTERN = re.compile(r"_x\d+(?:\.\d+)?\.\w+$")
+
+_jobs = {}  # (元の音声の絶対パス, 速度) -> Job
+_jobs_lock = threading.RLock()  # 完了済みの処理の後始末は投入中のスレッドで呼ばれることがある
+_evict_lock = threading.Lock()
+
+def variant_path(path, speed):
+    """
+    再生速度を変えた音声の保存先
+    """
+
+    base, ext = os.path.splitext(path)
+    return f"{base}_x{speed:g}{ext}"
+
+def is_supported(path):
+    """
+    再生速度を変えられる音声かどうか（形式が対応していて、PyAVまたはFFmpegが利用可能）
+    """
+
+    return transcoder.is_available() and os.path.splitext(path)[1].lstrip('.') in ct.SPEED_VARIANT_PROFILES
+
+def _evict(directory):
+    # 上限を超えた分を古い順に削除（元の音声は削除しない）
+    with _evict_lock:
+        entries = [
+            entry for entry in os.scandir(directory)
+            if entry.is_file() and VARIANT_NAME_PATTERN.search(entry.name)
+        ]
+        if len(entries) <= ct.SPEED_VARIANT_MAX_FILES:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - ct.SPEED_VARIANT_MAX_FILES]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+def render_variant(path, speed):
+    """
+    再生速度を変えた音声を作成して保存（作成済みの場合は何もしない）
+    Returns:
+        保存先のファイルパス
+    """
+
+    target_path = variant_path(path, speed)
+    if os.path.exists(target_path):
+        return target_path
+
+    with open(path, 'rb') as f:
+        audio_data = f.read()
+    profile_name = ct.SPEED_VARIANT_PROFILES[os.path.splitext(path)[1].lstrip('.')]
+    variant_data = transcoder.transcode(audio_data, profile_name, tempo=speed)
+
+    # 書き込み途中のファイルが読まれないよう、一時ファイルに書いてから置き換える
+    temp_path = f"{target_path}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(variant_data)
+    os.replace(temp_path, target_path)
+    _evict(os.path.dirname(os.path.abspath(target_path)))
+    return target_path
+
+def submit_variants(path):
+    """
+    全ての再生速度の音声の作成を共有ワーカープール（backgroundレーン）に投入
+    作成した音声は他のセッションとも共有するため、セッション単位のキャンセルの対象にしない
+    """
+
+    if not settings.get_settings().speed_variants_enabled or not path or not is_supported(path):
+        return
+    pool = worker_pool.get_worker_pool()
+    with _jobs_lock:
+        for speed in ct.PLAY_SPEED_OPTION:
+            key = (os.path.abspath(path), speed)
+            if speed == 1.0 or key in _jobs or os.path.exists(variant_path(path, speed)):
+                continue
+            job = pool.submit(worker_pool.BACKGROUND, render_variant, path, speed)
+            _jobs[key] = job
+            job.future.add_done_callback(lambda _, key=key: _forget(key))
+
+def _forget(key):
+    with _jobs_lock:
+        _jobs.pop(key, None)
+
+def get_variant(path, speed, timeout=ct.TRANSCODE_TIMEOUT):
+    """
+    指定の再生速度の音声のパスを取得
+    作成中の場合は完了を待ち、投入されていない場合（以前に生成した音声など）はその場で作成する
+    Returns:
+        音声のパス（速度を変えられない場合はNone）
+    """
+
+    if speed == 1.0:
+        return path
+    target_path = variant_path(path, speed)
+    if os.path.exists(target_path):
+        return target_path
+    if not is_supported(path):
+        return None
+
+    with _jobs_lock:
+        job = _jobs.get((os.path.abspath(path), speed))
+    try:
+        if job is not None and not job.future.cancelled():
+            return job.result(timeout=timeout)
+        return render_variant(path, speed)
+    except Exception as e:
+        print(f"Warning: 再生速度{speed}倍の音声を作成できませんでした: {e}")
+        return None
@@ -0,0 +1,108 @@
+"""
+生成した音声ファイルをURLで配信するためのヘルパー
+ファイル名に内容のハッシュを使うため、同じ音声は同じURLになりブラウザにキャッシュされる
+配信は audio_stream.py の配信サーバー（/media/<ファイル名>）が行い、音声のMIMEタイプ・Range指定（206）・ETag・Cache-Controlを付与する
+"""
+import hashlib
+import html
+import io
+import os
+import shutil
+import threading
+import time
+from functools import lru_cache
+from PIL import Image
+import constants as ct
+
+_published = {}  # (絶対パス, 更新時刻, サイズ) -> 配信用のファイル名
+_last_used = {}  # 配信用のファイル名 -> 最後に配信した時刻（ハードリンクは元ファイルの更新時刻を引き継ぐため、別に記録する）
+_published_lock = threading.Lock()
+
+def _content_hash(data):
+    return hashlib.sha1(data).hexdigest()[:ct.STATIC_MEDIA_HASH_LENGTH]
+
+def _evict():
+    # 上限を超えた分を、最後に配信した時刻が古い順に削除（このプロセスで配信していないファイルは更新時刻で判定）
+    entries = [entry for entry in os.scandir(ct.STATIC_MEDIA_DIR) if entry.is_file() and not entry.name.startswith('.')]
+    if len(entries) <= ct.STATIC_MEDIA_MAX_FILES:
+        return
+    entries.sort(key=lambda entry: _last_used.get(entry.name, entry.stat().st_mtime))
+    for entry in entries[:len(entries) - ct.STATIC_MEDIA_MAX_FILES]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+        _last_used.pop(entry.name, None)
+
+def media_url(file_name, base_url=""):
+    """
+    配信用のファイル名のURL（base_urlは配信サーバーのURL）
+    """
+
+    return f"{base_url.rstrip('/')}/{ct.STATIC_MEDIA_URL_PATH}/{file_name}"
+
+def publish_file(path, base_url=""):
+    """
+    音声ファイルを配信用のフォルダに配置し、URLを返す
+    同じファイル（パス・更新時刻・サイズが同じ）はハッシュを再計算しない
+    """
+
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _published_lock:
+        published = _published.get(key)
+        # 上限超過で削除された場合は配置し直す
+        if published and os.path.exists(os.path.join(ct.STATIC_MEDIA_DIR, published)):
+            _last_used[published] = time.time()
+            return media_url(published, base_url)
+
+        with open(path, 'rb') as f:
+            digest = _content_hash(f.read())
+        file_name = f"{digest}{os.path.splitext(path)[1]}"
+        target_path = os.path.join(ct.STATIC_MEDIA_DIR, file_name)
+        _last_used[file_name] = time.time()
+        if not os.path.exists(target_path):
+            os.makedirs(ct.STATIC_MEDIA_DIR, exist_ok=True)
+            try:
+                # 同じファイルシステム上ならコピーせずハードリンクを作成
+                os.link(path, target_path)
+            except OSError:
+                shutil.copyfile(path, target_path)
+            _evict()
+
+        _published[key] = file_name
+        return media_url(file_name, base_url)
+
+def media_path(file_name):
+    """
+    配信用のファイル名に対応するファイルのパス（配信用のファイル名として不正な場合はNone）
+    """
+
+    name, ext = os.path.splitext(file_name)
+    if len(name) != ct.STATIC_MEDIA_HASH_LENGTH or any(c not in "0123456789abcdef" for c in name) or ext.lstrip('.') not in ct.AUDIO_MIME_TYPES:
+        return None
+    return os.path.join(ct.STATIC_MEDIA_DIR, file_name)
+
+def audio_html(url, autoplay=False):
+    """
+    URLを参照する音声プレーヤーのHTML（音声データ自体は埋め込まない）
+    """
+
+    return (
+        f'<audio controls preload="metadata" {"autoplay " if autoplay else ""}'
+        f'src="{html.escape(url)}" style="width: 100%;"></audio>'
+    )
+
+@lru_cache(maxsize=None)
+def load_image(path):
+    """
+    アイコン画像の読み込み（プロセスごとに一度だけ）
+    元画像のままだとメッセージを表示するたびにStreamlit側でデコードと縮小が行われるため、
+    読み込み時にAVATAR_MAX_SIZEまで縮小したPNGにしておく
+    """
+
+    with Image.open(path) as image:
+        image.thumbnail((ct.AVATAR_MAX_SIZE, ct.AVATAR_MAX_SIZE))
+        buffer = io.BytesIO()
+        image.save(buffer, format="PNG")
+    return buffer.getvalue()
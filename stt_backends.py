@@ -0,0 +1,158 @@
+import io
+import threading
+from abc import ABC, abstractmethod
+# ローカル文字起こし用（未インストールの場合はOpenAI APIのみ利用可能）
+try:
+    from faster_whisper import WhisperModel
+    FASTER_WHISPER_AVAILABLE = True
+except ImportError:
+    FASTER_WHISPER_AVAILABLE = False
+import constants as ct
+import settings
+from word_timings import WordTimings
+
+# ローカルモデルはプロセス内で一度だけ読み込み、全セッションで共有する
+_local_models = {}
+_local_models_lock = threading.Lock()
+
+class Transcript:
+    """
+    文字起こし結果（OpenAIのレスポンスと同じく .text で本文を参照できる）
+    word_timestamps=Trueで取得した場合は .word_timings に単語ごとの時刻を保持する
+    .audio_path は単語ごとの時刻の基準となる前処理済みの音声ファイル（保存されていない場合はNone）
+    """
+
+    def __init__(self, text, word_timings=None, audio_path=None):
+        self.text = text
+        self.word_timings = word_timings
+        self.audio_path = audio_path
+
+class STTBackend(ABC):
+    """
+    文字起こしバックエンドの基底クラス
+    """
+
+    name = ""
+
+    @abstractmethod
+    def transcribe(self, audio_data, file_name="audio.wav", language="en", word_timestamps=False):
+        """
+        音声データから文字起こし結果を取得
+        Args:
+            audio_data: 音声データ（bytes）
+            file_name: 音声形式の判定に使うファイル名
+            language: 音声の言語
+            word_timestamps: 単語ごとの時刻も取得するか
+        Returns:
+            Transcript
+        """
+
+class OpenAIWhisperBackend(STTBackend):
+    """
+    OpenAI Whisper APIによる文字起こし
+    """
+
+    name = "openai"
+
+    def __init__(self, client, model=ct.OPENAI_STT_MODEL):
+        self.client = client
+        self.model = model
+
+    def transcribe(self, audio_data, file_name="audio.wav", language="en", word_timestamps=False):
+        if not word_timestamps:
+            response = self.client.audio.transcriptions.create(
+                model=self.model,
+                file=(file_name, audio_data),
+                language=language
+            )
+            return Transcript(response.text)
+
+        # 単語単位のタイムスタンプはverbose_json形式でのみ取得できる
+        response = self.client.audio.transcriptions.create(
+            model=self.model,
+            file=(file_name, audio_data),
+            language=language,
+            response_format="verbose_json",
+            timestamp_granularities=["word"]
+        )
+        return Transcript(response.text, WordTimings.from_words(response.words))
+
+class LocalWhisperBackend(STTBackend):
+    """
+    faster-whisper（量子化モデル）によるCPU上のローカル文字起こし
+    """
+
+    name = "local"
+
+    def __init__(self, model_name=None, compute_type=None, cpu_threads=None):
+        # 省略した項目は設定（settings.py）の値を使用
+        config = settings.get_settings()
+        self.model = load_local_model(
+            model_name or config.local_stt_model,
+            compute_type or config.local_stt_compute_type,
+            cpu_threads or config.local_stt_cpu_threads
+        )
+
+    def transcribe(self, audio_data, file_name="audio.wav", language="en", word_timestamps=False):
+        # 短い発話が対象のため、速度優先でビームサーチは行わない
+        segments, _ = self.model.transcribe(
+            io.BytesIO(audio_data),
+            language=language,
+            beam_size=1,
+            word_timestamps=word_timestamps
+        )
+        segments = list(segments)
+        text = "".join(segment.text for segment in segments).strip()
+        if not word_timestamps:
+            return Transcript(text)
+        return Transcript(text, WordTimings.from_words(word for segment in segments for word in segment.words))
+
+def is_local_available():
+    """
+    ローカル文字起こしが利用可能かどうか
+    """
+
+    return FASTER_WHISPER_AVAILABLE
+
+def load_local_model(model_name, compute_type, cpu_threads):
+    """
+    faster-whisperのモデルを読み込み（同じ設定のモデルはプロセス内で共有）
+    """
+
+    if not FASTER_WHISPER_AVAILABLE:
+        raise RuntimeError("faster-whisperがインストールされていないため、ローカル文字起こしは利用できません")
+
+    key = (model_name, compute_type, cpu_threads)
+    with _local_models_lock:
+        if key not in _local_models:
+            _local_models[key] = WhisperModel(
+                model_name,
+                device="cpu",
+                compute_type=compute_type,
+                cpu_threads=cpu_threads
+            )
+        return _local_models[key]
+
+def get_backend_name(mode=None):
+    """
+    モードに応じて使用するバックエンド名を決定
+    """
+
+    return settings.get_settings().stt_backend_for(mode)
+
+def get_stt_backend(openai_client, mode=None):
+    """
+    設定に応じた文字起こしバックエンドを取得
+    ローカルが指定されていても利用できない場合はOpenAI APIを使用する
+    Args:
+        openai_client: OpenAIのクライアント
+        mode: 現在のモード（モードごとの切り替え用）
+    """
+
+    if get_backend_name(mode) == "local":
+        try:
+            return LocalWhisperBackend()
+        except Exception as e:
+            print(f"Warning: ローカル文字起こしの初期化に失敗したため、OpenAI APIを使用します: {e}")
+
+    return OpenAIWhisperBackend(openai_client, settings.get_settings().openai_stt_model)
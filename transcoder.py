@@ -0,0 +1,225 @@
+import io
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+import numpy as np
+# 通常はPyAV（requirements.txtに含む）でプロセス内で変換する
+# FFmpegのパイプ呼び出しは、PyAVを導入できない環境向けの最終手段（呼び出しごとに子プロセスを起動するため遅い）
+try:
+    import av
+    PYAV_AVAILABLE = True
+except ImportError:
+    PYAV_AVAILABLE = False
+import constants as ct
+
+# FFmpegの場所はプロセス起動時に一度だけ確認する
+FFMPEG_PATH = shutil.which('ffmpeg')
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending_slots = threading.BoundedSemaphore(ct.TRANSCODE_MAX_PENDING)
+
+def is_available():
+    """
+    音声変換が利用可能かどうか
+    """
+
+    return PYAV_AVAILABLE or FFMPEG_PATH is not None
+
+def get_executor():
+    """
+    プロセス全体で共有する変換用のワーカープールを取得（初回のみ作成）
+    """
+
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=ct.TRANSCODE_MAX_WORKERS,
+                thread_name_prefix="transcode"
+            )
+    return _executor
+
+class _TempoFilter:
+    """
+    FFmpegのatempoフィルターで音の高さを変えずに再生速度を変える（PyAV用）
+    """
+
+    def __init__(self, tempo, audio_format, sample_rate, layout):
+        self.graph = av.filter.Graph()
+        source = self.graph.add_abuffer(
+            format=audio_format, sample_rate=sample_rate, layout=layout, time_base=Fraction(1, sample_rate)
+        )
+        atempo = self.graph.add("atempo", f"{tempo}")
+        sink = self.graph.add("abuffersink")
+        source.link_to(atempo)
+        atempo.link_to(sink)
+        self.graph.configure()
+
+    def process(self, frame):
+        """
+        フレームを渡し、出力できるフレームを返す（frameにNoneを渡すと残りを全て書き出す）
+        """
+
+        self.graph.push(frame)
+        frames = []
+        while True:
+            try:
+                filtered_frame = self.graph.pull()
+            except (av.BlockingIOError, av.EOFError):
+                return frames
+            filtered_frame.pts = None  # タイムスタンプはエンコーダー側で振り直す
+            frames.append(filtered_frame)
+
+def _transcode_with_pyav(audio_data, profile, tempo=None):
+    """
+    PyAVを使ってメモリ上で音声を変換（一時ファイル・子プロセス不要）
+    """
+
+    output_buffer = io.BytesIO()
+    with av.open(io.BytesIO(audio_data), 'r') as input_container, \
+            av.open(output_buffer, 'w', format=profile["format"]) as output_container:
+        stream = output_container.add_stream(profile["codec"], rate=profile["sample_rate"])
+        stream.bit_rate = profile["bit_rate"]
+        stream.layout = profile["layout"]
+        resampler = av.AudioResampler(
+            format=stream.format.name,
+            layout=profile["layout"],
+            rate=profile["sample_rate"]
+        )
+        tempo_filter = None
+        if tempo and tempo != 1.0:
+            tempo_filter = _TempoFilter(tempo, stream.format.name, profile["sample_rate"], profile["layout"])
+
+        def encode(frames):
+            if tempo_filter is not None:
+                frames = [filtered for frame in frames for filtered in tempo_filter.process(frame)]
+            for frame in frames:
+                output_container.mux(stream.encode(frame))
+
+        for frame in input_container.decode(audio=0):
+            encode(resampler.resample(frame))
+        # リサンプラー・フィルター・エンコーダーに残ったデータを書き出す
+        encode(resampler.resample(None))
+        if tempo_filter is not None:
+            for frame in tempo_filter.process(None):
+                output_container.mux(stream.encode(frame))
+        output_container.mux(stream.encode(None))
+
+    return output_buffer.getvalue()
+
+def _transcode_with_ffmpeg(audio_data, profile, tempo=None):
+    """
+    FFmpegを標準入出力のパイプで呼び出して音声を変換（一時ファイル不要）
+    PyAVがない場合の最終手段で、呼び出しごとにFFmpegのプロセスを起動する
+    """
+
+    cmd = [
+        FFMPEG_PATH, '-hide_banner', '-loglevel', 'error',
+        '-i', 'pipe:0',  # 標準入力から読み込み
+        '-vn',
+        '-ac', '1' if profile["layout"] == "mono" else '2',
+        '-ar', str(profile["sample_rate"]),
+        '-c:a', profile["codec"],
+        '-b:a', str(profile["bit_rate"]),
+    ]
+    if tempo and tempo != 1.0:
+        cmd += ['-filter:a', f'atempo={tempo}']
+    if profile["format"] == "mp4":
+        # シークできないパイプ出力でもMP4を書き出せるようにする
+        cmd += ['-movflags', 'frag_keyframe+empty_moov']
+    cmd += ['-f', profile["format"], 'pipe:1']  # 標準出力へ書き出し
+
+    result = subprocess.run(cmd, input=audio_data, capture_output=True, timeout=ct.TRANSCODE_TIMEOUT)
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(result.stderr.decode('utf-8', errors='replace').strip() or "FFmpegの変換に失敗しました")
+    return result.stdout
+
+def transcode(audio_data, target, bit_rate=None, tempo=None):
+    """
+    音声データを指定の形式に変換（呼び出し元のスレッドで実行）
+    Args:
+        audio_data: 変換元の音声データ（bytes）
+        target: 変換先のプロファイル名（ct.TRANSCODE_PROFILESのキー）
+        bit_rate: プロファイルのビットレートを上書きする場合に指定（bps）
+        tempo: 再生速度を変える場合に指定（0.5〜2.0、音の高さは変えない）
+    Returns:
+        変換後の音声データ（bytes）
+    """
+
+    profile = ct.TRANSCODE_PROFILES[target]
+    if bit_rate:
+        profile = {**profile, "bit_rate": bit_rate}
+    if PYAV_AVAILABLE:
+        return _transcode_with_pyav(audio_data, profile, tempo)
+    if FFMPEG_PATH is not None:
+        return _transcode_with_ffmpeg(audio_data, profile, tempo)
+    raise RuntimeError("PyAVとFFmpegのどちらも利用できないため、音声を変換できません")
+
+def decode_to_pcm(audio_data, sample_rate):
+    """
+    MP3などの圧縮音声をモノラルのPCM（float32, -1.0〜1.0）にデコード
+    Args:
+        audio_data: 音声データ（bytes）
+        sample_rate: 出力のサンプリングレート
+    """
+
+    if PYAV_AVAILABLE:
+        resampler = av.AudioResampler(format='s16', layout='mono', rate=sample_rate)
+        chunks = []
+        with av.open(io.BytesIO(audio_data), 'r') as input_container:
+            for frame in input_container.decode(audio=0):
+                chunks.extend(f.to_ndarray().reshape(-1) for f in resampler.resample(frame))
+            chunks.extend(f.to_ndarray().reshape(-1) for f in resampler.resample(None))
+        pcm = np.concatenate(chunks) if chunks else np.empty(0, dtype=np.int16)
+    elif FFMPEG_PATH is not None:
+        # PyAVがない場合の最終手段（呼び出しごとにFFmpegのプロセスを起動する）
+        cmd = [
+            FFMPEG_PATH, '-hide_banner', '-loglevel', 'error',
+            '-i', 'pipe:0', '-vn', '-ac', '1', '-ar', str(sample_rate),
+            '-f', 's16le', 'pipe:1'
+        ]
+        result = subprocess.run(cmd, input=audio_data, capture_output=True, timeout=ct.TRANSCODE_TIMEOUT)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode('utf-8', errors='replace').strip() or "FFmpegのデコードに失敗しました")
+        pcm = np.frombuffer(result.stdout, dtype='<i2')
+    else:
+        raise RuntimeError("PyAVとFFmpegのどちらも利用できないため、音声をデコードできません")
+
+    return pcm.astype(np.float32) / 32768.0
+
+def submit_transcode(audio_data, target, bit_rate=None):
+    """
+    音声変換をワーカープールに投入
+    受付上限（ct.TRANSCODE_MAX_PENDING）に達している場合は空きが出るまで待機する
+    Returns:
+        変換結果（bytes）を返すFuture
+    """
+
+    _pending_slots.acquire()
+    try:
+        future = get_executor().submit(transcode, audio_data, target, bit_rate)
+    except Exception:
+        _pending_slots.release()
+        raise
+    future.add_done_callback(lambda _: _pending_slots.release())
+    return future
+
+def transcode_batch(audio_data_list, target):
+    """
+    複数の音声データをまとめて変換（ワーカープールで並列実行）
+    Returns:
+        入力と同じ順序の変換結果のリスト（失敗したものはNone）
+    """
+
+    futures = [submit_transcode(audio_data, target) for audio_data in audio_data_list]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result(timeout=ct.TRANSCODE_TIMEOUT))
+        except Exception as e:
+            print(f"Warning: 音声変換に失敗しました: {e}")
+            results.append(None)
+    return results
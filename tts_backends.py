@@ -0,0 +1,258 @@
+import io
+import os
+import shutil
+import statistics
+import subprocess
+import threading
+import time
+import wave
+from abc import ABC, abstractmethod
+# ローカル音声合成用（未インストールの場合はOpenAI APIまたはeSpeakを利用）
+try:
+    from piper.voice import PiperVoice
+    PIPER_AVAILABLE = True
+except ImportError:
+    PIPER_AVAILABLE = False
+import constants as ct
+import settings
+import transcoder
+
+# eSpeak NGの場所はプロセス起動時に一度だけ確認する
+ESPEAK_PATH = shutil.which('espeak-ng') or shutil.which('espeak')
+
+# Piperの音声モデルはプロセス内で一度だけ読み込み、全セッションで共有する
+_piper_voices = {}
+_piper_voices_lock = threading.Lock()
+
+class SpeechAudio:
+    """
+    音声合成結果（OpenAIのレスポンスと同じく .content で音声データを参照できる）
+    """
+
+    def __init__(self, content, audio_format):
+        self.content = content
+        self.format = audio_format
+
+class TTSBackend(ABC):
+    """
+    音声合成バックエンドの基底クラス
+    """
+
+    name = ""
+
+    @abstractmethod
+    def synthesize(self, text):
+        """
+        テキストから音声データを生成
+        Returns:
+            SpeechAudio（.content に音声データ、.format に "mp3" / "wav" などの形式）
+        """
+
+    def synthesize_stream(self, text):
+        """
+        音声データを生成されたそばから少しずつ返す（ストリーミング再生用）
+        対応していないバックエンドは、合成が終わってからまとめて1チャンクで返す
+        Returns:
+            (形式, 音声データのチャンクのイテレータ)
+        """
+        speech_audio = self.synthesize(text)
+        return speech_audio.format, iter([speech_audio.content])
+
+class OpenAITTSBackend(TTSBackend):
+    """
+    OpenAI TTS APIによる音声合成
+    """
+
+    name = "openai"
+
+    def __init__(self, client, model=ct.OPENAI_TTS_MODEL, voice=ct.OPENAI_TTS_VOICE, response_format="mp3"):
+        self.client = client
+        self.model = model
+        self.voice = voice
+        self.response_format = response_format
+
+    def synthesize(self, text):
+        response = self.client.audio.speech.create(
+            model=self.model,
+            voice=self.voice,
+            input=text,
+            response_format=self.response_format
+        )
+        return SpeechAudio(response.content, self.response_format)
+
+    def synthesize_stream(self, text):
+        def chunks():
+            with self.client.audio.speech.with_streaming_response.create(
+                model=self.model,
+                voice=self.voice,
+                input=text,
+                response_format=self.response_format
+            ) as response:
+                yield from response.iter_bytes(ct.AUDIO_STREAM_CHUNK_SIZE)
+        return self.response_format, chunks()
+
+class PiperTTSBackend(TTSBackend):
+    """
+    Piper（ONNX音声モデル）によるCPU上のローカル音声合成
+    """
+
+    name = "piper"
+
+    def __init__(self, voice_path=None):
+        self.voice = load_piper_voice(voice_path or settings.get_settings().piper_voice_path)
+
+    def synthesize(self, text):
+        # 一時ファイルを使わずメモリ上でWAVを生成
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav_file:
+            if hasattr(self.voice, 'synthesize_wav'):
+                self.voice.synthesize_wav(text, wav_file)
+            else:
+                self.voice.synthesize(text, wav_file)
+        return SpeechAudio(buffer.getvalue(), "wav")
+
+class ESpeakTTSBackend(TTSBackend):
+    """
+    eSpeak NGによるローカル音声合成（WAVを標準出力から受け取る）
+    """
+
+    name = "espeak"
+
+    def __init__(self, voice=None):
+        if ESPEAK_PATH is None:
+            raise RuntimeError("eSpeak NGが見つからないため、ローカル音声合成は利用できません")
+        self.voice = voice or settings.get_settings().espeak_voice
+
+    def synthesize(self, text):
+        result = subprocess.run(
+            [ESPEAK_PATH, '-v', self.voice, '--stdout', text],
+            capture_output=True,
+            timeout=30
+        )
+        if result.returncode != 0 or not result.stdout:
+            raise RuntimeError(result.stderr.decode('utf-8', errors='replace').strip() or "eSpeakの音声合成に失敗しました")
+        return SpeechAudio(result.stdout, "wav")
+
+def load_piper_voice(voice_path):
+    """
+    Piperの音声モデルを読み込み（同じモデルはプロセス内で共有）
+    """
+
+    if not PIPER_AVAILABLE:
+        raise RuntimeError("piper-ttsがインストールされていないため、ローカル音声合成は利用できません")
+
+    with _piper_voices_lock:
+        if voice_path not in _piper_voices:
+            if not os.path.exists(voice_path):
+                raise RuntimeError(f"Piperの音声モデルが見つかりません: {voice_path}")
+            _piper_voices[voice_path] = PiperVoice.load(voice_path)
+        return _piper_voices[voice_path]
+
+def get_backend_name(purpose=None):
+    """
+    用途に応じて使用するバックエンド名を決定
+    """
+
+    return settings.get_settings().tts_backend_for(purpose)
+
+def get_tts_backend(openai_client, purpose=None, response_format="mp3"):
+    """
+    設定に応じた音声合成バックエンドを取得
+    ローカルが指定されていても利用できない場合はOpenAI APIを使用する
+    Args:
+        openai_client: OpenAIのクライアント
+        purpose: 用途（"problem" / "conversation"）
+        response_format: OpenAI APIに要求する形式（ローカルのバックエンドは常にWAV）
+    """
+
+    backend_name = get_backend_name(purpose)
+    try:
+        if backend_name == "piper":
+            return PiperTTSBackend()
+        if backend_name == "espeak":
+            return ESpeakTTSBackend()
+    except Exception as e:
+        print(f"Warning: ローカル音声合成の初期化に失敗したため、OpenAI APIを使用します: {e}")
+
+    config = settings.get_settings()
+    return OpenAITTSBackend(openai_client, config.openai_tts_model, config.openai_tts_voice, response_format)
+
+def plan_output_format(output_format):
+    """
+    出力形式に応じて、APIに要求する形式とローカルで変換するかを決める
+    変換できる場合はWAVで受け取って1回だけ指定のビットレートで圧縮し、
+    できない場合はAPIに出力形式を直接要求する（ビットレートはAPIの既定値）
+    Returns:
+        (response_format, encode_locally)
+    """
+
+    if output_format not in ct.TTS_OUTPUT_PROFILES:
+        return "mp3", False
+    if transcoder.is_available():
+        return "wav", True
+    return output_format, False
+
+def encode_output(speech_audio, output_format, bit_rate=None):
+    """
+    音声合成の結果を出力形式に圧縮（変換に失敗した場合は元の音声を返す）
+    """
+
+    profile = ct.TTS_OUTPUT_PROFILES.get(output_format)
+    if profile is None or speech_audio.format == output_format:
+        return speech_audio
+    try:
+        content = transcoder.submit_transcode(speech_audio.content, profile, bit_rate).result(timeout=ct.TRANSCODE_TIMEOUT)
+    except Exception as e:
+        print(f"Warning: 音声合成の結果を{output_format}に変換できませんでした: {e}")
+        return speech_audio
+    return SpeechAudio(content, output_format)
+
+def compare_latency(backends, texts, repeat=3):
+    """
+    複数の音声合成バックエンドのレイテンシを比較
+    Args:
+        backends: 比較するバックエンドのリスト
+        texts: 合成するテキストのリスト
+        repeat: 各テキストの合成回数
+    Returns:
+        バックエンド名ごとの統計情報（中央値・p95・平均バイト数）
+    """
+
+    results = {}
+    for backend in backends:
+        durations = []
+        sizes = []
+        for text in texts:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                speech_audio = backend.synthesize(text)
+                durations.append(time.perf_counter() - start)
+                sizes.append(len(speech_audio.content))
+        durations.sort()
+        results[backend.name] = {
+            "median_sec": statistics.median(durations),
+            "p95_sec": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+            "avg_bytes": statistics.mean(sizes),
+        }
+    return results
+
+if __name__ == "__main__":
+    # 利用可能なバックエンドで問題文程度の長さの英文を合成し、レイテンシを比較
+    sample_texts = [
+        "Could you send me the report by the end of the day?",
+        "I'm so glad we finally got to catch up over coffee.",
+        "Let's grab lunch together sometime next week if you're free.",
+    ]
+    backends = []
+    config = settings.get_settings()
+    if config.has_valid_api_key:
+        from openai import OpenAI
+        backends.append(OpenAITTSBackend(OpenAI(api_key=config.openai_api_key), config.openai_tts_model, config.openai_tts_voice))
+    for backend_class in (PiperTTSBackend, ESpeakTTSBackend):
+        try:
+            backends.append(backend_class())
+        except Exception as e:
+            print(f"{backend_class.name}: 利用できません（{e}）")
+
+    for name, stats in compare_latency(backends, sample_texts).items():
+        print(f"{name}: 中央値 {stats['median_sec'] * 1000:.0f}ms, p95 {stats['p95_sec'] * 1000:.0f}ms, 平均 {stats['avg_bytes']:.0f} bytes")
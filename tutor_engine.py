@@ -0,0 +1,231 @@
+"""
+Streamlitに依存しない英会話チューターの処理（会話・出題・評価・文字起こし・音声合成）
+学習者ごとの状態（会話メモリとChain）はTutorStateとして明示的に受け渡すため、
+画面（functions.py）・バックエンドサービス（backend_server.py）・バッチ処理・ベンチマークから同じ処理を呼び出せる
+
+API呼び出しはレート制限（rate_limiter）を守って実行する（上限到達時は待機、429エラー時は再試行）
+呼び出し元で枠を予約済みの場合は reserved=True を渡す
+"""
+import threading
+import time
+from openai import OpenAI
+from langchain.chains import ConversationChain
+from langchain.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+)
+from langchain.schema import HumanMessage, SystemMessage
+from langchain_openai import ChatOpenAI
+import constants as ct
+import settings
+import conversation_memory
+import batch_evaluation
+import llm_usage
+import rate_limiter
+import stt_backends
+import tts_backends
+
+def api_model_of(backend):
+    """
+    音声合成・文字起こしバックエンドが使うOpenAIのモデル名（ローカルの場合はNone）
+    """
+
+    return backend.model if backend.name == "openai" else None
+
+class TutorState:
+    """
+    学習者ごとの状態（会話メモリとシステムプロンプトごとのChain）
+    """
+
+    def __init__(self, memory):
+        self.memory = memory
+        self.chains = {}
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+class EnglishTutorEngine:
+    """
+    OpenAIクライアントとチャットモデルを持ち、状態（TutorState）を受け取って処理を行う
+    エンジン自体は学習者ごとの状態を持たないため、複数のセッション・スレッドで共有できる
+    """
+
+    def __init__(self, openai_obj, llm):
+        self.openai_obj = openai_obj
+        self.llm = llm
+
+    @classmethod
+    def from_settings(cls, config=None):
+        """
+        設定（settings.py）のAPIキー・モデル名でエンジンを作成
+        """
+
+        config = config or settings.get_settings()
+        llm = ChatOpenAI(
+            api_key=config.openai_api_key,
+            model=config.openai_chat_model,
+            temperature=config.chat_temperature,
+            callbacks=[llm_usage.USAGE_HANDLER]
+        )
+        return cls(OpenAI(api_key=config.openai_api_key), llm)
+
+    def new_state(self):
+        """
+        空の会話メモリを持つ状態を作成
+        """
+
+        memory = conversation_memory.TokenCountingSummaryBufferMemory(
+            llm=self.llm,
+            max_token_limit=settings.get_settings().memory_max_token_limit,
+            return_messages=True
+        )
+        return TutorState(memory)
+
+    def get_chain(self, state, system_template):
+        """
+        システムプロンプトごとのChain（会話メモリは状態の中で共有し、Chainは一度だけ作成）
+        """
+
+        if system_template not in state.chains:
+            prompt = ChatPromptTemplate.from_messages([
+                SystemMessage(content=system_template),
+                MessagesPlaceholder(variable_name="history"),
+                HumanMessagePromptTemplate.from_template("{input}")
+            ])
+            state.chains[system_template] = ConversationChain(
+                llm=self.llm,
+                memory=state.memory,
+                prompt=prompt
+            )
+        return state.chains[system_template]
+
+    def predict(self, state, system_template, text, reserved=False):
+        """
+        システムプロンプトごとのChainで回答を生成（同じ状態への呼び出しは順に実行）
+        """
+
+        with state.lock:
+            state.last_used = time.time()
+            return rate_limiter.get_rate_limiter().call(
+                settings.get_settings().openai_chat_model,
+                self.get_chain(state, system_template).predict,
+                kwargs={"input": text},
+                tokens=ct.RATE_LIMIT_CHAT_TOKENS,
+                reserved=reserved
+            )
+
+    def invoke(self, system_template, text, reserved=False):
+        """
+        会話メモリを使わずに、システムプロンプトと入力だけで回答を生成
+        """
+
+        messages = [SystemMessage(content=system_template), HumanMessage(content=text)]
+        return rate_limiter.get_rate_limiter().call(
+            settings.get_settings().openai_chat_model,
+            self.llm.invoke,
+            args=(messages,),
+            tokens=ct.RATE_LIMIT_CHAT_TOKENS,
+            reserved=reserved
+        ).content
+
+    def converse(self, state, text, reserved=False):
+        """
+        日常英会話の回答を生成
+        """
+
+        return self.predict(state, ct.SYSTEM_TEMPLATE_BASIC_CONVERSATION, text, reserved)
+
+    def next_problem(self, state=None, recent_problems=None, reserved=False):
+        """
+        問題文を生成
+        stateを省略した場合は会話メモリを使わずに生成する（評価と同時に実行する先読み用）
+        その場合、同じ問題文を繰り返さないよう、最近の問題文（recent_problems）を避けるよう指示する
+        """
+
+        if state is not None:
+            return self.predict(state, ct.SYSTEM_TEMPLATE_CREATE_PROBLEM, "", reserved)
+        text = ""
+        if recent_problems:
+            text = ct.PROBLEM_AVOID_TEMPLATE.format(recent_problems="\n".join(f"- {problem}" for problem in recent_problems))
+        return self.invoke(ct.SYSTEM_TEMPLATE_CREATE_PROBLEM, text, reserved)
+
+    def evaluate(self, problem, answer, reserved=False):
+        """
+        問題文と回答を比較した評価を生成（会話メモリは使わず、評価の指示と問題文・回答だけを渡す）
+        """
+
+        evaluation_input = ct.EVALUATION_INPUT_TEMPLATE.format(llm_text=problem, user_text=answer)
+        return self.invoke(ct.SYSTEM_TEMPLATE_EVALUATION, evaluation_input, reserved)
+
+    def evaluate_set(self, items, reserved=False):
+        """
+        ディクテーションのセットをまとめて評価（会話メモリは使わない）
+        Returns:
+            (問題ごとのフィードバックのリスト, 総評)
+        """
+
+        return rate_limiter.get_rate_limiter().call(
+            settings.get_settings().openai_chat_model,
+            batch_evaluation.evaluate_set,
+            args=(self.llm, items),
+            tokens=batch_evaluation.estimate_set_tokens(items),
+            reserved=reserved
+        )
+
+    def speech_backend(self, purpose=None, output_format="mp3", streaming=False):
+        """
+        用途ごとの音声合成バックエンド（mp3以外は、可能ならWAVで受け取ってからローカルで圧縮する）
+        ストリーミングでは受け取ったそばから配信するため変換せず、APIに出力形式を直接要求する
+        """
+
+        if streaming:
+            response_format = output_format if output_format in ct.AUDIO_MIME_TYPES else "mp3"
+        else:
+            response_format, _ = tts_backends.plan_output_format(output_format)
+        return tts_backends.get_tts_backend(self.openai_obj, purpose, response_format)
+
+    def synthesize(self, text, purpose=None, output_format="mp3", bit_rate=None, reserved=False):
+        """
+        テキストを音声データに変換（ローカル合成に失敗した場合はOpenAI APIで合成）
+        Returns:
+            (speech_audio, source_size): 音声合成結果と、ローカルで圧縮する前のバイト数
+        """
+
+        response_format, encode_locally = tts_backends.plan_output_format(output_format)
+        backend = tts_backends.get_tts_backend(self.openai_obj, purpose, response_format)
+        limiter = rate_limiter.get_rate_limiter()
+        try:
+            speech_audio = limiter.call(api_model_of(backend), backend.synthesize, args=(text,), reserved=reserved)
+        except Exception as e:
+            if backend.name == "openai":
+                raise
+            print(f"Warning: ローカル音声合成に失敗したため、OpenAI APIを使用します: {e}")
+            config = settings.get_settings()
+            fallback = tts_backends.OpenAITTSBackend(self.openai_obj, config.openai_tts_model, config.openai_tts_voice, response_format)
+            speech_audio = limiter.call(fallback.model, fallback.synthesize, args=(text,))
+        source_size = len(speech_audio.content)
+        if encode_locally:
+            speech_audio = tts_backends.encode_output(speech_audio, output_format, bit_rate)
+        return speech_audio, source_size
+
+    def transcription_backend(self, mode=None):
+        """
+        モードごとの文字起こしバックエンド
+        """
+
+        return stt_backends.get_stt_backend(self.openai_obj, mode)
+
+    def transcribe(self, audio_data, file_name="audio.wav", mode=None, language="en", word_timestamps=False, reserved=False):
+        """
+        音声データを文字起こし（OpenAI APIに失敗した場合はローカルで文字起こし）
+        """
+
+        backend = self.transcription_backend(mode)
+        kwargs = {"file_name": file_name, "language": language, "word_timestamps": word_timestamps}
+        try:
+            return rate_limiter.get_rate_limiter().call(api_model_of(backend), backend.transcribe, args=(audio_data,), kwargs=kwargs, reserved=reserved)
+        except Exception as e:
+            if backend.name == "local" or not stt_backends.is_local_available():
+                raise
+            print(f"Warning: OpenAI APIでの文字起こしに失敗したため、ローカルで文字起こしします: {e}")
+            return stt_backends.LocalWhisperBackend().transcribe(audio_data, **kwargs)
@@ -0,0 +1,193 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import constants as ct
+import settings
+
+# 文字起こし結果のメモリキャッシュ（録音のハッシュ → (text, word_timings)）
+_cache = OrderedDict()
+_cache_limit = (None, ct.TRANSCRIPT_CACHE_SIZE)  # (上限を読み込んだ設定, 保持する件数)
+_cache_lock = threading.Lock()
+_evict_lock = threading.Lock()
+
+class WordTimings:
+    """
+    単語ごとの開始・終了時刻（秒）を配列で保持するクラス
+    時刻は元の録音ではなく、文字起こしに送った前処理済みの音声（無音トリミング後）の先頭からの秒数
+    （前処理済みの音声は clip_path() で録音のハッシュから参照できる）
+    """
+
+    def __init__(self, words, starts, ends):
+        self.words = list(words)
+        self.starts = np.asarray(starts, dtype=np.float32)
+        self.ends = np.asarray(ends, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.words)
+
+    @classmethod
+    def from_words(cls, words):
+        """
+        .word / .start / .end 属性を持つ単語のリスト（APIやfaster-whisperの結果）から作成
+        """
+
+        words = list(words or [])
+        return cls(
+            [word.word.strip() for word in words],
+            [word.start for word in words],
+            [word.end for word in words]
+        )
+
+    def segment(self, start_index, end_index):
+        """
+        start_index番目からend_index番目（含まない）までの単語の時間範囲（秒）
+        """
+
+        return float(self.starts[start_index]), float(self.ends[end_index - 1])
+
+    def pauses(self, min_pause_sec=ct.LONG_PAUSE_SEC):
+        """
+        単語間の間がmin_pause_sec以上の箇所
+        Returns:
+            (直前の単語のインデックス, 間の長さ) のリスト
+        """
+
+        gaps = self.starts[1:] - self.ends[:-1]
+        return [(int(index), float(gaps[index])) for index in np.flatnonzero(gaps >= min_pause_sec)]
+
+    def words_per_minute(self):
+        """
+        最初の単語から最後の単語までの発話速度（WPM）
+        """
+
+        if len(self) < 2:
+            return 0.0
+        duration = float(self.ends[-1] - self.starts[0])
+        return len(self) / duration * 60 if duration > 0 else 0.0
+
+def recording_hash(audio_data):
+    """
+    録音データのハッシュ（キャッシュのキー）
+    """
+
+    return hashlib.sha1(audio_data).hexdigest()
+
+def _cache_file_path(audio_hash):
+    return os.path.join(ct.TRANSCRIPT_CACHE_DIR, f"{audio_hash}.npz")
+
+def _clip_file_path(audio_hash):
+    return os.path.join(ct.TRANSCRIPT_CACHE_DIR, f"{audio_hash}.wav")
+
+def clip_path(audio_hash):
+    """
+    単語ごとの時刻の基準となる前処理済みの音声ファイルのパス（保存されていない場合はNone）
+    """
+
+    file_path = _clip_file_path(audio_hash)
+    return file_path if os.path.exists(file_path) else None
+
+def _cache_size():
+    # 設定が再読み込みされた場合のみ上限を読み直す
+    global _cache_limit
+    config = settings.get_settings()
+    if _cache_limit[0] is not config:
+        _cache_limit = (config, config.transcript_cache_size)
+    return _cache_limit[1]
+
+def _remember(audio_hash, entry):
+    cache_size = _cache_size()
+    with _cache_lock:
+        _cache[audio_hash] = entry
+        _cache.move_to_end(audio_hash)
+        while len(_cache) > cache_size:
+            _cache.popitem(last=False)
+
+def load_cached_transcript(audio_hash):
+    """
+    キャッシュから文字起こし結果を取得（メモリ → ディスクの順に確認）
+    Args:
+        audio_hash: 録音のハッシュ
+    Returns:
+        (text, word_timings)（キャッシュにない場合はNone）
+    """
+
+    with _cache_lock:
+        if audio_hash in _cache:
+            _cache.move_to_end(audio_hash)
+            return _cache[audio_hash]
+
+    file_path = _cache_file_path(audio_hash)
+    if not os.path.exists(file_path):
+        return None
+
+    try:
+        with np.load(file_path) as data:
+            word_timings = None
+            if bool(data["has_timings"]):
+                word_timings = WordTimings(data["words"].tolist(), data["starts"], data["ends"])
+            entry = (str(data["text"]), word_timings)
+        # 使われたファイルを削除の対象から遠ざける（更新時刻の古い順に削除するため）
+        os.utime(file_path)
+    except Exception as e:
+        print(f"Warning: 文字起こしキャッシュの読み込みに失敗しました: {e}")
+        return None
+
+    _remember(audio_hash, entry)
+    return entry
+
+def save_cached_transcript(audio_hash, text, word_timings=None, clip=None):
+    """
+    文字起こし結果を録音のハッシュと対応付けてメモリとディスクに保存
+    Args:
+        clip: 文字起こしに送った前処理済みの音声（WAV）。単語ごとの時刻がある場合のみ、時刻の基準として一緒に保存する
+    """
+
+    _remember(audio_hash, (text, word_timings))
+
+    try:
+        os.makedirs(ct.TRANSCRIPT_CACHE_DIR, exist_ok=True)
+        np.savez(
+            _cache_file_path(audio_hash),
+            text=np.array(text),
+            has_timings=np.array(word_timings is not None),
+            words=np.array(word_timings.words if word_timings else [], dtype=str),
+            starts=word_timings.starts if word_timings else np.empty(0, dtype=np.float32),
+            ends=word_timings.ends if word_timings else np.empty(0, dtype=np.float32)
+        )
+        if word_timings is not None and clip:
+            with open(_clip_file_path(audio_hash), 'wb') as clip_file:
+                clip_file.write(clip)
+        _evict_files()
+    except Exception as e:
+        print(f"Warning: 文字起こしキャッシュの保存に失敗しました: {e}")
+
+def _evict_files():
+    # 上限を超えた分を更新時刻の古い順に削除
+    with _evict_lock:
+        entries = [entry for entry in os.scandir(ct.TRANSCRIPT_CACHE_DIR) if entry.is_file() and entry.name.endswith(".npz")]
+        if len(entries) <= ct.TRANSCRIPT_CACHE_MAX_FILES:
+            return
+        entries.sort(key=lambda entry: entry.stat().st_mtime)
+        for entry in entries[:len(entries) - ct.TRANSCRIPT_CACHE_MAX_FILES]:
+            # 単語ごとの時刻の基準となる音声も一緒に削除する
+            for file_path in (entry.path, _clip_file_path(entry.name[:-len(".npz")])):
+                try:
+                    os.remove(file_path)
+                except OSError:
+                    pass
+
+def format_word_timings(word_timings):
+    """
+    単語のタイミング情報（発話速度・長いポーズ）を画面表示用のMarkdownに整形
+    """
+
+    lines = [f"- 発話速度: {word_timings.words_per_minute():.0f} WPM"]
+    pauses = word_timings.pauses()
+    if pauses:
+        pause_texts = [f"「{word_timings.words[index]}」の後（{gap:.1f}秒）" for index, gap in pauses]
+        lines.append(f"- 長い間（{ct.LONG_PAUSE_SEC}秒以上）: " + "、".join(pause_texts))
+    else:
+        lines.append("- 長い間: なし（スムーズに話せています）")
+    return "\n".join(lines)
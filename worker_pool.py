@@ -0,0 +1,207 @@
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+import constants as ct
+import settings
+
+INTERACTIVE = "interactive"  # 学習者が結果を待っている処理（会話の返答・問題文生成・文字起こしなど）
+PREFETCH = "prefetch"  # 学習者が次に待つ処理の先読み（次の問題文など、backgroundより先に実行）
+BACKGROUND = "background"  # 学習者を待たせない処理（要約・再生速度ごとの音声の変換など）
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class Job:
+    """
+    投入した処理のハンドル（Futureとキャンセル用のフラグ）
+    """
+
+    def __init__(self, lane, tag):
+        self.lane = lane
+        self.tag = tag
+        self.future = None
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        """
+        処理をキャンセル（実行開始前の処理のみ中止できる）
+        """
+
+        self.cancel_event.set()
+        return self.future.cancel()
+
+    def result(self, timeout=ct.WORKER_POOL_TIMEOUT):
+        return self.future.result(timeout=timeout)
+
+class Lane:
+    """
+    レーンごとのワーカーと統計情報
+    """
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"pool-{name}")
+        self.queued = 0  # 実行待ちの件数
+        self.running = 0  # 実行中の件数
+        self.completed = 0
+        self.cancelled = 0
+        self.failed = 0
+        self.total_wait_sec = 0.0  # 実行待ち時間の合計
+
+class WorkerPool:
+    """
+    プロセス全体で共有するAPI処理用のワーカープール
+    interactive → prefetch → background の順に優先し、優先度の高いレーンに待ちがある間は低いレーンの処理を始めない
+    """
+
+    def __init__(self, interactive_workers, prefetch_workers, background_workers, max_in_flight):
+        self.lanes = {
+            INTERACTIVE: Lane(INTERACTIVE, interactive_workers),
+            PREFETCH: Lane(PREFETCH, prefetch_workers),
+            BACKGROUND: Lane(BACKGROUND, background_workers),
+        }
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.jobs = set()
+        self.condition = threading.Condition()
+
+    def _acquire_slot(self, lane, job):
+        # 全体の上限に空きがあり、優先度の高いレーンの待ちがなくなるまで待機
+        with self.condition:
+            while self.in_flight >= self.max_in_flight or self._has_priority_queued(lane):
+                if job.cancel_event.is_set():
+                    return False
+                self.condition.wait(timeout=0.5)
+            if job.cancel_event.is_set():
+                return False
+            self.in_flight += 1
+            lane.queued -= 1
+            lane.running += 1
+            return True
+
+    def _has_priority_queued(self, lane):
+        # 優先度の高いレーン（self.lanesの並び順で前のもの）に実行待ちがあるか
+        for name, other in self.lanes.items():
+            if name == lane.name:
+                return False
+            if other.queued > 0:
+                return True
+        return False
+
+    def _run(self, job, submitted_at, fn, args, kwargs):
+        lane = self.lanes[job.lane]
+        if not self._acquire_slot(lane, job):
+            with self.condition:
+                lane.queued -= 1
+                lane.cancelled += 1
+                self.condition.notify_all()
+            raise CancelledError()
+
+        wait_sec = time.perf_counter() - submitted_at
+        succeeded = False
+        try:
+            result = fn(*args, **kwargs)
+            succeeded = True
+            return result
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                lane.running -= 1
+                lane.total_wait_sec += wait_sec
+                if succeeded:
+                    lane.completed += 1
+                else:
+                    lane.failed += 1
+                self.condition.notify_all()
+
+    def submit(self, lane_name, fn, *args, tag=None, **kwargs):
+        """
+        処理をレーンに投入
+        Args:
+            lane_name: INTERACTIVE / PREFETCH / BACKGROUND
+            fn: 実行する関数（Streamlitの画面操作やst.session_stateへのアクセスは不可）
+            tag: キャンセル用の識別子（セッションIDなど）
+        Returns:
+            Job
+        """
+
+        lane = self.lanes[lane_name]
+        job = Job(lane_name, tag)
+        with self.condition:
+            lane.queued += 1
+            self.jobs.add(job)
+        job.future = lane.executor.submit(self._run, job, time.perf_counter(), fn, args, kwargs)
+        job.future.add_done_callback(lambda _: self._forget(job))
+        return job
+
+    def _forget(self, job):
+        with self.condition:
+            self.jobs.discard(job)
+            # ワーカーが受け取る前にキャンセルされた処理は待ち件数から除く
+            if job.future.cancelled():
+                self.lanes[job.lane].queued -= 1
+                self.lanes[job.lane].cancelled += 1
+            self.condition.notify_all()
+
+    def run(self, lane_name, fn, *args, tag=None, timeout=ct.WORKER_POOL_TIMEOUT, **kwargs):
+        """
+        処理を投入して結果を待つ（呼び出し元のスレッドはブロックされる）
+        """
+
+        return self.submit(lane_name, fn, *args, tag=tag, **kwargs).result(timeout=timeout)
+
+    def cancel(self, tag=None, lane_name=None):
+        """
+        未完了の処理をまとめてキャンセル
+        Args:
+            tag: 指定した識別子の処理のみ対象にする
+            lane_name: 指定したレーンの処理のみ対象にする
+        Returns:
+            キャンセルを要求した件数
+        """
+
+        with self.condition:
+            targets = [
+                job for job in self.jobs
+                if (tag is None or job.tag == tag) and (lane_name is None or job.lane == lane_name)
+            ]
+        for job in targets:
+            job.cancel()
+        return len(targets)
+
+    def metrics(self):
+        """
+        レーンごとの待ち件数・実行中の件数などの統計情報
+        """
+
+        with self.condition:
+            return {
+                name: {
+                    "queued": lane.queued,
+                    "running": lane.running,
+                    "max_workers": lane.max_workers,
+                    "completed": lane.completed,
+                    "cancelled": lane.cancelled,
+                    "failed": lane.failed,
+                    "avg_wait_ms": lane.total_wait_sec / max(lane.completed + lane.failed, 1) * 1000,
+                }
+                for name, lane in self.lanes.items()
+            }
+
+def get_worker_pool():
+    """
+    プロセス全体で共有するワーカープールを取得（初回のみ作成）
+    """
+
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            config = settings.get_settings()
+            _pool = WorkerPool(
+                config.worker_pool_interactive_workers,
+                config.worker_pool_prefetch_workers,
+                config.worker_pool_background_workers,
+                config.worker_pool_max_in_flight
+            )
+    return _pool